@@ -6,15 +6,32 @@ Shopify 日志与 Cookie 状态 API 服务
 接口列表:
   GET  /api/shopify/daily-stats           查询任务执行日志统计（支持按日期/范围筛选）
   POST /api/shopify/cookie-status/report  上报 Cookie 状态（供本地 PyCharm 调用）
+  POST /api/shopify/cookie-status/report/batch  批量上报 Cookie 状态
   GET  /api/shopify/cookie-status         查询最新 Cookie 状态
+  GET  /api/shopify/task-log              查询任务日志明细（游标分页 / NDJSON 流式导出）
+  GET  /api/shopify/cookie-status/history 查询 Cookie 状态历史（游标分页 / NDJSON 流式导出）
+  GET  /api/shopify/stage-latency         各阶段耗时 p50/p95/p99 与按小时吞吐量
+  POST /api/shopify/metrics/report        worker 上报阶段耗时直方图快照
+  GET  /metrics                           各 worker 阶段耗时（Prometheus 文本格式）
+  GET  /api/shopify/workers               在线 worker 及其正在处理的任务（租约）
+  POST /api/shopify/tasks/notify          通知有新任务（报价系统调用）
+  GET  /api/shopify/tasks/wait            worker 长轮询等待新任务通知
 
 运行方式:
   python api_server.py
 """
 
-import pymysql
-from datetime import datetime, date
-from flask import Flask, request, jsonify
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, date, timedelta
+from functools import wraps
+from flask import Flask, request, jsonify, Response, stream_with_context
+
+from metrics import Histogram, render_prometheus
+from storage import MySQLStorage
 
 app = Flask(__name__)
 
@@ -32,8 +49,22 @@ DB_CONFIG = {
 }
 
 
+# 默认连接生产 MySQL；压测 / 离线调试时可用 use_storage(SQLiteStorage(...)) 替换，
+# 见 storage.py 与 load_test_api.py
+storage = MySQLStorage(DB_CONFIG)
+
+
+def use_storage(new_storage):
+    """切换存储后端，并清空依赖旧后端的进程内状态"""
+    global storage
+    storage = new_storage
+    _compacted_days.clear()
+    response_cache.clear()
+    task_signal.reset()
+
+
 def get_conn():
-    return pymysql.connect(**DB_CONFIG, cursorclass=pymysql.cursors.DictCursor)
+    return storage.get_conn()
 
 
 # ============================================================
@@ -48,6 +79,97 @@ def err(msg="error", code=400):
     return jsonify({"code": code, "msg": msg, "data": None}), code
 
 
+# ============================================================
+# 响应缓存（TTL + ETag）
+#
+# 监控每隔几秒轮询 daily-stats / cookie-status，短 TTL 缓存可避免重复查库；
+# 缓存键只包含接口实际读取的查询参数，其他参数（如防缓存的时间戳）不产生新条目；
+# 条目数超过 RESPONSE_CACHE_MAX_ENTRIES 时先清理过期条目，再按最近最少使用淘汰。
+# cookie_report 写入时清空 cookie-status 缓存。
+# ============================================================
+
+DAILY_STATS_CACHE_TTL   = 10   # 秒
+COOKIE_STATUS_CACHE_TTL = 30   # 秒
+RESPONSE_CACHE_ENABLED  = True   # 压测时可关闭，测量直接查库的延迟
+RESPONSE_CACHE_MAX_ENTRIES = 256
+
+
+class TTLCache:
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()    # key -> (expires_at, body, etag)，按最近使用排序
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1], entry[2]
+
+    def set(self, key, body: bytes, etag: str, ttl: float):
+        with self._lock:
+            self._data[key] = (time.time() + ttl, body, etag)
+            self._data.move_to_end(key)
+            if len(self._data) > self.max_entries:
+                now = time.time()
+                for k in [k for k, entry in self._data.items() if entry[0] <= now]:
+                    del self._data[k]
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def invalidate(self, namespace: str):
+        with self._lock:
+            for key in [k for k in self._data if k[0] == namespace]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+response_cache = TTLCache()
+
+
+def _cache_key(namespace: str, params: tuple):
+    """按接口读取参数的方式（request.args.get 取原值）组成键，保证同键的请求得到同样的响应"""
+    return namespace, tuple(request.args.get(name) for name in params)
+
+
+def _conditional_response(body: bytes, etag: str, ttl: float):
+    resp = Response(body, mimetype="application/json")
+    resp.set_etag(etag)
+    resp.headers["Cache-Control"] = f"max-age={int(ttl)}"
+    return resp.make_conditional(request)
+
+
+def cached_response(namespace: str, ttl: float, params: tuple = ()):
+    """缓存成功(200)的 JSON 响应，并支持 If-None-Match → 304；params 为接口读取的查询参数名"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not RESPONSE_CACHE_ENABLED:
+                return fn(*args, **kwargs)
+            key = _cache_key(namespace, params)
+            hit = response_cache.get(key)
+            if hit is not None:
+                return _conditional_response(hit[0], hit[1], ttl)
+
+            resp = app.make_response(fn(*args, **kwargs))
+            if resp.status_code != 200:
+                return resp
+            body = resp.get_data()
+            etag = hashlib.md5(body).hexdigest()
+            response_cache.set(key, body, etag, ttl)
+            return _conditional_response(body, etag, ttl)
+        return wrapper
+    return decorator
+
+
 def parse_date_param(val: str, param_name: str):
     """将字符串解析为 date 对象，格式 YYYY-MM-DD"""
     try:
@@ -56,6 +178,85 @@ def parse_date_param(val: str, param_name: str):
         return None
 
 
+DATE_RANGE_PARAMS = ("date", "start_date", "end_date")   # parse_date_range 读取的参数
+
+
+def parse_date_range():
+    """
+    解析 date 或 start_date/end_date 参数。
+    返回 (start_d, end_d, 错误信息)；均未传时返回 (None, None, None)。
+    """
+    date_str       = request.args.get("date")
+    start_date_str = request.args.get("start_date")
+    end_date_str   = request.args.get("end_date")
+
+    if date_str:
+        d = parse_date_param(date_str, "date")
+        if d is None:
+            return None, None, "date 格式错误，请使用 YYYY-MM-DD"
+        return d, d, None
+    if start_date_str or end_date_str:
+        start_d = parse_date_param(start_date_str, "start_date")
+        end_d   = parse_date_param(end_date_str,   "end_date")
+        if start_d is None or end_d is None:
+            return None, None, "start_date / end_date 格式错误，请使用 YYYY-MM-DD"
+        if start_d > end_d:
+            return None, None, "start_date 不能晚于 end_date"
+        return start_d, end_d, None
+    return None, None, None
+
+
+def _daterange(start_d: date, end_d: date):
+    d = start_d
+    while d <= end_d:
+        yield d
+        d += timedelta(days=1)
+
+
+# ============================================================
+# 每日统计汇总表（shopify_task_log_daily）
+#
+# 历史日期的日志不会再变化，由压缩器按 (task_date, result) 汇总写入汇总表；
+# 当天数据仍实时查询原始表。建表与历史回填见 sql/001_shopify_task_log_daily.sql
+# ============================================================
+
+_compacted_days = set()          # 本进程内已确认汇总完毕的历史日期
+_compact_lock = threading.Lock()
+
+
+def compact_daily_stats(conn, start_d: date, end_d: date):
+    """将 [start_d, end_d] 内尚未汇总的历史日期（今天之前）写入汇总表"""
+    end_d = min(end_d, date.today() - timedelta(days=1))
+    if start_d > end_d:
+        return
+
+    with _compact_lock:
+        pending = [d for d in _daterange(start_d, end_d) if d not in _compacted_days]
+        if not pending:
+            return
+
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT DISTINCT task_date
+                FROM shopify_task_log_daily
+                WHERE task_date BETWEEN %s AND %s
+            """, (pending[0].strftime("%Y-%m-%d"), pending[-1].strftime("%Y-%m-%d")))
+            done = {str(row["task_date"]) for row in cursor.fetchall()}
+
+            missing = [d for d in pending if d.strftime("%Y-%m-%d") not in done]
+            if missing:
+                sql = """
+                    INSERT INTO shopify_task_log_daily (task_date, result, total)
+                    SELECT task_date, result, COUNT(*)
+                    FROM shopify_task_log
+                    WHERE task_date BETWEEN %s AND %s
+                    GROUP BY task_date, result
+                """ + storage.upsert_clause(["task_date", "result"], ["total"])
+                cursor.execute(sql, (missing[0].strftime("%Y-%m-%d"), missing[-1].strftime("%Y-%m-%d")))
+        conn.commit()
+        _compacted_days.update(pending)
+
+
 # ============================================================
 # 接口 1：查询任务执行日志统计
 # GET /api/shopify/daily-stats
@@ -67,58 +268,58 @@ def parse_date_param(val: str, param_name: str):
 # ============================================================
 
 @app.route("/api/shopify/daily-stats", methods=["GET"])
+@cached_response("daily-stats", DAILY_STATS_CACHE_TTL, DATE_RANGE_PARAMS)
 def daily_stats():
     today = date.today()
 
-    date_str       = request.args.get("date")
-    start_date_str = request.args.get("start_date")
-    end_date_str   = request.args.get("end_date")
-
-    if date_str:
-        d = parse_date_param(date_str, "date")
-        if d is None:
-            return err("date 格式错误，请使用 YYYY-MM-DD")
-        start_d = end_d = d
-    elif start_date_str or end_date_str:
-        start_d = parse_date_param(start_date_str, "start_date")
-        end_d   = parse_date_param(end_date_str,   "end_date")
-        if start_d is None or end_d is None:
-            return err("start_date / end_date 格式错误，请使用 YYYY-MM-DD")
-        if start_d > end_d:
-            return err("start_date 不能晚于 end_date")
-    else:
+    start_d, end_d, error = parse_date_range()
+    if error:
+        return err(error)
+    if start_d is None:
         start_d = end_d = today
 
     try:
         conn = get_conn()
         try:
+            compact_daily_stats(conn, start_d, end_d)
+
+            per_day = {}
             with conn.cursor() as cursor:
-                sql = """
-                    SELECT
-                        task_date,
-                        COUNT(*) AS total,
-                        SUM(result = 'success') AS success,
-                        SUM(result = 'failed')  AS failed,
-                        SUM(result = 'skipped') AS skipped
-                    FROM shopify_task_log
-                    WHERE task_date BETWEEN %s AND %s
-                    GROUP BY task_date
-                    ORDER BY task_date DESC
-                """
-                cursor.execute(sql, (start_d.strftime("%Y-%m-%d"),
-                                     end_d.strftime("%Y-%m-%d")))
-                rows = cursor.fetchall()
+                # 历史日期：读汇总表
+                past_end = min(end_d, today - timedelta(days=1))
+                if start_d <= past_end:
+                    cursor.execute("""
+                        SELECT task_date, result, total
+                        FROM shopify_task_log_daily
+                        WHERE task_date BETWEEN %s AND %s
+                    """, (start_d.strftime("%Y-%m-%d"), past_end.strftime("%Y-%m-%d")))
+                    for row in cursor.fetchall():
+                        counts = per_day.setdefault(str(row["task_date"]), {})
+                        counts[row["result"]] = int(row["total"] or 0)
+
+                # 当天：实时查原始日志
+                if start_d <= today <= end_d:
+                    cursor.execute("""
+                        SELECT result, COUNT(*) AS total
+                        FROM shopify_task_log
+                        WHERE task_date = %s
+                        GROUP BY result
+                    """, (today.strftime("%Y-%m-%d"),))
+                    for row in cursor.fetchall():
+                        counts = per_day.setdefault(today.strftime("%Y-%m-%d"), {})
+                        counts[row["result"]] = int(row["total"] or 0)
         finally:
             conn.close()
 
         result = []
-        for row in rows:
+        for task_date in sorted(per_day, reverse=True):
+            counts = per_day[task_date]
             result.append({
-                "task_date": str(row["task_date"]),
-                "total":     int(row["total"]   or 0),
-                "success":   int(row["success"] or 0),
-                "failed":    int(row["failed"]  or 0),
-                "skipped":   int(row["skipped"] or 0),
+                "task_date": task_date,
+                "total":     sum(counts.values()),
+                "success":   counts.get("success", 0),
+                "failed":    counts.get("failed", 0),
+                "skipped":   counts.get("skipped", 0),
             })
 
         return ok({
@@ -133,6 +334,35 @@ def daily_stats():
         return err(f"数据库查询异常: {e}", 500)
 
 
+# ============================================================
+# Cookie 最新状态表（shopify_cookie_status_latest）
+#
+# shopify_cookie_status 是只追加的历史表；每次上报时同步 upsert 最新状态表，
+# 查询接口只读最新状态表。建表与回填见 sql/002_shopify_cookie_status_latest.sql
+# ============================================================
+
+LATEST_UPSERT_SQL = """
+    INSERT INTO shopify_cookie_status_latest
+        (store_id, is_valid, checked_at, checker, detail)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+
+def _latest_upsert_sql() -> str:
+    return LATEST_UPSERT_SQL + storage.upsert_clause(
+        ["store_id"], ["is_valid", "checked_at", "checker", "detail"])
+
+
+def _cookie_status_row(row: dict) -> dict:
+    return {
+        "store_id":   row["store_id"],
+        "is_valid":   bool(row["is_valid"]),
+        "checked_at": str(row["checked_at"]),
+        "checker":    row["checker"],
+        "detail":     row["detail"],
+    }
+
+
 # ============================================================
 # 接口 2：上报 Cookie 状态
 # POST /api/shopify/cookie-status/report
@@ -152,46 +382,113 @@ def cookie_report():
     if not body:
         return err("请求体必须是 JSON 格式")
 
-    store_id = body.get("store_id", "").strip()
+    params, error = _parse_cookie_report(body)
+    if error:
+        return err(error)
+
+    try:
+        _insert_cookie_reports([params])
+        return ok({
+            "store_id":   params[0],
+            "is_valid":   bool(params[1]),
+            "reported_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }, msg="上报成功")
+
+    except Exception as e:
+        return err(f"数据库写入异常: {e}", 500)
+
+
+# ============================================================
+# 接口 2b：批量上报 Cookie 状态
+# POST /api/shopify/cookie-status/report/batch
+#
+# Body (JSON):
+#   {"reports": [ {单条上报格式}, ... ]}   或直接传数组
+#
+# 逐条校验，合法的记录在同一事务内一次性写入；返回每条的处理结果。
+# ============================================================
+
+COOKIE_REPORT_BATCH_MAX = 1000
+
+
+@app.route("/api/shopify/cookie-status/report/batch", methods=["POST"])
+def cookie_report_batch():
+    body = request.get_json(silent=True)
+    reports = body.get("reports") if isinstance(body, dict) else body
+    if not isinstance(reports, list) or not reports:
+        return err("请求体必须是非空 JSON 数组，或包含 reports 数组的对象")
+    if len(reports) > COOKIE_REPORT_BATCH_MAX:
+        return err(f"单次最多上报 {COOKIE_REPORT_BATCH_MAX} 条")
+
+    results = []
+    rows = []
+    for index, item in enumerate(reports):
+        params, error = _parse_cookie_report(item)
+        if error:
+            results.append({"index": index, "store_id": None, "ok": False, "msg": error})
+        else:
+            results.append({"index": index, "store_id": params[0], "ok": True, "msg": "上报成功"})
+            rows.append(params)
+
+    if not rows:
+        return jsonify({"code": 400, "msg": "没有合法的上报记录", "data": {"results": results}}), 400
+
+    try:
+        _insert_cookie_reports(rows)
+    except Exception as e:
+        return err(f"数据库写入异常: {e}", 500)
+
+    return ok({
+        "accepted": len(rows),
+        "rejected": len(results) - len(rows),
+        "reported_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "results": results,
+    }, msg="上报完成")
+
+
+def _parse_cookie_report(body):
+    """校验单条上报，返回 (参数元组, 错误信息)"""
+    if not isinstance(body, dict):
+        return None, "上报记录必须是 JSON 对象"
+
+    store_id = str(body.get("store_id") or "").strip()
     if not store_id:
-        return err("缺少必填字段: store_id")
+        return None, "缺少必填字段: store_id"
 
     is_valid_raw = body.get("is_valid")
     if is_valid_raw is None:
-        return err("缺少必填字段: is_valid")
+        return None, "缺少必填字段: is_valid"
     is_valid = 1 if is_valid_raw else 0
 
     checker = str(body.get("checker", "pycharm"))[:50]
     detail  = str(body.get("detail",  ""))[:500]
 
-    try:
-        conn = get_conn()
-        try:
-            with conn.cursor() as cursor:
-                sql = """
-                    INSERT INTO shopify_cookie_status
-                        (store_id, is_valid, checked_at, checker, detail)
-                    VALUES (%s, %s, %s, %s, %s)
-                """
-                cursor.execute(sql, (
-                    store_id,
-                    is_valid,
-                    datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                    checker,
-                    detail,
-                ))
-            conn.commit()
-        finally:
-            conn.close()
+    return (
+        store_id,
+        is_valid,
+        datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        checker,
+        detail,
+    ), None
 
-        return ok({
-            "store_id":   store_id,
-            "is_valid":   bool(is_valid),
-            "reported_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        }, msg="上报成功")
 
-    except Exception as e:
-        return err(f"数据库写入异常: {e}", 500)
+def _insert_cookie_reports(rows: list):
+    """在同一事务内写入历史表并更新最新状态表"""
+    conn = get_conn()
+    try:
+        with conn.cursor() as cursor:
+            sql = """
+                INSERT INTO shopify_cookie_status
+                    (store_id, is_valid, checked_at, checker, detail)
+                VALUES (%s, %s, %s, %s, %s)
+            """
+            cursor.executemany(sql, rows)
+            # 最新状态表每个店铺一行
+            cursor.executemany(_latest_upsert_sql(), rows)
+        conn.commit()
+    finally:
+        conn.close()
+    response_cache.invalidate("cookie-status")
 
 
 # ============================================================
@@ -203,6 +500,7 @@ def cookie_report():
 # ============================================================
 
 @app.route("/api/shopify/cookie-status", methods=["GET"])
+@cached_response("cookie-status", COOKIE_STATUS_CACHE_TTL, ("store_id",))
 def cookie_status():
     store_id = request.args.get("store_id", "").strip()
 
@@ -211,50 +509,27 @@ def cookie_status():
         try:
             with conn.cursor() as cursor:
                 if store_id:
-                    # 查指定店铺的最新一条
+                    # 查指定店铺的最新状态
                     sql = """
                         SELECT store_id, is_valid, checked_at, checker, detail
-                        FROM shopify_cookie_status
+                        FROM shopify_cookie_status_latest
                         WHERE store_id = %s
-                        ORDER BY checked_at DESC
-                        LIMIT 1
                     """
                     cursor.execute(sql, (store_id,))
                     row = cursor.fetchone()
                     if not row:
                         return err(f"未找到 store_id={store_id} 的 Cookie 状态记录", 404)
 
-                    data = {
-                        "store_id":   row["store_id"],
-                        "is_valid":   bool(row["is_valid"]),
-                        "checked_at": str(row["checked_at"]),
-                        "checker":    row["checker"],
-                        "detail":     row["detail"],
-                    }
+                    data = _cookie_status_row(row)
                 else:
-                    # 查所有店铺各自最新一条（子查询取最大ID）
+                    # 查所有店铺最新状态（最新状态表每个店铺仅一行）
                     sql = """
-                        SELECT s.store_id, s.is_valid, s.checked_at, s.checker, s.detail
-                        FROM shopify_cookie_status s
-                        INNER JOIN (
-                            SELECT store_id, MAX(id) AS max_id
-                            FROM shopify_cookie_status
-                            GROUP BY store_id
-                        ) t ON s.store_id = t.store_id AND s.id = t.max_id
-                        ORDER BY s.checked_at DESC
+                        SELECT store_id, is_valid, checked_at, checker, detail
+                        FROM shopify_cookie_status_latest
+                        ORDER BY checked_at DESC
                     """
                     cursor.execute(sql)
-                    rows = cursor.fetchall()
-                    data = [
-                        {
-                            "store_id":   r["store_id"],
-                            "is_valid":   bool(r["is_valid"]),
-                            "checked_at": str(r["checked_at"]),
-                            "checker":    r["checker"],
-                            "detail":     r["detail"],
-                        }
-                        for r in rows
-                    ]
+                    data = [_cookie_status_row(r) for r in cursor.fetchall()]
         finally:
             conn.close()
 
@@ -264,9 +539,539 @@ def cookie_status():
         return err(f"数据库查询异常: {e}", 500)
 
 
+# ============================================================
+# 明细查询公共逻辑
+#
+# 分页采用基于 id 的游标（keyset）：按 id 倒序返回，next_cursor 为本页最小 id，
+# 下一页传 cursor=next_cursor 即可，不受 OFFSET 深翻页影响。
+# format=ndjson 时改为流式导出：使用服务端游标（SSDictCursor）逐行输出，
+# 不在 Flask 进程中缓存整个结果集。流式导出会长时间占用连接，因此单独建连，
+# 不占用连接池。
+# ============================================================
+
+ROWS_DEFAULT_LIMIT = 100
+ROWS_MAX_LIMIT     = 1000
+
+
+def _parse_cursor_and_limit():
+    """返回 (cursor, limit, 错误信息)"""
+    cursor_str = request.args.get("cursor", "").strip()
+    limit_str  = request.args.get("limit", "").strip()
+    try:
+        cursor_id = int(cursor_str) if cursor_str else None
+        limit = int(limit_str) if limit_str else ROWS_DEFAULT_LIMIT
+    except ValueError:
+        return None, None, "cursor / limit 必须是整数"
+    if limit < 1 or limit > ROWS_MAX_LIMIT:
+        return None, None, f"limit 取值范围 1~{ROWS_MAX_LIMIT}"
+    return cursor_id, limit, None
+
+
+def _stream_ndjson(sql: str, params: tuple, row_fn):
+    # 连接与查询在开始输出前完成，失败时仍能返回错误响应
+    conn = None
+    try:
+        conn = storage.stream_conn()
+        cursor = conn.cursor()
+        cursor.execute(sql, params)
+    except Exception as e:
+        if conn is not None:
+            conn.close()
+        return err(f"数据库查询异常: {e}", 500)
+
+    def generate():
+        try:
+            for row in cursor:
+                yield json.dumps(row_fn(row), ensure_ascii=False) + "\n"
+        finally:
+            conn.close()
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def _query_rows(select_sql: str, where: list, params: list, row_fn):
+    """按 where 条件查询明细：分页返回 JSON，或 format=ndjson 时流式导出"""
+    cursor_id, limit, error = _parse_cursor_and_limit()
+    if error:
+        return err(error)
+    if cursor_id is not None:
+        where.append("id < %s")
+        params.append(cursor_id)
+
+    sql = select_sql
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY id DESC"
+
+    if request.args.get("format") == "ndjson":
+        if request.args.get("limit"):
+            sql += " LIMIT %s"
+            params.append(limit)
+        return _stream_ndjson(sql, tuple(params), row_fn)
+
+    sql += " LIMIT %s"
+    params.append(limit + 1)
+
+    try:
+        conn = get_conn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(sql, tuple(params))
+                rows = cursor.fetchall()
+        finally:
+            conn.close()
+    except Exception as e:
+        return err(f"数据库查询异常: {e}", 500)
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return ok({
+        "rows":        [row_fn(r) for r in rows],
+        "next_cursor": rows[-1]["id"] if has_more else None,
+    })
+
+
+# ============================================================
+# 接口 4：查询任务日志明细
+# GET /api/shopify/task-log
+#
+# 参数（均可选）：
+#   date / start_date&end_date   按 task_date 筛选
+#   result                       success / failed / skipped
+#   keer_product_id              指定商品
+#   cursor                       上一页返回的 next_cursor
+#   limit                        每页条数（默认100，最大1000）
+#   format=ndjson                流式导出全部匹配行（传 limit 时限制行数）
+# ============================================================
+
+@app.route("/api/shopify/task-log", methods=["GET"])
+def task_log():
+    start_d, end_d, error = parse_date_range()
+    if error:
+        return err(error)
+
+    where, params = [], []
+    if start_d is not None:
+        where.append("task_date BETWEEN %s AND %s")
+        params += [start_d.strftime("%Y-%m-%d"), end_d.strftime("%Y-%m-%d")]
+    result = request.args.get("result", "").strip()
+    if result:
+        where.append("result = %s")
+        params.append(result)
+    keer_product_id = request.args.get("keer_product_id", "").strip()
+    if keer_product_id:
+        where.append("keer_product_id = %s")
+        params.append(keer_product_id)
+
+    return _query_rows("""
+        SELECT id, task_date, keer_product_id, result, detail, created_at
+        FROM shopify_task_log
+    """, where, params, lambda r: {
+        "id":              r["id"],
+        "task_date":       str(r["task_date"]),
+        "keer_product_id": r["keer_product_id"],
+        "result":          r["result"],
+        "detail":          r["detail"],
+        "created_at":      str(r["created_at"]),
+    })
+
+
+# ============================================================
+# 接口 5：查询 Cookie 状态历史
+# GET /api/shopify/cookie-status/history
+#
+# 参数（均可选）：
+#   store_id                     指定店铺
+#   date / start_date&end_date   按 checked_at 日期筛选
+#   cursor / limit / format      同 /api/shopify/task-log
+# ============================================================
+
+@app.route("/api/shopify/cookie-status/history", methods=["GET"])
+def cookie_status_history():
+    start_d, end_d, error = parse_date_range()
+    if error:
+        return err(error)
+
+    where, params = [], []
+    store_id = request.args.get("store_id", "").strip()
+    if store_id:
+        where.append("store_id = %s")
+        params.append(store_id)
+    if start_d is not None:
+        where.append("checked_at >= %s AND checked_at < %s")
+        params += [start_d.strftime("%Y-%m-%d"),
+                   (end_d + timedelta(days=1)).strftime("%Y-%m-%d")]
+
+    return _query_rows("""
+        SELECT id, store_id, is_valid, checked_at, checker, detail
+        FROM shopify_cookie_status
+    """, where, params, lambda r: {"id": r["id"], **_cookie_status_row(r)})
+
+
+# ============================================================
+# 接口 6：阶段耗时分位数与按小时吞吐量
+# GET /api/shopify/stage-latency
+#
+# 参数（同 daily-stats）：
+#   date=2024-01-15 / start_date=...&end_date=... / （不传）当天
+#
+# 返回：
+#   stages  各阶段 count / p50 / p95 / p99 / max（毫秒）及重试次数
+#   hourly  按小时的任务数（来自 shopify_task_log）
+# ============================================================
+
+STAGE_LATENCY_CACHE_TTL = 30   # 秒
+
+
+def _stage_percentile(cursor, range_params: tuple, stage: str, total: int, pct: int) -> int:
+    """最近秩法分位数：按耗时升序取第 ceil(total * pct / 100) 行"""
+    rank = max(1, -(-total * pct // 100))   # 向上取整
+    cursor.execute("""
+        SELECT duration_ms
+        FROM shopify_task_stage_log
+        WHERE task_date BETWEEN %s AND %s AND stage = %s
+        ORDER BY duration_ms
+        LIMIT 1 OFFSET %s
+    """, (*range_params, stage, rank - 1))
+    row = cursor.fetchone()
+    return int(row["duration_ms"]) if row else 0
+
+
+@app.route("/api/shopify/stage-latency", methods=["GET"])
+@cached_response("stage-latency", STAGE_LATENCY_CACHE_TTL, DATE_RANGE_PARAMS)
+def stage_latency():
+    start_d, end_d, error = parse_date_range()
+    if error:
+        return err(error)
+    if start_d is None:
+        start_d = end_d = date.today()
+    range_params = (start_d.strftime("%Y-%m-%d"), end_d.strftime("%Y-%m-%d"))
+
+    try:
+        conn = get_conn()
+        try:
+            with conn.cursor() as cursor:
+                # 计数 / 最大值 / 重试在库内聚合，分位数用 LIMIT 1 OFFSET 逐个取一行，
+                # 不把整段时间的明细拉到 API 进程
+                cursor.execute("""
+                    SELECT stage, COUNT(*) AS total, MAX(duration_ms) AS max_ms,
+                           SUM(retries) AS retries
+                    FROM shopify_task_stage_log
+                    WHERE task_date BETWEEN %s AND %s
+                    GROUP BY stage
+                    ORDER BY stage
+                """, range_params)
+                stages = []
+                for row in cursor.fetchall():
+                    total, retries = int(row["total"]), int(row["retries"] or 0)
+                    stages.append({
+                        "stage":         row["stage"],
+                        "count":         total,
+                        **{f"p{pct}_ms": _stage_percentile(cursor, range_params, row["stage"],
+                                                           total, pct)
+                           for pct in (50, 95, 99)},
+                        "max_ms":        int(row["max_ms"]),
+                        "total_retries": retries,
+                        "avg_retries":   round(retries / total, 3),
+                    })
+
+                cursor.execute(f"""
+                    SELECT {storage.hour_bucket("created_at")} AS hour,
+                           result, COUNT(*) AS total
+                    FROM shopify_task_log
+                    WHERE created_at >= %s AND created_at < %s
+                    GROUP BY hour, result
+                """, (range_params[0], (end_d + timedelta(days=1)).strftime("%Y-%m-%d")))
+                hourly = {}
+                for row in cursor.fetchall():
+                    counts = hourly.setdefault(row["hour"], {})
+                    counts[row["result"]] = int(row["total"] or 0)
+        finally:
+            conn.close()
+    except Exception as e:
+        return err(f"数据库查询异常: {e}", 500)
+
+    return ok({
+        "query_range": {"start_date": range_params[0], "end_date": range_params[1]},
+        "stages": stages,
+        "hourly": [
+            {
+                "hour":    hour,
+                "total":   sum(counts.values()),
+                "success": counts.get("success", 0),
+                "failed":  counts.get("failed", 0),
+                "skipped": counts.get("skipped", 0),
+            }
+            for hour, counts in sorted(hourly.items())
+        ],
+    })
+
+
+# ============================================================
+# 接口 7：阶段耗时指标
+# POST /api/shopify/metrics/report   worker 每条任务结束后上报累计快照
+#   {"worker_id": "host-1234", "stages": {stage: 直方图}}
+# GET  /metrics                      Prometheus 文本格式，按 worker 打标签
+#
+# 快照保存在进程内存中，超过 METRICS_STALE_SECONDS 未更新的 worker 不再输出。
+# ============================================================
+
+METRICS_STALE_SECONDS = 600
+METRICS_MAX_STAGES    = 100     # 单个 worker 上报的阶段数上限
+
+_worker_metrics = {}      # worker_id -> (received_at, stages)
+_worker_metrics_lock = threading.Lock()
+
+
+@app.route("/api/shopify/metrics/report", methods=["POST"])
+def metrics_report():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return err("请求体必须是 JSON 格式")
+
+    worker_id = str(body.get("worker_id") or "").strip()[:100]
+    stages = body.get("stages")
+    if not worker_id or not isinstance(stages, dict):
+        return err("缺少必填字段: worker_id / stages")
+    if len(stages) > METRICS_MAX_STAGES:
+        return err(f"阶段数超过上限 {METRICS_MAX_STAGES}")
+
+    # 逐个校验直方图结构，格式错误的快照不进入内存，避免 /metrics 渲染失败
+    for stage, histogram in stages.items():
+        if not stage or len(stage) > 100:
+            return err(f"阶段名称无效: {stage[:100]!r}")
+        try:
+            stages[stage] = Histogram.from_dict(histogram).to_dict()
+        except ValueError as e:
+            return err(f"阶段 {stage} 的直方图格式错误: {e}")
+
+    with _worker_metrics_lock:
+        _worker_metrics[worker_id] = (time.time(), stages)
+    return ok({"worker_id": worker_id, "stages": len(stages)}, msg="上报成功")
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    now = time.time()
+    with _worker_metrics_lock:
+        for worker_id in [w for w, (ts, _) in _worker_metrics.items()
+                          if now - ts > METRICS_STALE_SECONDS]:
+            del _worker_metrics[worker_id]
+        snapshots = {(("worker", w),): stages for w, (_, stages) in _worker_metrics.items()}
+
+    try:
+        body = render_prometheus(snapshots)
+    except (KeyError, TypeError, ValueError) as e:
+        return err(f"指标快照格式错误: {e}", 500)
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+
+# ============================================================
+# 接口 8：worker 与正在处理的任务
+# GET /api/shopify/workers?all=1
+#
+# 数据来自 shopify_worker（worker 心跳）与 shopify_task_lease（任务租约），
+# 见 sql/005_shopify_worker_lease.sql。
+#
+# 参数:
+#   all  可选，=1 时同时返回已停止或心跳超时的 worker
+#
+# 返回：
+#   workers         各 worker 的心跳信息与其持有的未过期租约（tasks）
+#   expired_leases  已过期、等待其他 worker 重新领取的租约（持有者崩溃或失联）
+# ============================================================
+
+WORKER_STALE_SECONDS = 90   # 超过该秒数无心跳视为失联（worker 每 30 秒心跳一次）
+
+
+def _lease_row(row: dict) -> dict:
+    return {
+        "keer_product_id": row["keer_product_id"],
+        "store_id":        row["store_id"],
+        "stage":           row["stage"],
+        "attempts":        int(row["attempts"] or 0),
+        "leased_at":       str(row["leased_at"]),
+        "expires_at":      str(row["expires_at"]),
+    }
+
+
+@app.route("/api/shopify/workers", methods=["GET"])
+def workers():
+    include_all = request.args.get("all", "").strip() == "1"
+    # 存活 / 过期在库内按数据库时钟判断（worker 用 NOW() 写心跳与租约），不依赖 API 主机的时钟
+    now_sql = storage.now_before()
+    alive_sql = f"(status = 'running' AND heartbeat_at >= {storage.now_before(WORKER_STALE_SECONDS)})"
+
+    try:
+        conn = get_conn()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"SELECT {now_sql} AS checked_at")
+                checked_at = str(cursor.fetchone()["checked_at"])
+
+                sql = f"""
+                    SELECT worker_id, hostname, pid, stores, status, tasks_done,
+                           started_at, heartbeat_at, {alive_sql} AS alive
+                    FROM shopify_worker
+                """
+                if not include_all:
+                    sql += f" WHERE {alive_sql}"
+                cursor.execute(sql + " ORDER BY worker_id")
+                worker_rows = cursor.fetchall()
+
+                cursor.execute(f"""
+                    SELECT keer_product_id, worker_id, store_id, stage, attempts,
+                           leased_at, expires_at, expires_at > {now_sql} AS active
+                    FROM shopify_task_lease
+                    ORDER BY leased_at
+                """)
+                lease_rows = cursor.fetchall()
+        finally:
+            conn.close()
+    except Exception as e:
+        return err(f"数据库查询异常: {e}", 500)
+
+    leases, expired = {}, []
+    for row in lease_rows:
+        if row["active"]:
+            leases.setdefault(row["worker_id"], []).append(_lease_row(row))
+        else:
+            expired.append(dict(_lease_row(row), worker_id=row["worker_id"]))
+
+    data = []
+    for row in worker_rows:
+        data.append({
+            "worker_id":    row["worker_id"],
+            "hostname":     row["hostname"],
+            "pid":          int(row["pid"] or 0),
+            "stores":       [s for s in (row["stores"] or "").split(",") if s],
+            "status":       row["status"],
+            "alive":        bool(row["alive"]),
+            "tasks_done":   int(row["tasks_done"] or 0),
+            "started_at":   str(row["started_at"]),
+            "heartbeat_at": str(row["heartbeat_at"]),
+            "tasks":        leases.get(row["worker_id"], []),
+        })
+
+    return ok({
+        "checked_at":     checked_at,
+        "total":          len(data),
+        "alive":          sum(1 for w in data if w["alive"]),
+        "workers":        data,
+        "expired_leases": expired,
+    })
+
+
+# ============================================================
+# 接口 9：新任务通知（长轮询）
+# POST /api/shopify/tasks/notify
+# GET  /api/shopify/tasks/wait?since=<version>&timeout=25
+#
+# 进程内维护一个版本号，有新任务时加一并唤醒所有等待中的 worker。信号来源:
+#   1. 报价系统在任务状态改为“报价单创建完毕”并提交后调用 notify；
+#   2. quotation_task_detail 上的触发器递增 shopify_task_signal 的版本号
+#      （见 sql/008_shopify_task_signal.sql），仅在有 worker 等待时每
+#      TASK_SIGNAL_DB_POLL_SECONDS 秒按主键读取一次，与 worker 数量无关。
+#
+# wait 参数:
+#   since    worker 上次收到的版本号；不传或与当前版本不同时立即返回
+#   timeout  最长等待秒数（默认 25，上限 TASK_WAIT_MAX_SECONDS）
+#
+# 返回：{"version": 当前版本号, "changed": 是否有新任务通知}
+# ============================================================
+
+TASK_WAIT_DEFAULT_SECONDS   = 25
+TASK_WAIT_MAX_SECONDS       = 60
+TASK_SIGNAL_DB_POLL_SECONDS = 1.0
+
+
+class TaskSignal:
+    def __init__(self):
+        self.version = 0
+        self._db_version = None
+        self._waiters = 0
+        self._cond = threading.Condition()
+        self._watcher = None
+
+    def reset(self):
+        with self._cond:
+            self._db_version = None
+
+    def notify(self) -> int:
+        with self._cond:
+            self.version += 1
+            self._cond.notify_all()
+            return self.version
+
+    def wait(self, since, timeout: float) -> int:
+        self._ensure_watcher()
+        with self._cond:
+            self._waiters += 1
+            self._cond.notify_all()     # 唤醒触发器表读取线程
+            try:
+                self._cond.wait_for(lambda: since is None or self.version != since, timeout)
+                return self.version
+            finally:
+                self._waiters -= 1
+
+    def _ensure_watcher(self):
+        with self._cond:
+            if self._watcher is not None and self._watcher.is_alive():
+                return
+            self._watcher = threading.Thread(target=self._watch_db, name="task-signal", daemon=True)
+            self._watcher.start()
+
+    def _watch_db(self):
+        """有 worker 等待时读取触发器维护的版本号，变化即通知；无人等待时不访问数据库"""
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._waiters > 0)
+            try:
+                conn = get_conn()
+                try:
+                    with conn.cursor() as cursor:
+                        cursor.execute("SELECT version FROM shopify_task_signal WHERE id = 1")
+                        row = cursor.fetchone()
+                finally:
+                    conn.close()
+            except Exception:
+                row = None      # 表未创建或数据库不可用时只依赖 notify 接口
+            if row is not None:
+                db_version = int(row["version"])
+                with self._cond:
+                    changed = self._db_version is not None and db_version != self._db_version
+                    self._db_version = db_version
+                if changed:
+                    self.notify()
+            time.sleep(TASK_SIGNAL_DB_POLL_SECONDS)
+
+
+task_signal = TaskSignal()
+
+
+@app.route("/api/shopify/tasks/notify", methods=["POST"])
+def tasks_notify():
+    return ok({"version": task_signal.notify()}, msg="已通知")
+
+
+@app.route("/api/shopify/tasks/wait", methods=["GET"])
+def tasks_wait():
+    since = request.args.get("since", "").strip()
+    timeout = request.args.get("timeout", "").strip()
+    try:
+        since = int(since) if since else None
+        timeout = float(timeout) if timeout else TASK_WAIT_DEFAULT_SECONDS
+    except ValueError:
+        return err("since 必须是整数，timeout 必须是数字")
+    timeout = min(max(timeout, 0.0), TASK_WAIT_MAX_SECONDS)
+
+    version = task_signal.wait(since, timeout)
+    return ok({"version": version, "changed": since is not None and version != since})
+
+
 # ============================================================
 # 启动
 # ============================================================
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=2580, debug=False)
+    app.run(host="0.0.0.0", port=2580, debug=False, threaded=True)   # 长轮询占用处理线程
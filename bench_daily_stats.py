@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""
+daily-stats 接口延迟基准测试
+
+在独立的测试库中写入百万级 shopify_task_log 数据，对比：
+  - legacy : 旧实现，直接对原始日志 GROUP BY task_date
+  - rollup : 当前 /api/shopify/daily-stats（历史读汇总表 + 当天实时）
+
+运行方式:
+  python bench_daily_stats.py --database quote_iw_bench --rows 2000000 --days 365
+  python bench_daily_stats.py --database quote_iw_bench --skip-seed     # 复用已有数据
+
+注意: 会在 --database 指定的库中重建 shopify_task_log / shopify_task_log_daily，
+      切勿指向生产库。
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import date, datetime, timedelta
+
+import pymysql
+
+import api_server
+
+
+LEGACY_SQL = """
+    SELECT
+        task_date,
+        COUNT(*) AS total,
+        SUM(result = 'success') AS success,
+        SUM(result = 'failed')  AS failed,
+        SUM(result = 'skipped') AS skipped
+    FROM shopify_task_log
+    WHERE task_date BETWEEN %s AND %s
+    GROUP BY task_date
+    ORDER BY task_date DESC
+"""
+
+
+def seed(conn, rows: int, days: int, batch: int = 10000):
+    with conn.cursor() as cursor:
+        cursor.execute("DROP TABLE IF EXISTS shopify_task_log")
+        cursor.execute("DROP TABLE IF EXISTS shopify_task_log_daily")
+        cursor.execute("""
+            CREATE TABLE shopify_task_log (
+                id              BIGINT AUTO_INCREMENT PRIMARY KEY,
+                task_date       DATE         NOT NULL,
+                keer_product_id VARCHAR(64)  NOT NULL DEFAULT '',
+                result          VARCHAR(20)  NOT NULL,
+                detail          VARCHAR(500) NOT NULL DEFAULT '',
+                created_at      DATETIME     NOT NULL,
+                INDEX idx_task_date_result (task_date, result)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """)
+        cursor.execute("""
+            CREATE TABLE shopify_task_log_daily (
+                task_date  DATE        NOT NULL,
+                result     VARCHAR(20) NOT NULL,
+                total      INT         NOT NULL DEFAULT 0,
+                PRIMARY KEY (task_date, result)
+            ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+        """)
+    conn.commit()
+
+    today = date.today()
+    results = ['success'] * 7 + ['failed'] * 2 + ['skipped']
+    sql = """
+        INSERT INTO shopify_task_log
+            (task_date, keer_product_id, result, detail, created_at)
+        VALUES (%s, %s, %s, %s, %s)
+    """
+    t0 = time.time()
+    written = 0
+    while written < rows:
+        n = min(batch, rows - written)
+        values = []
+        for i in range(n):
+            d = today - timedelta(days=random.randrange(days))
+            ts = datetime(d.year, d.month, d.day) + timedelta(seconds=random.randrange(86400))
+            values.append((d.strftime('%Y-%m-%d'), f"KP{written + i}",
+                           random.choice(results), '', ts.strftime('%Y-%m-%d %H:%M:%S')))
+        with conn.cursor() as cursor:
+            cursor.executemany(sql, values)
+        conn.commit()
+        written += n
+        print(f"  已写入 {written}/{rows} 行 ({written / (time.time() - t0):.0f} 行/秒)", end='\r')
+    print()
+
+
+def measure(fn, repeat: int) -> list:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def report(name: str, samples: list):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:28s} p50={statistics.median(samples):8.2f}ms  "
+          f"p95={p95:8.2f}ms  max={samples[-1]:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="daily-stats 延迟基准测试")
+    parser.add_argument("--database", required=True, help="测试库名（不要使用生产库）")
+    parser.add_argument("--rows", type=int, default=2000000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--skip-seed", action="store_true")
+    args = parser.parse_args()
+
+    if args.database == api_server.DB_CONFIG["database"]:
+        parser.error("--database 不能与生产库相同")
+
+    api_server.DB_CONFIG["database"] = args.database
+    conn = pymysql.connect(**api_server.DB_CONFIG, cursorclass=pymysql.cursors.DictCursor)
+    try:
+        if not args.skip_seed:
+            print(f"写入 {args.rows} 行测试数据（{args.days} 天）...")
+            seed(conn, args.rows, args.days)
+
+        today = date.today()
+        ranges = {
+            "today":   (today, today),
+            "30 days": (today - timedelta(days=29), today),
+            "365 days": (today - timedelta(days=args.days - 1), today),
+        }
+
+        client = api_server.app.test_client()
+        for label, (start_d, end_d) in ranges.items():
+            params = (start_d.strftime('%Y-%m-%d'), end_d.strftime('%Y-%m-%d'))
+
+            def legacy():
+                with conn.cursor() as cursor:
+                    cursor.execute(LEGACY_SQL, params)
+                    cursor.fetchall()
+
+            def rollup():
+                resp = client.get("/api/shopify/daily-stats",
+                                  query_string={"start_date": params[0], "end_date": params[1]})
+                assert resp.status_code == 200, resp.get_data(as_text=True)
+
+            # 预热一次：首个请求会触发历史日期的压缩
+            t0 = time.perf_counter()
+            rollup()
+            print(f"[{label}] 首次请求（含压缩）: {(time.perf_counter() - t0) * 1000:.2f}ms")
+
+            report(f"[{label}] legacy", measure(legacy, args.repeat))
+            report(f"[{label}] rollup", measure(rollup, args.repeat))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
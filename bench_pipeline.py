@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+process_one_task 端到端离线基准测试
+
+启动 bench_stub_server.StubServer 替身服务，把 shopify_auto_loop 的外部依赖
+（Shopify 后台 / GCS / Cookie / ZhipuAI 密钥与 chat-completions / 源店铺商品 /
+任务反馈）全部指向本地，分别以串行和并发方式处理 N 条模拟任务，
+输出吞吐量（任务/分钟）和各阶段耗时分位数。
+
+与生产环境的差异:
+  - 任务从替身服务的 /bench/next-task 领取，不连接 MySQL；DB 日志、阶段明细与任务断点不落库
+  - CSRF token 通过普通 HTTP 请求替身后台页面获取，不启动 Chrome
+
+运行方式:
+  python bench_pipeline.py --tasks 50 --mode both --workers 8 --latency-ms 80
+  python bench_pipeline.py --tasks 20 --mode serial --error-rate 0.05 --job-duration 2
+
+录制 / 回放（见 http_cassette.py）：
+  python bench_pipeline.py --tasks 20 --mode serial --record cassettes/bench.jsonl
+  python bench_pipeline.py --mode serial --replay cassettes/bench.jsonl --replay-delay zero
+回放时不启动替身服务，任务数由 cassette 中录制的 /bench/next-task 决定。
+"""
+
+import argparse
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+
+import http_cassette
+import shopify_auto_loop as loop
+from bench_stub_server import StubConfig, StubServer
+from metrics import Histogram, StageMetrics
+
+
+# ============================================================
+# 把 shopify_auto_loop 指向替身服务
+# ============================================================
+
+REPLAY_BASE_URL = "http://bench-stub.invalid"
+
+
+def configure_worker(base: str, inventory_wait: float, log_dir: str, dedupe: bool = False):
+    loop.SHOPIFY_ADMIN_URL = base
+    loop.ZHIPU_CHAT_URL = f"{base}/api/paas/v4/chat/completions"
+    loop.COOKIE_URL = f"{base}/cookies.json"
+    loop.API_BASE_URL = base
+    loop.LOG_API_BASE_URL = base
+    loop.LOG_DIR = log_dir
+    loop.INVENTORY_WAIT_SECONDS = inventory_wait
+    loop.TASK_CHECKPOINT_ENABLED = False
+    loop.IMPORT_DEDUPE_ENABLED = dedupe      # 串行 / 并发两轮处理相同商品，默认关闭以免第二轮全部跳过
+
+    def fetch_one_task():
+        try:
+            resp = requests.get(f"{base}/bench/next-task", timeout=10)
+        except http_cassette.CassetteMiss:
+            return None
+        return resp.json() if resp.status_code == 200 else None
+
+    @loop.timed_stage('csrf')
+    def get_csrf_token_http(cookie_list: list) -> Optional[str]:
+        resp = requests.get(f"{base}/store/{loop.STORE_ID}/products?selectedView=all", timeout=15)
+        match = re.search(r'data-serialized-id="server-data">\s*(\{.*?\})\s*</script>',
+                          resp.text, re.DOTALL)
+        if not match:
+            return None
+        return loop.json.loads(match.group(1)).get('csrfToken')
+
+    loop.fetch_one_task = fetch_one_task
+    loop._get_csrf_token_selenium = get_csrf_token_http
+    loop._write_db_log = lambda *args, **kwargs: None
+    loop.stage_log_writer.flush = lambda: None
+    loop.report_stage_metrics = lambda: None
+
+
+# ============================================================
+# 运行与统计
+# ============================================================
+
+def _percentile_from_histogram(h: Histogram, pct: float) -> str:
+    """由直方图估算分位数（返回所在桶上界）"""
+    if not h.count:
+        return "-"
+    target = h.count * pct / 100
+    cumulative = 0
+    for bound, count in zip(h.buckets, h.counts):
+        cumulative += count
+        if cumulative >= target:
+            return f"≤{bound}s"
+    return f">{h.buckets[-1]}s"
+
+
+def run_mode(server: Optional[StubServer], tasks: int, workers: int) -> dict:
+    if server is not None:
+        server.reset_tasks(tasks)
+    loop.stage_metrics = StageMetrics()
+    analyzer = loop.ZhipuImageAnalyzer()
+    results = {"success": 0, "failed": 0, "skipped": 0}
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            result = loop.process_one_task(analyzer)
+            if result == 'skipped':
+                return
+            with lock:
+                results[result] = results.get(result, 0) + 1
+            if result == 'paused':     # 后台熔断，停止领取
+                return
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for f in [pool.submit(worker) for _ in range(workers)]:
+            f.result()
+    elapsed = time.perf_counter() - t0
+
+    done = results["success"] + results["failed"]
+    return {
+        "elapsed": elapsed,
+        "results": results,
+        "tasks_per_min": done / elapsed * 60 if elapsed else 0,
+        "stages": loop.stage_metrics.snapshot(),
+    }
+
+
+def print_report(label: str, report: dict):
+    print("=" * 72)
+    print(f"{label}: {report['results']}  耗时 {report['elapsed']:.2f}s  "
+          f"吞吐 {report['tasks_per_min']:.1f} 任务/分钟")
+    print(f"{'stage':18s} {'count':>6s} {'avg':>10s} {'p50':>10s} {'p95':>10s} {'p99':>10s}")
+    for stage, data in sorted(report["stages"].items()):
+        h = Histogram.from_dict(data)
+        avg = h.sum / h.count if h.count else 0
+        print(f"{stage:18s} {h.count:6d} {avg:9.3f}s "
+              f"{_percentile_from_histogram(h, 50):>10s} "
+              f"{_percentile_from_histogram(h, 95):>10s} "
+              f"{_percentile_from_histogram(h, 99):>10s}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="process_one_task 离线基准测试")
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--mode", choices=["serial", "concurrent", "both"], default="both")
+    parser.add_argument("--workers", type=int, default=4, help="并发模式的线程数")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=10)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--job-duration", type=float, default=0.5)
+    parser.add_argument("--variants", type=int, default=3)
+    parser.add_argument("--inventory-wait", type=float, default=0,
+                        help="覆盖 INVENTORY_WAIT_SECONDS（默认 0）")
+    parser.add_argument("--route-latency", action="append", default=[],
+                        help="按接口覆盖延迟，如 zhipu_chat=3000（可重复）")
+    parser.add_argument("--dedupe", action="store_true",
+                        help="启用导入去重（第二轮起相同商品将跳过导入）")
+    parser.add_argument("--record", metavar="CASSETTE", help="录制本次运行的全部 HTTP 请求")
+    parser.add_argument("--replay", metavar="CASSETTE", help="回放 cassette，不启动替身服务")
+    parser.add_argument("--replay-delay", choices=["original", "zero"], default="original")
+    args = parser.parse_args()
+
+    if args.replay:
+        http_cassette.install("replay", args.replay, args.replay_delay)
+        with tempfile.TemporaryDirectory() as log_dir:
+            configure_worker(REPLAY_BASE_URL, args.inventory_wait, log_dir, args.dedupe)
+            loop.init_global_api_keys()
+            print_report(f"回放({args.replay_delay})", run_mode(None, 0, 1))
+        return
+
+    route_latency = {}
+    for item in args.route_latency:
+        name, _, value = item.partition("=")
+        route_latency[name] = float(value)
+
+    config = StubConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                        error_rate=args.error_rate, job_duration=args.job_duration,
+                        variants=args.variants, route_latency_ms=route_latency)
+    server = StubServer(config).start()
+    if args.record:
+        http_cassette.install("record", args.record)
+    try:
+        with tempfile.TemporaryDirectory() as log_dir:
+            configure_worker(server.base_url, args.inventory_wait, log_dir, args.dedupe)
+            loop.init_global_api_keys()
+            if args.mode in ("serial", "both"):
+                print_report("串行", run_mode(server, args.tasks, 1))
+            if args.mode in ("concurrent", "both"):
+                print_report(f"并发({args.workers}线程)", run_mode(server, args.tasks, args.workers))
+            print("=" * 72)
+            print(f"替身服务请求数: {dict(sorted(server.request_counts.items()))}")
+    finally:
+        http_cassette.uninstall()
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
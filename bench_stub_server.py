@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+"""
+本地替身服务：模拟 shopify_auto_loop.py 依赖的全部外部接口，用于离线基准测试
+
+模拟的接口:
+  GET  /cookies.json                                  Cookie JSON（COOKIE_URL）
+  POST /api/zhipuai_key                               ZhipuAI 密钥列表（API_BASE_URL）
+  POST /api/task-data/save                            任务状态反馈（API_BASE_URL）
+  POST /api/shopify/cookie-status/report              Cookie 状态上报（LOG_API_BASE_URL）
+  POST /api/shopify/metrics/report                    阶段耗时上报（LOG_API_BASE_URL）
+  POST /api/paas/v4/chat/completions                  智谱 chat-completions（ZHIPU_CHAT_URL）
+  GET  /products/<handle>.json                        源店铺商品 JSON
+  GET  /store/<store>/products                        后台商品页（含 server-data csrfToken）
+  POST /api/operations/<hash>/<operation>/shopify/<store>
+       ProductCSVStageUploads / ProductImportCreate / ProductImportSubmit /
+       InventoryStagedUploads / InventoryImportCreate / InventoryImportSubmit
+  GET  /api/operations/<hash>/JobPoller/shopify/<store>
+  POST /gcs-upload                                    GCS 表单直传目标
+  GET  /bench/next-task                               取一条模拟任务（无任务时 204）
+
+每类接口可单独配置延迟（毫秒 + 抖动）与错误注入概率，见 StubConfig。
+
+单独运行:
+  python bench_stub_server.py --port 8900 --latency-ms 50 --error-rate 0.02
+"""
+
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib import parse
+
+
+# ============================================================
+# 配置
+# ============================================================
+
+@dataclass
+class StubConfig:
+    latency_ms: float = 0            # 所有接口的默认延迟
+    jitter_ms: float = 0             # 延迟随机抖动 ±jitter_ms
+    error_rate: float = 0.0          # 所有接口的默认错误概率（返回 HTTP 500）
+    route_latency_ms: Dict[str, float] = field(default_factory=dict)   # 按接口覆盖，键见 route_name
+    route_error_rate: Dict[str, float] = field(default_factory=dict)
+    job_duration: float = 0.5        # Shopify 异步 Job 从提交到 done 的秒数
+    variants: int = 3                # 每个模拟商品的变体数
+    images: int = 3                  # 每个模拟商品的图片数
+    tasks: int = 0                   # /bench/next-task 可发放的任务数
+    category: str = "Apparel & Accessories"
+
+    def latency_for(self, route: str) -> float:
+        base = self.route_latency_ms.get(route, self.latency_ms)
+        if self.jitter_ms:
+            base += random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, base) / 1000.0
+
+    def error_rate_for(self, route: str) -> float:
+        return self.route_error_rate.get(route, self.error_rate)
+
+
+# ============================================================
+# 响应构造（也供 http_cassette.py 导入抓包时生成响应）
+# ============================================================
+
+def build_cookie_json() -> list:
+    return [
+        {"name": "_shopify_s", "value": str(uuid.uuid4()), "domain": ".shopify.com", "path": "/"},
+        {"name": "_shopify_y", "value": str(uuid.uuid4()), "domain": ".shopify.com", "path": "/"},
+        {"name": "koa.sid", "value": uuid.uuid4().hex, "domain": "admin.shopify.com",
+         "path": "/", "secure": True, "httpOnly": True},
+    ]
+
+
+def build_product_json(handle: str, variants: int, images: int) -> dict:
+    return {"product": {
+        "id": abs(hash(handle)) % 10 ** 12,
+        "title": f"Bench Product {handle}",
+        "handle": handle,
+        "body_html": "<p>benchmark product</p>",
+        "vendor": "bench",
+        "product_type": "",
+        "tags": "bench, stub",
+        "options": [{"name": "Size"}],
+        "variants": [{
+            "id": i + 1, "title": f"S{i}", "price": "19.99", "compare_at_price": None,
+            "sku": f"{handle}-{i}", "available": True,
+            "option1": f"S{i}", "option2": None, "option3": None, "grams": 100,
+        } for i in range(variants)],
+        "images": [{
+            "id": i + 1, "src": f"https://cdn.example.com/{handle}/{i}.jpg",
+            "alt": None, "position": i + 1,
+        } for i in range(images)],
+    }}
+
+
+def build_admin_page(csrf_token: str) -> str:
+    server_data = json.dumps({"csrfToken": csrf_token})
+    return ('<html><head></head><body>'
+            f'<script type="text/json" data-serialized-id="server-data">{server_data}</script>'
+            '</body></html>')
+
+
+def _staged_target(base_url: str, filename: str) -> dict:
+    key = f"tmp/{uuid.uuid4().hex}/{filename}"
+    return {"url": f"{base_url}/gcs-upload", "resourceUrl": None, "parameters": [
+        {"name": "key", "value": key},
+        {"name": "Content-Type", "value": "text/csv"},
+        {"name": "policy", "value": uuid.uuid4().hex},
+    ]}
+
+
+class JobRegistry:
+    """记录模拟 Job 的创建时间，JobPoller 在 job_duration 秒后返回 done"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self) -> str:
+        job_id = f"gid://shopify/Job/{uuid.uuid4()}"
+        with self._lock:
+            self._jobs[job_id] = time.time()
+        return job_id
+
+    def is_done(self, job_id: str, duration: float) -> bool:
+        with self._lock:
+            created = self._jobs.get(job_id)
+        return created is None or time.time() - created >= duration
+
+
+def build_operation_response(operation: str, variables: dict, base_url: str,
+                             jobs: Optional[JobRegistry] = None,
+                             job_duration: float = 0.0) -> dict:
+    """按 admin GraphQL 操作名构造成功响应"""
+    jobs = jobs or JobRegistry()
+    if operation in ("ProductCSVStageUploads", "InventoryStagedUploads"):
+        filename = ((variables.get("input") or [{}])[0]).get("filename", "upload.csv")
+        return {"data": {"stagedUploadsCreate": {
+            "stagedTargets": [_staged_target(base_url, filename)], "userErrors": []}}}
+    if operation == "ProductImportCreate":
+        return {"data": {"productImportCreate": {
+            "productImport": {"id": f"gid://shopify/ProductImport/{random.randrange(10 ** 9)}"},
+            "userErrors": []}}}
+    if operation == "ProductImportSubmit":
+        return {"data": {"productImportSubmit": {
+            "productImport": {"id": variables.get("id"),
+                              "job": {"id": jobs.create(), "done": False}},
+            "userErrors": []}}}
+    if operation == "InventoryImportCreate":
+        return {"data": {"inventoryImportCreate": {
+            "inventoryImport": {"id": f"gid://shopify/InventoryImport/{random.randrange(10 ** 9)}"},
+            "userErrors": []}}}
+    if operation == "InventoryImportSubmit":
+        return {"data": {"inventoryImportSubmit": {
+            "job": {"id": jobs.create(), "done": False}, "userErrors": []}}}
+    if operation == "JobPoller":
+        job_id = variables.get("id", "")
+        return {"data": {"job": {"id": job_id, "done": jobs.is_done(job_id, job_duration)}}}
+    return {"data": {}}
+
+
+# ============================================================
+# HTTP 服务
+# ============================================================
+
+_OPERATION_RE = re.compile(r"^/api/operations/[0-9a-f]+/(\w+)/shopify/[^/]+$")
+
+
+def route_name(method: str, path: str) -> str:
+    """请求 → 路由名（用于按接口配置延迟 / 错误率）"""
+    m = _OPERATION_RE.match(path)
+    if m:
+        return m.group(1)
+    if path.startswith("/products/"):
+        return "product_json"
+    if path.startswith("/store/"):
+        return "admin_page"
+    return {
+        "/cookies.json": "cookies",
+        "/api/zhipuai_key": "zhipuai_key",
+        "/api/paas/v4/chat/completions": "zhipu_chat",
+        "/gcs-upload": "gcs_upload",
+        "/api/task-data/save": "feedback",
+        "/api/shopify/cookie-status/report": "cookie_report",
+        "/api/shopify/metrics/report": "metrics_report",
+        "/bench/next-task": "next_task",
+    }.get(path, "unknown")
+
+
+class StubServer:
+    def __init__(self, config: StubConfig, host: str = "127.0.0.1", port: int = 0):
+        self.config = config
+        self.jobs = JobRegistry()
+        self.cookies = build_cookie_json()   # 与真实 Cookie 文件一样，更新前内容不变
+        self.request_counts: Dict[str, int] = {}
+        self._issued = 0
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://{host}:{self.httpd.server_address[1]}"
+
+    def start(self) -> "StubServer":
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def next_task(self) -> Optional[dict]:
+        with self._lock:
+            if self._issued >= self.config.tasks:
+                return None
+            self._issued += 1
+            n = self._issued
+        return {
+            "keer_product_id": f"BENCH{n:06d}",
+            "client_product_url": f"{self.base_url}/products/bench-{n}",
+            "client_product_image": f"{self.base_url}/images/bench-{n}.jpg",
+            "quotation_result": json.dumps([{"quantity": 1, "nation": "US", "price": 10 + n % 7}]),
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+
+    def reset_tasks(self, tasks: int):
+        with self._lock:
+            self._issued = 0
+            self.config.tasks = tasks
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body=b"", content_type="application/json"):
+                if isinstance(body, (dict, list)):
+                    body = json.dumps(body).encode("utf-8")
+                elif isinstance(body, str):
+                    body = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_body(self) -> bytes:
+                length = int(self.headers.get("Content-Length") or 0)
+                return self.rfile.read(length) if length else b""
+
+            def _handle(self, method: str):
+                url = parse.urlsplit(self.path)
+                path = url.path
+                body = self._read_body() if method == "POST" else b""
+                name = route_name(method, path)
+                with stub._lock:
+                    stub.request_counts[name] = stub.request_counts.get(name, 0) + 1
+
+                delay = stub.config.latency_for(name)
+                if delay:
+                    time.sleep(delay)
+                if name != "next_task" and random.random() < stub.config.error_rate_for(name):
+                    self._send(500, {"errors": [{"message": f"injected error: {name}"}]})
+                    return
+
+                cfg = stub.config
+                m = _OPERATION_RE.match(path)
+                if m:
+                    if method == "GET":
+                        qs = parse.parse_qs(url.query)
+                        variables = json.loads(qs.get("variables", ["{}"])[0])
+                    else:
+                        variables = (json.loads(body or b"{}") or {}).get("variables") or {}
+                    self._send(200, build_operation_response(
+                        m.group(1), variables, stub.base_url, stub.jobs, cfg.job_duration))
+                elif name == "cookies":
+                    self._send(200, stub.cookies)
+                elif name == "zhipuai_key":
+                    self._send(200, {"success": True,
+                                     "data": [{"key": f"stub-key-{i}"} for i in range(3)]})
+                elif name == "zhipu_chat":
+                    self._send(200, {"choices": [{"message": {"content": cfg.category}}]})
+                elif name == "product_json":
+                    handle = path[len("/products/"):].rsplit(".json", 1)[0]
+                    self._send(200, build_product_json(handle, cfg.variants, cfg.images))
+                elif name == "admin_page":
+                    self._send(200, build_admin_page(uuid.uuid4().hex), "text/html")
+                elif name == "gcs_upload":
+                    self._send(204)
+                elif name in ("feedback", "cookie_report", "metrics_report"):
+                    self._send(200, {"code": 0, "msg": "success", "data": None})
+                elif name == "next_task":
+                    task = stub.next_task()
+                    if task is None:
+                        self._send(204)
+                    else:
+                        self._send(200, task)
+                else:
+                    self._send(404, {"errors": [{"message": f"no stub for {path}"}]})
+
+            def do_GET(self):
+                self._handle("GET")
+
+            def do_POST(self):
+                self._handle("POST")
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="shopify_auto_loop 本地替身服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--job-duration", type=float, default=0.5)
+    parser.add_argument("--tasks", type=int, default=100)
+    args = parser.parse_args()
+
+    config = StubConfig(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                        error_rate=args.error_rate, job_duration=args.job_duration,
+                        tasks=args.tasks)
+    server = StubServer(config, args.host, args.port)
+    print(f"替身服务已启动: {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
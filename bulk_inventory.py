@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+全店批量库存对账
+
+读取 Shopify 库存导出文件，按规则计算每个变体的目标库存，只把变化的行
+按 Shopify 导入大小分块提交（InventoryStagedUploads / InventoryImportCreate /
+InventoryImportSubmit），多块并发等待导入完成，逐块输出进度与吞吐量。
+规则格式见 inventory_export.py「批量对账」一节。
+
+运行方式:
+  # 把主仓库所有变体重置为 100（不传 --rules 时使用 --quantity 与店铺主仓库位置）
+  python bulk_inventory.py export.csv --quantity 100
+  python bulk_inventory.py export.csv --rules rules.json --store-id 893848-2 --chunk-rows 2000
+  python bulk_inventory.py export.csv --rules rules.json --dry-run     # 只生成分块文件
+  # 小批量补货：只把变化的行合成一个文件单次导入（restock_from_export），可限定 handle
+  python bulk_inventory.py export.csv --single --quantity 100 --handles a-handle,b-handle
+"""
+
+import argparse
+import json
+
+import shopify_auto_loop as loop
+from inventory_export import QuantityRule, load_rules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全店批量库存对账")
+    parser.add_argument("export_file", help="Shopify 库存导出 CSV")
+    parser.add_argument("--rules", help="规则文件（JSON）")
+    parser.add_argument("--quantity", type=int, default=loop.INVENTORY_QUANTITY,
+                        help="未指定 --rules 时，主仓库位置的目标库存")
+    parser.add_argument("--store-id", help="店铺（来自 stores.json；默认单店铺配置）")
+    parser.add_argument("--chunk-rows", type=int, default=loop.INVENTORY_BULK_CHUNK_ROWS)
+    parser.add_argument("--max-inflight", type=int, default=loop.INVENTORY_BULK_MAX_INFLIGHT)
+    parser.add_argument("--dry-run", action="store_true", help="只生成分块文件，不提交")
+    parser.add_argument("--single", action="store_true",
+                        help="不分块，变化的行单次导入（不支持 --rules / --dry-run）")
+    parser.add_argument("--handles", help="--single 时只处理这些 handle（逗号分隔）")
+    args = parser.parse_args()
+    if args.single and (args.rules or args.dry_run):
+        parser.error("--single 不支持 --rules / --dry-run")
+
+    store = loop.default_store()
+    if args.store_id:
+        stores = {s.store_id: s for s in loop.load_stores(loop.STORES_CONFIG_PATH)}
+        if args.store_id not in stores:
+            parser.error(f"{loop.STORES_CONFIG_PATH} 中没有店铺 {args.store_id}")
+        store = stores[args.store_id]
+
+    with loop.use_store(store):
+        if args.single:
+            handles = {h.strip() for h in (args.handles or '').split(',') if h.strip()} or None
+            ok = loop.restock_from_export(args.export_file, quantity=args.quantity, handles=handles)
+            raise SystemExit(0 if ok else 1)
+        if args.rules:
+            rules = load_rules(args.rules)
+        else:
+            rules = [QuantityRule(op='set', value=args.quantity,
+                                  location=store.inventory_location_name)]
+        loop.log_info(f"店铺 {store.store_id}，规则 {len(rules)} 条，"
+                      f"每块至多 {args.chunk_rows} 行，并发 {args.max_inflight} 块")
+        stats = loop.bulk_reconcile_inventory(args.export_file, rules,
+                                              chunk_rows=args.chunk_rows,
+                                              max_inflight=args.max_inflight,
+                                              dry_run=args.dry_run)
+
+    print("=" * 60)
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
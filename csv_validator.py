@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+"""
+上传前的 CSV 本地校验
+
+generate_shopify_csv / generate_inventory_csv 的输出在上传前先按 Shopify 导入约束检查，
+能安全修正的问题直接修正并覆盖原文件，无法修正的问题拒绝上传并给出具体原因，
+避免经过 staged upload / GCS / Create / Submit 与后台 Job 几分钟后才失败。
+
+  validate_product_csv    产品导入 CSV
+  validate_inventory_csv  库存导入 CSV
+
+修正（repairs）:
+  - URL handle 含空白或 URL 保留字符 → 替换为连字符（café-crème 等 Unicode handle 保持不变，
+    避免已导入商品换 handle 后被重复创建）；handle 为空 → 由标题生成
+  - Title / SEO title / SEO description 超长 → 截断
+  - 图片地址为 //cdn... → 补 https:；其他非 http(s) 图片地址 → 删除该图片
+  - 重复的选项组合 → 只保留第一行
+  - 变体缺少 Option1 value → Default Title
+  - 库存 CSV 中重复的 (Handle, 选项, Location) 行 → 只保留第一行
+拒绝（errors）:
+  - 缺少必需列、没有任何变体、标题为空
+  - URL handle 为空且无法由标题生成
+  - 变体数超过 SHOPIFY_MAX_VARIANTS
+  - 价格不是非负数、库存数量不是整数
+"""
+
+import csv
+import re
+from dataclasses import dataclass, field
+from typing import List
+
+from inventory_export import NOT_STOCKED
+
+
+SHOPIFY_MAX_VARIANTS    = 100
+SHOPIFY_MAX_HANDLE      = 255
+SHOPIFY_MAX_TITLE       = 255
+SHOPIFY_MAX_SEO_TITLE   = 70
+SHOPIFY_MAX_SEO_DESC    = 320
+SHOPIFY_MAX_OPTION_VALUE = 255
+
+PRODUCT_REQUIRED_COLUMNS   = ('Title', 'URL handle', 'Option1 value', 'Price', 'Product image URL')
+INVENTORY_REQUIRED_COLUMNS = ('Handle', 'Location', 'On hand (new)')
+
+_HANDLE_FORBIDDEN_RE = re.compile(r'[\s/?#%&<>"\'\\]+')
+_TITLE_SLUG_RE      = re.compile(r'[\W_]+')
+
+
+@dataclass
+class ValidationResult:
+    path: str
+    handle: str = ''
+    errors: List[str] = field(default_factory=list)
+    repairs: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    @property
+    def reason(self) -> str:
+        return '; '.join(self.errors)
+
+
+def normalize_handle(value: str) -> str:
+    """只替换空白与 URL 保留字符，其余字符（含非 ASCII）原样保留"""
+    return _HANDLE_FORBIDDEN_RE.sub('-', (value or '').strip()).strip('-')[:SHOPIFY_MAX_HANDLE]
+
+
+def handle_from_title(title: str) -> str:
+    return _TITLE_SLUG_RE.sub('-', (title or '').lower()).strip('-')[:SHOPIFY_MAX_HANDLE]
+
+
+def _read(path: str):
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.DictReader(f)
+        return list(reader.fieldnames or []), list(reader)
+
+
+def _write(path: str, headers: list, rows: list):
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, fieldnames=headers)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _is_number(value: str) -> bool:
+    try:
+        return float(value) >= 0
+    except (TypeError, ValueError):
+        return False
+
+
+# ============================================================
+# 产品 CSV
+# ============================================================
+
+def _is_variant_row(row: dict) -> bool:
+    """图片附加行只有 handle 与图片字段；变体行带价格或 SKU"""
+    return bool(row.get('Price') or row.get('SKU'))
+
+
+def _truncate(row: dict, column: str, limit: int, result: ValidationResult):
+    value = row.get(column) or ''
+    if len(value) > limit:
+        row[column] = value[:limit]
+        result.repairs.append(f"{column} 超过 {limit} 字符，已截断")
+
+
+def _repair_image(row: dict, column: str, result: ValidationResult) -> bool:
+    """返回 False 表示图片地址无效且已清空"""
+    url = (row.get(column) or '').strip()
+    if not url:
+        return True
+    if url.startswith('//'):
+        row[column] = 'https:' + url
+        result.repairs.append(f"{column} 缺少协议，已补 https:")
+        return True
+    if not re.match(r'^https?://[^\s/]+/\S*$', url):
+        row[column] = ''
+        result.repairs.append(f"{column} 无效（{url[:80]}），已删除")
+        return False
+    return True
+
+
+def validate_product_csv(path: str, repair: bool = True) -> ValidationResult:
+    result = ValidationResult(path)
+    try:
+        headers, rows = _read(path)
+    except (OSError, csv.Error, UnicodeDecodeError) as e:
+        result.errors.append(f"无法读取 CSV: {e}")
+        return result
+
+    missing = [c for c in PRODUCT_REQUIRED_COLUMNS if c not in headers]
+    if missing:
+        result.errors.append(f"缺少列: {', '.join(missing)}")
+        return result
+
+    variants = [r for r in rows if _is_variant_row(r)]
+    if not variants:
+        result.errors.append("没有任何变体行")
+        return result
+
+    first = variants[0]
+    title = (first.get('Title') or '').strip()
+    if not title:
+        result.errors.append("商品标题为空")
+
+    # URL handle：所有行必须一致且合法
+    handle = first.get('URL handle') or ''
+    fixed = normalize_handle(handle) or handle_from_title(title)
+    if not fixed:
+        result.errors.append("URL handle 为空且无法由标题生成")
+    result.handle = fixed
+    if fixed and (fixed != handle or any((r.get('URL handle') or '') != fixed for r in rows)):
+        for r in rows:
+            r['URL handle'] = fixed
+        result.repairs.append(f"URL handle 已规范化: {handle!r} → {fixed!r}")
+
+    _truncate(first, 'Title', SHOPIFY_MAX_TITLE, result)
+    if 'SEO title' in headers:
+        _truncate(first, 'SEO title', SHOPIFY_MAX_SEO_TITLE, result)
+    if 'SEO description' in headers:
+        _truncate(first, 'SEO description', SHOPIFY_MAX_SEO_DESC, result)
+
+    # 变体：选项组合去重、价格检查
+    seen, kept, bad_prices = set(), [], []
+    for r in rows:
+        if not _is_variant_row(r):
+            kept.append(r)
+            continue
+        if not (r.get('Option1 value') or '').strip():
+            r['Option1 value'] = 'Default Title'
+            result.repairs.append("变体缺少 Option1 value，已设为 Default Title")
+        for col in ('Option1 value', 'Option2 value', 'Option3 value'):
+            if col in headers:
+                _truncate(r, col, SHOPIFY_MAX_OPTION_VALUE, result)
+        combo = tuple(r.get(c) or '' for c in ('Option1 value', 'Option2 value', 'Option3 value'))
+        if combo in seen:
+            result.repairs.append(f"重复的选项组合 {'/'.join(v for v in combo if v)}，已删除（SKU={r.get('SKU') or '-'}）")
+            continue
+        seen.add(combo)
+        if not _is_number(r.get('Price')):
+            bad_prices.append(r)
+        kept.append(r)
+    rows = kept
+    if bad_prices:
+        sample = bad_prices[0]
+        result.errors.append(f"{len(bad_prices)} 个变体价格无效，如 {sample.get('Price')!r}（SKU={sample.get('SKU') or '-'}）")
+
+    variant_count = sum(1 for r in rows if _is_variant_row(r))
+    if variant_count > SHOPIFY_MAX_VARIANTS:
+        result.errors.append(f"变体数 {variant_count} 超过 Shopify 上限 {SHOPIFY_MAX_VARIANTS}")
+
+    # 图片：地址无效的附加图片行整行删除，主图 / 变体图只清空字段
+    kept = []
+    for r in rows:
+        valid = _repair_image(r, 'Product image URL', result)
+        if 'Variant image URL' in headers:
+            _repair_image(r, 'Variant image URL', result)
+        if not valid and not _is_variant_row(r):
+            continue
+        if not valid and 'Image position' in headers:
+            r['Image position'] = ''
+            if 'Image alt text' in headers:
+                r['Image alt text'] = ''
+        kept.append(r)
+    rows = kept
+
+    if result.ok and result.repairs and repair:
+        _write(path, headers, rows)
+    return result
+
+
+# ============================================================
+# 库存 CSV
+# ============================================================
+
+def validate_inventory_csv(path: str, handle: str = '', repair: bool = True) -> ValidationResult:
+    """handle: 产品 CSV 校验后的 URL handle，库存行统一改为该值以保证两份文件一致"""
+    result = ValidationResult(path, handle=handle)
+    try:
+        headers, rows = _read(path)
+    except (OSError, csv.Error, UnicodeDecodeError) as e:
+        result.errors.append(f"无法读取 CSV: {e}")
+        return result
+
+    missing = [c for c in INVENTORY_REQUIRED_COLUMNS if c not in headers]
+    if missing:
+        result.errors.append(f"缺少列: {', '.join(missing)}")
+        return result
+
+    seen, kept = set(), []
+    for r in rows:
+        handle = r.get('Handle') or ''
+        fixed = result.handle or normalize_handle(handle)
+        if not fixed:
+            result.errors.append(f"库存行缺少 Handle（SKU={r.get('SKU') or '-'}）")
+            continue
+        if fixed != handle:
+            r['Handle'] = fixed
+            result.repairs.append(f"Handle 已规范化: {handle!r} → {fixed!r}")
+        if not (r.get('Location') or '').strip():
+            result.errors.append(f"库存行缺少 Location（Handle={fixed}, SKU={r.get('SKU') or '-'}）")
+            continue
+        new = (r.get('On hand (new)') or '').strip()
+        if new and new.lower() != NOT_STOCKED and not re.fullmatch(r'-?\d+', new):
+            result.errors.append(f"On hand (new) 不是整数: {new!r}（Handle={fixed}, SKU={r.get('SKU') or '-'}）")
+        key = (fixed, r.get('Option1 Value') or '', r.get('Option2 Value') or '',
+               r.get('Option3 Value') or '', r.get('Location'))
+        if key in seen:
+            result.repairs.append(f"重复的库存行 {'/'.join(v for v in key[1:4] if v)} @ {key[4]}，已删除")
+            continue
+        seen.add(key)
+        kept.append(r)
+
+    if not kept and not result.errors:
+        result.errors.append("没有任何库存行")
+
+    if result.ok and result.repairs and repair:
+        _write(path, headers, kept)
+    return result
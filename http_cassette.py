@@ -0,0 +1,398 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP 录制 / 回放（cassette）
+
+shopify_auto_loop.py 的所有出站请求（requests.get/post 与 Session）最终都经过
+requests.Session.send，本模块在这一层挂钩：
+  - record : 正常发出请求，同时把请求/响应及耗时追加写入 cassette（JSONL）
+  - replay : 不发出网络请求，按录制顺序返回响应；可按原始耗时或零延迟回放
+
+请求匹配键为 (method, URL 路径, GraphQL operationName)，忽略主机与查询串，
+同一键的多次请求按录制顺序依次返回；用完即视为未命中。
+录制时不保存 Cookie / Authorization / x-csrf-token 等敏感请求头，响应体中的凭据
+（Cookie JSON 的 value（数组或 storage_state 格式）、ZhipuAI 密钥、后台页面中的 csrfToken）
+与请求体中的 shopify_session_token / shopify_multitrack_token 替换为占位值后再写入。
+
+注意：只有经过 requests 的请求会被录制 / 回放。run_forever 获取 CSRF token 时
+_get_csrf_token_selenium 启动真实 Chrome 访问 admin.shopify.com，不经过
+requests.Session.send，回放模式下仍会访问线上后台（bench_pipeline 已将其替换为
+经过 requests 的实现）。
+
+从抓包生成 cassette（仓库中的 curl 文件只有请求，没有响应；
+admin GraphQL 操作的响应由 bench_stub_server 构造，其余返回空 200）：
+  python http_cassette.py import-curl curl cassettes/curl_capture.jsonl
+"""
+
+import argparse
+import base64
+import json
+import re
+import shlex
+import threading
+import time
+from collections import deque
+from datetime import timedelta
+from urllib import parse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+
+SENSITIVE_HEADERS = {"cookie", "authorization", "x-csrf-token", "set-cookie"}
+
+# 抓包导入时默认忽略的埋点 / 遥测请求
+TELEMETRY_HOSTS = (
+    "otlp-http-production.shopifysvc.com",
+    "monorail-edge.shopifysvc.com",
+    "translate-pa.googleapis.com",
+    "cdn.shopify.com",
+)
+
+
+GCS_STAGED_UPLOAD_URL = "https://shopify-staged-uploads.storage.googleapis.com/"
+
+REDACTED = "REDACTED"
+_CSRF_TOKEN_RE = re.compile(r'("csrfToken"\s*:\s*")[^"]*(")')
+# 请求体（admin GraphQL 的 client context）中的会话令牌
+_SESSION_TOKEN_RE = re.compile(r'("shopify_(?:session|multitrack)_token"\s*:\s*")[^"]*(")')
+
+
+class CassetteMiss(requests.exceptions.ConnectionError):
+    """回放时找不到匹配的录制记录"""
+
+
+# ============================================================
+# 记录格式
+# ============================================================
+
+def _operation_name(body) -> str:
+    if not body:
+        return ""
+    if isinstance(body, bytes):
+        try:
+            body = body.decode("utf-8")
+        except UnicodeDecodeError:
+            return ""
+    if not isinstance(body, str) or not body.lstrip().startswith("{"):
+        return ""
+    try:
+        return (json.loads(body) or {}).get("operationName") or ""
+    except (ValueError, AttributeError):
+        return ""
+
+
+def match_key(method: str, url: str, body=None) -> tuple:
+    parts = parse.urlsplit(url)
+    operation = _operation_name(body)
+    if not operation and parts.query:
+        operation = parse.parse_qs(parts.query).get("operationName", [""])[0]
+    return method.upper(), parts.path, operation
+
+
+def _encode_body(body) -> dict:
+    if body is None:
+        return {"encoding": "none", "data": ""}
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if not isinstance(body, bytes):     # 流式上传（文件对象等）只记录类型
+        return {"encoding": "none", "data": ""}
+    try:
+        return {"encoding": "utf-8", "data": body.decode("utf-8")}
+    except UnicodeDecodeError:
+        return {"encoding": "base64", "data": base64.b64encode(body).decode("ascii")}
+
+
+def _decode_body(data: dict) -> bytes:
+    if data["encoding"] == "utf-8":
+        return data["data"].encode("utf-8")
+    if data["encoding"] == "base64":
+        return base64.b64decode(data["data"])
+    return b""
+
+
+def _safe_headers(headers) -> dict:
+    return {k: v for k, v in (headers or {}).items() if k.lower() not in SENSITIVE_HEADERS}
+
+
+def _is_cookie_list(data) -> bool:
+    return (isinstance(data, list) and bool(data)
+            and all(isinstance(c, dict) and "name" in c and "value" in c for c in data))
+
+
+def _redact_cookie_json(data) -> bool:
+    """
+    Cookie JSON 的两种格式（与 download_cookies 一致）：Cookie 数组，或 Playwright
+    storage_state 的 {"cookies": [...], "origins": [...]}。已替换返回 True
+    """
+    if _is_cookie_list(data):
+        cookies = data
+    elif isinstance(data, dict) and _is_cookie_list(data.get("cookies")):
+        cookies = data["cookies"]
+        for origin in data.get("origins") or []:
+            for item in (origin.get("localStorage") or []) if isinstance(origin, dict) else []:
+                if isinstance(item, dict) and "value" in item:
+                    item["value"] = REDACTED
+    else:
+        return False
+    for cookie in cookies:
+        cookie["value"] = REDACTED
+    return True
+
+
+def redact_response_body(url: str, body):
+    """替换响应体中的凭据；非文本响应原样返回"""
+    if isinstance(body, bytes):
+        try:
+            body = body.decode("utf-8")
+        except UnicodeDecodeError:
+            return body
+    if not isinstance(body, str) or not body:
+        return body
+
+    data = None
+    if body.lstrip()[:1] in ("{", "["):
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = None
+    if _redact_cookie_json(data):
+        return json.dumps(data, ensure_ascii=False)
+    if parse.urlsplit(url).path.endswith("/api/zhipuai_key") and isinstance(data, dict):
+        for i, item in enumerate(data.get("data") or []):
+            if isinstance(item, dict) and "key" in item:
+                item["key"] = f"{REDACTED}-{i}"
+        return json.dumps(data, ensure_ascii=False)
+    return _CSRF_TOKEN_RE.sub(lambda m: f"{m.group(1)}{REDACTED}{m.group(2)}", body)
+
+
+def redact_request_body(body):
+    """替换请求体中的 Shopify 会话令牌；非文本请求体原样返回"""
+    if isinstance(body, bytes):
+        try:
+            text = body.decode("utf-8")
+        except UnicodeDecodeError:
+            return body
+        return _SESSION_TOKEN_RE.sub(lambda m: f"{m.group(1)}{REDACTED}{m.group(2)}", text).encode("utf-8")
+    if isinstance(body, str):
+        return _SESSION_TOKEN_RE.sub(lambda m: f"{m.group(1)}{REDACTED}{m.group(2)}", body)
+    return body
+
+
+def make_interaction(method: str, url: str, req_headers, req_body,
+                     status: int, resp_headers, resp_body, elapsed: float,
+                     synthetic: bool = False) -> dict:
+    return {
+        "request": {
+            "method": method.upper(),
+            "url": url,
+            "headers": _safe_headers(req_headers),
+            "body": _encode_body(redact_request_body(req_body)),
+        },
+        "response": {
+            "status": status,
+            "headers": _safe_headers(resp_headers),
+            "body": _encode_body(redact_response_body(url, resp_body)),
+        },
+        "elapsed": elapsed,
+        "synthetic": synthetic,
+    }
+
+
+def load_cassette(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+# ============================================================
+# 录制 / 回放
+# ============================================================
+
+class _Recorder:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, original_send, session, request, **kwargs):
+        t0 = time.perf_counter()
+        response = original_send(session, request, **kwargs)
+        elapsed = time.perf_counter() - t0
+        interaction = make_interaction(
+            request.method, request.url, request.headers, request.body,
+            response.status_code, response.headers, response.content, elapsed)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(interaction, ensure_ascii=False) + "\n")
+        return response
+
+
+class _Player:
+    def __init__(self, path: str, delay: str = "original"):
+        if delay not in ("original", "zero"):
+            raise ValueError("delay 取值为 original 或 zero")
+        self.delay = delay
+        self._queues = {}
+        self._lock = threading.Lock()
+        for item in load_cassette(path):
+            req = item["request"]
+            key = match_key(req["method"], req["url"], _decode_body(req["body"]))
+            self._queues.setdefault(key, deque()).append(item)
+
+    def __call__(self, original_send, session, request, **kwargs):
+        key = match_key(request.method, request.url, request.body)
+        with self._lock:
+            queue = self._queues.get(key)
+            item = queue.popleft() if queue else None
+        if item is None:
+            raise CassetteMiss(f"cassette 中没有匹配的记录: {key}", request=request)
+
+        if self.delay == "original" and item.get("elapsed"):
+            time.sleep(item["elapsed"])
+
+        resp_data = item["response"]
+        response = requests.Response()
+        response.status_code = resp_data["status"]
+        response.headers = CaseInsensitiveDict(resp_data["headers"])
+        response._content = _decode_body(resp_data["body"])
+        response.url = request.url
+        response.request = request
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers) or "utf-8"
+        response.elapsed = timedelta(seconds=item.get("elapsed") or 0)
+        response.reason = "OK" if response.status_code < 400 else "Error"
+        return response
+
+    def remaining(self) -> int:
+        with self._lock:
+            return sum(len(q) for q in self._queues.values())
+
+
+_original_send = requests.Session.send
+_active = None
+
+
+def install(mode: str, path: str, delay: str = "original"):
+    """mode: record / replay；重复调用会替换当前的录制或回放"""
+    global _active
+    if mode == "record":
+        handler = _Recorder(path)
+    elif mode == "replay":
+        handler = _Player(path, delay)
+    else:
+        raise ValueError(f"未知的 cassette 模式: {mode}")
+
+    def send(session, request, **kwargs):
+        return handler(_original_send, session, request, **kwargs)
+
+    requests.Session.send = send
+    _active = handler
+    return handler
+
+
+def uninstall():
+    global _active
+    requests.Session.send = _original_send
+    _active = None
+
+
+# ============================================================
+# 从 curl 抓包导入
+# ============================================================
+
+def parse_curl_file(text: str) -> list:
+    """解析浏览器“复制为 cURL”导出的命令序列，返回 [(method, url, headers, body)]"""
+    tokens = shlex.split(text.replace("\\\n", " "))
+    commands, current = [], None
+    for tok in tokens:
+        if tok == "curl":
+            current = []
+            commands.append(current)
+        elif current is not None:
+            current.append(tok.rstrip(";") if tok.endswith(";") and tok != ";" else tok)
+
+    requests_out = []
+    for args in commands:
+        url, method, headers, body = None, None, {}, None
+        it = iter(args)
+        for tok in it:
+            if tok in ("-H", "--header"):
+                name, _, value = next(it, "").partition(":")
+                headers[name.strip()] = value.strip()
+            elif tok in ("--data-raw", "--data", "-d", "--data-binary"):
+                body = next(it, "")
+            elif tok in ("-X", "--request"):
+                method = next(it, "GET").upper()
+            elif tok in ("-b", "--cookie"):
+                next(it, None)           # 不导入 Cookie
+            elif tok.startswith("-") or tok == ";":
+                continue
+            elif url is None:
+                url = tok
+        if url:
+            requests_out.append((method or ("POST" if body is not None else "GET"), url, headers, body))
+    return requests_out
+
+
+def import_curl(curl_path: str, out_path: str, include_telemetry: bool = False) -> int:
+    from bench_stub_server import build_operation_response
+
+    with open(curl_path, "r", encoding="utf-8") as f:
+        captured = parse_curl_file(f.read())
+
+    count = 0
+    with open(out_path, "w", encoding="utf-8") as out:
+        for method, url, headers, body in captured:
+            host = parse.urlsplit(url).netloc
+            if method == "OPTIONS":
+                continue
+            if not include_telemetry and (host in TELEMETRY_HOSTS or url.endswith("/.well-known/dux")):
+                continue
+
+            operation = match_key(method, url, body)[2]
+            if operation:
+                if method == "GET":
+                    qs = parse.parse_qs(parse.urlsplit(url).query)
+                    variables = json.loads(qs.get("variables", ["{}"])[0])
+                else:
+                    variables = (json.loads(body) or {}).get("variables") or {}
+                result = build_operation_response(operation, variables, "", job_duration=0)
+                # 与抓包中 GCS 直传的地址保持一致，回放时才能匹配上传请求
+                for target in (result["data"].get("stagedUploadsCreate") or {}).get("stagedTargets", []):
+                    target["url"] = GCS_STAGED_UPLOAD_URL
+                resp_body = json.dumps(result)
+                resp_headers = {"Content-Type": "application/json"}
+            else:
+                resp_body = ""
+                resp_headers = {}
+
+            status = 204 if "storage.googleapis.com" in host and method == "POST" else 200
+            out.write(json.dumps(make_interaction(
+                method, url, headers, body, status, resp_headers, resp_body,
+                elapsed=0.0, synthetic=True), ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP cassette 工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_import = sub.add_parser("import-curl", help="把 curl 抓包转换为 cassette")
+    p_import.add_argument("curl_file")
+    p_import.add_argument("out_file")
+    p_import.add_argument("--include-telemetry", action="store_true")
+
+    p_show = sub.add_parser("show", help="列出 cassette 中的请求")
+    p_show.add_argument("cassette")
+
+    args = parser.parse_args()
+    if args.command == "import-curl":
+        n = import_curl(args.curl_file, args.out_file, args.include_telemetry)
+        print(f"已导入 {n} 条记录: {args.out_file}")
+    elif args.command == "show":
+        for item in load_cassette(args.cassette):
+            req = item["request"]
+            key = match_key(req["method"], req["url"], _decode_body(req["body"]))
+            print(f"{item['response']['status']}  {item.get('elapsed', 0):7.3f}s  {key}")
+
+
+if __name__ == "__main__":
+    main()
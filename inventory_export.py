@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""
+Shopify 库存导出 CSV 解析与增量导入
+
+库存导出 / 导入使用同一种格式（见 inventory_export_updated.csv）：每个变体在每个
+仓库位置一行，"On hand (current)" 为导出时的库存，"On hand (new)" 为要设置的新库存，
+未在该位置备货时为 "not stocked"。
+
+  iter_export     逐行读取导出文件（流式，不把整个文件读入内存）
+  InventoryIndex  按 (Handle, SKU, Location) 索引当前库存
+  delta_rows      只保留当前库存与目标数量不同的行，生成最小的库存导入
+  write_inventory_csv  写出可直接导入 Shopify 的库存 CSV
+  iter_reconcile_chunks  全店批量对账：按规则计算目标库存，按 Shopify 导入大小分块输出变化行
+
+运行方式:
+  # 以导出文件中的 On hand (new) 为目标，只保留有变化的行
+  python inventory_export.py delta inventory_export_updated.csv inventory_delta.csv
+  # 把某个位置的所有变体补货到 100
+  python inventory_export.py delta export.csv inventory_delta.csv --location 牟平区北关大街845 --quantity 100
+  # 按规则文件对账，只统计不提交（提交见 bulk_inventory.py）
+  python inventory_export.py reconcile export.csv --rules rules.json
+"""
+
+import argparse
+import csv
+import json
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+
+INVENTORY_HEADERS = [
+    'Handle', 'Title',
+    'Option1 Name', 'Option1 Value',
+    'Option2 Name', 'Option2 Value',
+    'Option3 Name', 'Option3 Value',
+    'SKU', 'HS Code', 'COO',
+    'Location', 'Bin name',
+    'Incoming (not editable)', 'Unavailable (not editable)',
+    'Committed (not editable)', 'Available (not editable)',
+    'On hand (current)', 'On hand (new)'
+]
+
+NOT_STOCKED = 'not stocked'
+
+InventoryKey = Tuple[str, str, str]     # (Handle, SKU, Location)
+
+
+# ============================================================
+# 解析
+# ============================================================
+
+def parse_on_hand(value: str) -> Optional[int]:
+    """库存数量；空值或 not stocked 返回 None"""
+    value = (value or '').strip()
+    if not value or value.lower() == NOT_STOCKED:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+
+def inventory_key(row: dict) -> InventoryKey:
+    return (row.get('Handle') or '', row.get('SKU') or '', row.get('Location') or '')
+
+
+def iter_export(path: str) -> Iterator[dict]:
+    """逐行读取库存导出文件；缺少必需列时抛出 ValueError"""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        reader = csv.DictReader(f)
+        missing = [h for h in ('Handle', 'SKU', 'Location', 'On hand (current)')
+                   if h not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"不是 Shopify 库存导出文件，缺少列: {', '.join(missing)}")
+        for row in reader:
+            yield row
+
+
+class InventoryIndex:
+    """(Handle, SKU, Location) → 当前库存（未备货为 None）"""
+
+    def __init__(self):
+        self._on_hand: Dict[InventoryKey, Optional[int]] = {}
+
+    @classmethod
+    def from_export(cls, path: str, locations: Optional[set] = None) -> "InventoryIndex":
+        index = cls()
+        for row in iter_export(path):
+            if locations and row.get('Location') not in locations:
+                continue
+            index._on_hand[inventory_key(row)] = parse_on_hand(row.get('On hand (current)'))
+        return index
+
+    def __len__(self):
+        return len(self._on_hand)
+
+    def __contains__(self, key: InventoryKey):
+        return key in self._on_hand
+
+    def get(self, handle: str, sku: str, location: str) -> Optional[int]:
+        return self._on_hand.get((handle, sku, location))
+
+    def stocked(self, handle: str, sku: str, location: str) -> bool:
+        return self._on_hand.get((handle, sku, location)) is not None
+
+
+# ============================================================
+# 增量
+# ============================================================
+
+def make_target(quantity: Optional[int] = None, location: Optional[str] = None,
+                handles: Optional[set] = None) -> Callable[[dict], Optional[int]]:
+    """
+    目标数量函数：quantity 为 None 时使用导出文件自身的 On hand (new)，
+    否则把所有变体设为 quantity；location / handles 限定处理范围。
+    """
+    def target(row: dict) -> Optional[int]:
+        if location and row.get('Location') != location:
+            return None
+        if handles and row.get('Handle') not in handles:
+            return None
+        if quantity is None:
+            return parse_on_hand(row.get('On hand (new)'))
+        return quantity
+    return target
+
+
+def delta_rows(rows: Iterable[dict],
+               target: Optional[Callable[[dict], Optional[int]]] = None) -> Iterator[dict]:
+    """
+    只输出需要修改的行：目标数量不为 None、该位置已备货、且与当前库存不同。
+    输出行保留导出时的 On hand (current)，On hand (new) 为目标数量。
+    target 默认取导出文件的 On hand (new)。
+    """
+    target = target or make_target()
+    for row in rows:
+        new = target(row)
+        if new is None:
+            continue
+        current = parse_on_hand(row.get('On hand (current)'))
+        if current is None or current == new:
+            continue
+        out = {h: row.get(h, '') or '' for h in INVENTORY_HEADERS}
+        out['On hand (current)'] = str(current)
+        out['On hand (new)'] = str(new)
+        yield out
+
+
+def write_inventory_csv(rows: Iterable[dict], path: str) -> int:
+    """写出库存导入 CSV，返回数据行数"""
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+        writer = csv.DictWriter(f, fieldnames=INVENTORY_HEADERS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+
+# ============================================================
+# 批量对账
+#
+# 导出文件按 batch_rows 行一批流式读取（内存只保留当前批次与未输出的分块），
+# 每批先取出 Location / Handle / SKU / On hand 各列，再逐条规则对整列计算命中掩码
+# 并更新目标列，最后把目标与当前不同的行攒成 chunk_rows 行一块输出。
+#
+# 规则文件（JSON 数组，按顺序应用，后面的规则覆盖前面的结果）：
+#   [{"location": "牟平区北关大街845", "set": 100},
+#    {"location": "牟平区北关大街845", "sku_prefix": "DWOD1-", "min": 20},
+#    {"handle": "some-handle", "add": -5}]
+# 匹配条件 location / handle / sku_prefix 均可省略（省略即匹配全部）；
+# 操作为 set（设为）/ add（增减）/ min（至少）/ max（至多）之一，结果不小于 0。
+# 未备货（not stocked）的行不修改。
+# ============================================================
+
+RULE_OPS = ('set', 'add', 'min', 'max')
+
+
+@dataclass
+class QuantityRule:
+    op: str
+    value: int
+    location: str = ''
+    handle: str = ''
+    sku_prefix: str = ''
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "QuantityRule":
+        ops = [op for op in RULE_OPS if op in data]
+        if len(ops) != 1:
+            raise ValueError(f"规则必须且只能包含 {'/'.join(RULE_OPS)} 之一: {data}")
+        return cls(op=ops[0], value=int(data[ops[0]]),
+                   location=data.get('location', ''), handle=data.get('handle', ''),
+                   sku_prefix=data.get('sku_prefix', ''))
+
+    def mask(self, locations: List[str], handles: List[str], skus: List[str]) -> List[bool]:
+        result = [True] * len(locations)
+        if self.location:
+            result = [m and v == self.location for m, v in zip(result, locations)]
+        if self.handle:
+            result = [m and v == self.handle for m, v in zip(result, handles)]
+        if self.sku_prefix:
+            result = [m and v.startswith(self.sku_prefix) for m, v in zip(result, skus)]
+        return result
+
+    def apply(self, quantities: List[Optional[int]], mask: List[bool]) -> List[Optional[int]]:
+        op, value = self.op, self.value
+        if op == 'set':
+            fn = lambda q: value
+        elif op == 'add':
+            fn = lambda q: q + value
+        elif op == 'min':
+            fn = lambda q: max(q, value)
+        else:
+            fn = lambda q: min(q, value)
+        return [max(0, fn(q)) if m and q is not None else q for q, m in zip(quantities, mask)]
+
+
+def load_rules(path: str) -> List[QuantityRule]:
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if not isinstance(data, list):
+        raise ValueError("规则文件必须是 JSON 数组")
+    return [QuantityRule.from_dict(item) for item in data]
+
+
+def iter_batches(rows: Iterable[dict], batch_rows: int) -> Iterator[List[dict]]:
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_rows:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def apply_rules(batch: List[dict], rules: List[QuantityRule]):
+    """对一批行按列应用规则，返回 (当前库存列, 目标库存列)"""
+    locations = [r.get('Location') or '' for r in batch]
+    handles   = [r.get('Handle') or '' for r in batch]
+    skus      = [r.get('SKU') or '' for r in batch]
+    current   = [parse_on_hand(r.get('On hand (current)')) for r in batch]
+    target = list(current)
+    for rule in rules:
+        target = rule.apply(target, rule.mask(locations, handles, skus))
+    return current, target
+
+
+def iter_reconcile_chunks(export_path: str, rules: List[QuantityRule], chunk_rows: int,
+                          batch_rows: int = 10000, stats: Optional[dict] = None) -> Iterator[List[dict]]:
+    """
+    流式对账，按 chunk_rows 行一块输出需要修改的库存行。
+    stats（可选）累计 scanned（已读行数）/ changed（变化行数）。
+    """
+    stats = stats if stats is not None else {}
+    stats.setdefault('scanned', 0)
+    stats.setdefault('changed', 0)
+    chunk = []
+    for batch in iter_batches(iter_export(export_path), batch_rows):
+        current, target = apply_rules(batch, rules)
+        stats['scanned'] += len(batch)
+        for row, cur, new in zip(batch, current, target):
+            if cur is None or new == cur:
+                continue
+            out = {h: row.get(h, '') or '' for h in INVENTORY_HEADERS}
+            out['On hand (current)'] = str(cur)
+            out['On hand (new)'] = str(new)
+            chunk.append(out)
+            stats['changed'] += 1
+            if len(chunk) >= chunk_rows:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+# ============================================================
+# 命令行
+# ============================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Shopify 库存导出解析 / 增量导入生成")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_delta = sub.add_parser("delta", help="生成只包含变化行的库存导入 CSV")
+    p_delta.add_argument("export_file")
+    p_delta.add_argument("out_file")
+    p_delta.add_argument("--quantity", type=int,
+                         help="目标库存；不传则使用导出文件中的 On hand (new)")
+    p_delta.add_argument("--location", help="只处理该仓库位置")
+    p_delta.add_argument("--handle", action="append", default=[], help="只处理指定商品（可重复）")
+
+    p_stats = sub.add_parser("stats", help="统计导出文件中各位置的变体数与库存")
+    p_stats.add_argument("export_file")
+
+    p_rec = sub.add_parser("reconcile", help="按规则文件对账，统计变化行与分块数（不提交）")
+    p_rec.add_argument("export_file")
+    p_rec.add_argument("--rules", required=True, help="规则文件（JSON）")
+    p_rec.add_argument("--chunk-rows", type=int, default=5000)
+
+    args = parser.parse_args()
+    if args.command == "delta":
+        target = make_target(args.quantity, args.location, set(args.handle) or None)
+        total = 0
+
+        def counted(rows):
+            nonlocal total
+            for row in rows:
+                total += 1
+                yield row
+
+        n = write_inventory_csv(delta_rows(counted(iter_export(args.export_file)), target),
+                                args.out_file)
+        print(f"导出 {total} 行，其中 {n} 行库存有变化: {args.out_file}")
+    elif args.command == "stats":
+        stats = {}
+        for row in iter_export(args.export_file):
+            entry = stats.setdefault(row.get('Location') or '', [0, 0, 0])
+            on_hand = parse_on_hand(row.get('On hand (current)'))
+            entry[0] += 1
+            if on_hand is None:
+                entry[1] += 1
+            else:
+                entry[2] += on_hand
+        for location, (rows, not_stocked, on_hand) in sorted(stats.items()):
+            print(f"{location}: {rows} 行, 未备货 {not_stocked}, 库存合计 {on_hand}")
+    elif args.command == "reconcile":
+        stats = {}
+        chunks = sum(1 for _ in iter_reconcile_chunks(args.export_file, load_rules(args.rules),
+                                                      args.chunk_rows, stats=stats))
+        print(f"导出 {stats['scanned']} 行，其中 {stats['changed']} 行需要修改，"
+              f"分 {chunks} 块（每块至多 {args.chunk_rows} 行）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+api_server.py 压测
+
+默认把 api_server 切换到本地 SQLite 替身（storage.SQLiteStorage），按 --rows / --stores
+生成模拟的 shopify_task_log 与 shopify_cookie_status 数据，在本进程内启动服务，
+再以多线程并发请求以下接口，输出各接口的 RPS 与延迟分位数：
+  daily-stats    GET  /api/shopify/daily-stats?start_date=...&end_date=...
+  cookie-status  GET  /api/shopify/cookie-status
+  report         POST /api/shopify/cookie-status/report
+
+运行方式:
+  python load_test_api.py --rows 500000 --stores 200 --concurrency 16 --duration 20
+  python load_test_api.py --no-cache --endpoints daily-stats,cookie-status
+  python load_test_api.py --target http://127.0.0.1:2580 --skip-seed   # 压测已运行的服务
+
+注意: SQLite 替身只用于估算服务端自身开销（Flask / 连接 / 缓存 / 序列化），
+      查库延迟与生产 MySQL 不同；--target 指向生产服务时 report 会写入真实数据。
+"""
+
+import argparse
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+import requests
+from werkzeug.serving import make_server
+
+import api_server
+from storage import SQLiteStorage
+
+
+ENDPOINTS = ("daily-stats", "cookie-status", "report")
+
+
+# ============================================================
+# 模拟数据
+# ============================================================
+
+def seed(storage: SQLiteStorage, rows: int, days: int, stores: int, batch: int = 10000):
+    today = date.today()
+    results = ['success'] * 7 + ['failed'] * 2 + ['skipped']
+    conn = storage.get_conn()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM shopify_task_log")
+            cursor.execute("DELETE FROM shopify_task_log_daily")
+            cursor.execute("DELETE FROM shopify_cookie_status")
+            cursor.execute("DELETE FROM shopify_cookie_status_latest")
+
+            sql = """
+                INSERT INTO shopify_task_log
+                    (task_date, keer_product_id, result, detail, created_at)
+                VALUES (%s, %s, %s, %s, %s)
+            """
+            written = 0
+            while written < rows:
+                n = min(batch, rows - written)
+                values = []
+                for _ in range(n):
+                    d = today - timedelta(days=random.randrange(days))
+                    created = datetime(d.year, d.month, d.day,
+                                       random.randrange(24), random.randrange(60))
+                    values.append((d.strftime("%Y-%m-%d"), str(random.randrange(10 ** 6)),
+                                   random.choice(results), "",
+                                   created.strftime("%Y-%m-%d %H:%M:%S")))
+                cursor.executemany(sql, values)
+                written += n
+
+            history = []
+            for i in range(stores):
+                for _ in range(random.randint(1, 20)):
+                    checked = datetime.now() - timedelta(minutes=random.randrange(days * 1440))
+                    history.append((f"store-{i}", random.choice((0, 1, 1, 1)),
+                                    checked.strftime("%Y-%m-%d %H:%M:%S"), "seed", ""))
+            history.sort(key=lambda r: r[2])
+            cursor.executemany("""
+                INSERT INTO shopify_cookie_status
+                    (store_id, is_valid, checked_at, checker, detail)
+                VALUES (%s, %s, %s, %s, %s)
+            """, history)
+            cursor.executemany(api_server._latest_upsert_sql(), history)
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"已生成 {rows} 条任务日志 / {len(history)} 条 Cookie 状态（{stores} 个店铺）")
+
+
+# ============================================================
+# 在本进程内启动服务
+# ============================================================
+
+class LocalServer:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        logging.getLogger("werkzeug").setLevel(logging.ERROR)   # 不输出逐条访问日志
+        self._server = make_server(host, port, api_server.app, threaded=True)
+        self.base_url = f"http://{host}:{self._server.server_port}"
+
+    def start(self) -> "LocalServer":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+
+
+# ============================================================
+# 压测
+# ============================================================
+
+def _build_request(endpoint: str, base: str, days: int, stores: int):
+    if endpoint == "daily-stats":
+        end_d = date.today()
+        start_d = end_d - timedelta(days=random.randrange(days))
+        return "GET", f"{base}/api/shopify/daily-stats", {
+            "params": {"start_date": start_d.strftime("%Y-%m-%d"),
+                       "end_date": end_d.strftime("%Y-%m-%d")}}
+    if endpoint == "cookie-status":
+        if random.random() < 0.5:
+            return "GET", f"{base}/api/shopify/cookie-status", {}
+        return "GET", f"{base}/api/shopify/cookie-status", {
+            "params": {"store_id": f"store-{random.randrange(stores)}"}}
+    return "POST", f"{base}/api/shopify/cookie-status/report", {
+        "json": {"store_id": f"store-{random.randrange(stores)}",
+                 "is_valid": random.random() < 0.9,
+                 "checker": "load-test"}}
+
+
+def run_endpoint(endpoint: str, base: str, concurrency: int, duration: float,
+                 days: int, stores: int) -> dict:
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        session = requests.Session()
+        local_lat, local_status = [], {}
+        while time.perf_counter() < deadline:
+            method, url, kwargs = _build_request(endpoint, base, days, stores)
+            t0 = time.perf_counter()
+            try:
+                status = session.request(method, url, timeout=30, **kwargs).status_code
+            except requests.RequestException:
+                status = "error"
+            local_lat.append(time.perf_counter() - t0)
+            local_status[status] = local_status.get(status, 0) + 1
+        with lock:
+            latencies.extend(local_lat)
+            for k, v in local_status.items():
+                statuses[k] = statuses.get(k, 0) + v
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    return {"endpoint": endpoint, "elapsed": elapsed, "latencies": sorted(latencies),
+            "statuses": statuses}
+
+
+def _pct_ms(sorted_values: list, pct: float) -> float:
+    """最近秩法分位数（毫秒），sorted_values 须已升序"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * pct // 100))   # 向上取整
+    return sorted_values[int(rank) - 1] * 1000
+
+
+def print_report(reports: list, concurrency: int):
+    print("=" * 84)
+    print(f"并发 {concurrency}")
+    print(f"{'endpoint':15s} {'requests':>9s} {'rps':>9s} {'avg':>9s} "
+          f"{'p50':>9s} {'p95':>9s} {'p99':>9s} {'max':>9s}  status")
+    for r in reports:
+        lat = r["latencies"]
+        n = len(lat)
+        avg = statistics.mean(lat) * 1000 if lat else 0.0
+        print(f"{r['endpoint']:15s} {n:9d} {n / r['elapsed']:9.1f} {avg:7.1f}ms "
+              f"{_pct_ms(lat, 50):7.1f}ms {_pct_ms(lat, 95):7.1f}ms {_pct_ms(lat, 99):7.1f}ms "
+              f"{(lat[-1] * 1000 if lat else 0):7.1f}ms  {r['statuses']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="api_server 压测")
+    parser.add_argument("--target", help="压测已运行的服务（如 http://127.0.0.1:2580），不启动本地替身")
+    parser.add_argument("--sqlite", help="SQLite 文件路径（默认临时文件）")
+    parser.add_argument("--skip-seed", action="store_true", help="复用 --sqlite 中已有数据")
+    parser.add_argument("--rows", type=int, default=200000, help="shopify_task_log 行数")
+    parser.add_argument("--days", type=int, default=90, help="数据覆盖的天数")
+    parser.add_argument("--stores", type=int, default=100, help="店铺数")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=10, help="每个接口压测秒数")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--no-cache", action="store_true", help="关闭响应缓存")
+    args = parser.parse_args()
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    for e in endpoints:
+        if e not in ENDPOINTS:
+            parser.error(f"未知接口: {e}（可选 {', '.join(ENDPOINTS)}）")
+
+    if args.target:
+        base, server, tmp_dir = args.target.rstrip("/"), None, None
+    else:
+        tmp_dir = None
+        path = args.sqlite
+        if not path:
+            tmp_dir = tempfile.TemporaryDirectory()
+            path = os.path.join(tmp_dir.name, "load_test.sqlite3")
+        sqlite_storage = SQLiteStorage(path)
+        api_server.use_storage(sqlite_storage)
+        api_server.RESPONSE_CACHE_ENABLED = not args.no_cache
+        if not args.skip_seed:
+            seed(sqlite_storage, args.rows, args.days, args.stores)
+        server = LocalServer().start()
+        base = server.base_url
+
+    try:
+        reports = [run_endpoint(e, base, args.concurrency, args.duration, args.days, args.stores)
+                   for e in endpoints]
+        print_report(reports, args.concurrency)
+    finally:
+        if server is not None:
+            server.stop()
+        if tmp_dir is not None:
+            tmp_dir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+进程内阶段耗时直方图 + Prometheus 文本格式输出
+
+shopify_auto_loop.py 用 StageMetrics 采集每个阶段的耗时，
+api_server.py 汇总各 worker 上报的快照并统一输出。仅依赖标准库。
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+
+# 秒；覆盖从毫秒级的解析到分钟级的库存等待
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_METRIC_NAME = "shopify_stage_duration_seconds"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)   # 非累计，每个桶单独计数
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.sum += value
+        self.count += 1
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def to_dict(self) -> dict:
+        return {"buckets": list(self.buckets), "counts": list(self.counts),
+                "sum": self.sum, "count": self.count}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Histogram":
+        """校验并还原 to_dict() 的输出；结构不合法时抛出 ValueError"""
+        if not isinstance(data, dict):
+            raise ValueError("直方图必须是对象")
+        buckets, counts = data.get("buckets"), data.get("counts")
+        if not isinstance(buckets, list) or not buckets or not isinstance(counts, list):
+            raise ValueError("buckets / counts 必须是数组且 buckets 不能为空")
+        if len(buckets) != len(counts):
+            raise ValueError(f"buckets 与 counts 长度不一致（{len(buckets)} / {len(counts)}）")
+        if not all(_is_number(b) and math.isfinite(b) for b in buckets) or \
+                any(lo >= hi for lo, hi in zip(buckets, buckets[1:])):
+            raise ValueError("buckets 必须是严格递增的有限数值")
+        if not all(_is_count(c) for c in counts):
+            raise ValueError("counts 必须是非负整数")
+        count, total = data.get("count"), data.get("sum")
+        if not _is_count(count) or count < sum(counts):
+            raise ValueError("count 必须是非负整数且不小于各桶计数之和")
+        if not _is_number(total) or not math.isfinite(total) or total < 0:
+            raise ValueError("sum 必须是非负有限数值")
+
+        h = cls(buckets)
+        h.counts = list(counts)
+        h.sum = float(total)
+        h.count = count
+        return h
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_count(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+
+class StageMetrics:
+    """按阶段名称聚合的耗时直方图，线程安全"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._histograms: Dict[str, Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, seconds: float):
+        with self._lock:
+            h = self._histograms.get(stage)
+            if h is None:
+                h = self._histograms[stage] = Histogram(self.buckets)
+            h.observe(seconds)
+
+    @contextmanager
+    def time(self, stage: str):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t0)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {stage: h.to_dict() for stage, h in self._histograms.items()}
+
+
+def _format_labels(labels: dict) -> str:
+    parts = []
+    for k, v in labels.items():
+        v = str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{k}="{v}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def _format_bound(bound: float) -> str:
+    return str(int(bound)) if float(bound).is_integer() else str(bound)
+
+
+def render_prometheus(snapshots: dict, metric_name: str = STAGE_METRIC_NAME,
+                      help_text: str = "Duration of each pipeline stage in seconds") -> str:
+    """
+    snapshots: {额外标签(dict 转成的 tuple): StageMetrics.snapshot()}
+    单进程时传 {(): metrics.snapshot()} 即可。
+    """
+    lines = [f"# HELP {metric_name} {help_text}", f"# TYPE {metric_name} histogram"]
+    for extra_labels, snapshot in snapshots.items():
+        for stage in sorted(snapshot):
+            h = Histogram.from_dict(snapshot[stage])
+            base = {**dict(extra_labels), "stage": stage}
+            cumulative = 0
+            for bound, count in zip(h.buckets, h.counts):
+                cumulative += count
+                labels = _format_labels({**base, "le": _format_bound(bound)})
+                lines.append(f"{metric_name}_bucket{labels} {cumulative}")
+            labels = _format_labels({**base, "le": "+Inf"})
+            lines.append(f"{metric_name}_bucket{labels} {h.count}")
+            lines.append(f"{metric_name}_sum{_format_labels(base)} {h.sum:.6f}")
+            lines.append(f"{metric_name}_count{_format_labels(base)} {h.count}")
+    return "\n".join(lines) + "\n"
+
+
+def start_metrics_http_server(metrics: StageMetrics, port: int,
+                              host: str = "0.0.0.0") -> Optional[object]:
+    """在后台线程中启动 /metrics 端点，返回 server 对象（启动失败返回 None）"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus({(): metrics.snapshot()}).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError:
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
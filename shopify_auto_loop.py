@@ -5,9 +5,13 @@ Shopify CSV 自动生成 + 上传
 """
 
 import csv
+import hashlib
+import heapq
 import json
 import os
 import re
+import socket
+import sqlite3
 import time
 import traceback
 import threading
@@ -20,10 +24,19 @@ from selenium.webdriver.chrome.service import Service as ChromeService
 
 from datetime import datetime
 from typing import Optional, List, Dict
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
+from collections import deque
+from concurrent.futures import Future
+from contextlib import contextmanager
+from functools import wraps
 from urllib import parse
 from pathlib import Path
 
+from csv_validator import validate_inventory_csv, validate_product_csv
+from inventory_export import (InventoryIndex, delta_rows, iter_export, iter_reconcile_chunks,
+                              make_target, write_inventory_csv)
+from metrics import StageMetrics, start_metrics_http_server
+
 
 # ============================================================
 # 全局配置
@@ -49,7 +62,11 @@ DB_CONFIG = {
 API_BASE_URL     = "http://47.95.157.46:8520"
 LOG_API_BASE_URL = "http://47.104.72.198:2580"
 
-# Shopify配置
+# 外部服务地址（离线基准测试时指向本地替身服务，见 bench_pipeline.py）
+SHOPIFY_ADMIN_URL = "https://admin.shopify.com"
+ZHIPU_CHAT_URL    = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+
+# Shopify配置（单店铺默认值；多店铺见 STORES_CONFIG_PATH 与 StoreConfig）
 STORE_ID   = "893848-2"
 COOKIE_URL = "https://ceshi-1300392622.cos.ap-beijing.myqcloud.com/shopify-cookies/893848-2.json"
 
@@ -57,12 +74,66 @@ COOKIE_URL = "https://ceshi-1300392622.cos.ap-beijing.myqcloud.com/shopify-cooki
 INVENTORY_LOCATION_ID   = "83358875936"
 INVENTORY_LOCATION_NAME = "牟平区北关大街845"
 AUTODS_LOCATION_NAME    = "AutoDS prod-pfhikdgf"   # AutoDS 仓库位置（固定）
-INVENTORY_WAIT_SECONDS  = 120              # 产品导入后等待秒数（1-2分钟）
+INVENTORY_WAIT_SECONDS  = 120              # 无法轮询导入状态时，产品导入后固定等待秒数
+IMPORT_POLL_INITIAL_INTERVAL = 2           # 产品导入 Job 首次轮询间隔（秒）
+IMPORT_POLL_MAX_INTERVAL     = 15          # 轮询间隔上限（秒）
+IMPORT_POLL_BACKOFF          = 1.5         # 每次未完成后间隔乘以该系数
+IMPORT_POLL_TIMEOUT          = 600         # 单轮最长等待导入完成的秒数，超时后保留断点，任务稍后重新领取继续等待
+IMPORT_WAIT_MAX_ROUNDS       = 3           # 导入 Job 连续多少轮未完成后反馈任务失败
 INVENTORY_QUANTITY      = 100              # 固定库存数量
 
+# 多店铺配置文件（JSON 数组，字段见 StoreConfig）；存在时 __main__ 以多店铺模式运行
+STORES_CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stores.json')
+
+# Shopify 后台熔断（Cookie 失效 / 后台不可用时暂停领取任务）
+BREAKER_FAILURE_THRESHOLD    = 2           # 连续认证失败多少次后熔断
+BREAKER_COOLDOWN_SECONDS     = 900         # 熔断后经过该秒数允许一次半开探测
+BREAKER_VERSION_CHECK_SECONDS = 60         # 熔断期间检查 Cookie 文件是否更新的间隔
+
+# Cookie 有效性探测（单次 HTTP GET，结果按 Cookie 内容缓存）
+COOKIE_PROBE_TIMEOUT             = 5       # 探测请求超时（秒）
+COOKIE_PROBE_TTL_SECONDS         = 300     # “有效”结果缓存秒数
+COOKIE_PROBE_INVALID_TTL_SECONDS = 60      # “失效”结果缓存秒数
+
+# admin 会话缓存（每个店铺复用已取得的 Cookie / CSRF token，省去重复下载 Cookie 与启动 Chrome）
+ADMIN_SESSION_TTL_SECONDS = 600            # 超过该秒数重新获取；认证失败或熔断器未闭合时立即作废
+
+# 上传预取
+PREFETCH_ADMIN_SESSION      = True         # 商品抓取成功后立即在后台获取 Cookie / CSRF
+PREFETCH_STAGED_UPLOADS     = False        # 同时预留 staged upload 目标
+PREFETCH_STAGED_UPLOAD_SIZE = 1024 * 1024  # 预留时申报的文件大小上限（字节），实际文件更大则重新申请
+PREFETCH_MAX_AGE            = 600          # 预取结果超过该秒数视为过期
+
 # 日志目录
 LOG_DIR = r"C:\ShopifyAutoLog"
 
+# 阶段耗时指标
+METRICS_PORT = 9108                        # 本机 Prometheus 抓取端口（/metrics）
+WORKER_ID    = f"{socket.gethostname()}-{os.getpid()}"
+STAGE_LOG_BATCH_SIZE    = 50               # 阶段耗时明细攒够多少行批量写库
+STAGE_LOG_FLUSH_SECONDS = 60               # 或距上次写库超过多少秒
+
+# 多节点协作（shopify_worker / shopify_task_lease，见 sql/005_shopify_worker_lease.sql）
+WORKER_HEARTBEAT_SECONDS = 30              # 心跳间隔：刷新 worker 登记并为持有的任务续租
+TASK_LEASE_SECONDS       = 180             # 租约有效期；持有者停止心跳超过该秒数后任务可被重新领取
+TASK_CLAIM_CANDIDATES    = 5               # 每次领取时取出的候选任务数（被其他 worker 抢先时依次尝试）
+
+# 任务增量轮询（TaskPoller，索引见 sql/007_quotation_task_poll_index.sql）
+TASK_FULL_SCAN_SECONDS = 300               # 完整扫描 3 天窗口的间隔，补上创建后才满足条件的任务
+TASK_IDLE_MIN_SECONDS  = 10                # 无任务时首次退避秒数
+TASK_IDLE_MAX_SECONDS  = 120               # 退避上限
+TASK_IDLE_BACKOFF      = 2                 # 连续无任务时退避乘数；领到任务立即复位
+
+# 新任务通知（api_server 长轮询 /api/shopify/tasks/wait，见 TaskSignalListener）
+TASK_SIGNAL_ENABLED       = True
+TASK_SIGNAL_WAIT_SECONDS  = 25             # 单次长轮询最长等待秒数
+TASK_SIGNAL_RETRY_SECONDS = 60             # api_server 不可达时的重试间隔（期间按 TaskPoller 退避轮询）
+
+# HTTP 录制 / 回放（见 http_cassette.py）：None / 'record' / 'replay'
+HTTP_CASSETTE_MODE  = None
+HTTP_CASSETTE_PATH  = os.path.join(LOG_DIR, 'cassettes', 'worker.jsonl')
+HTTP_CASSETTE_DELAY = 'original'           # 回放延迟：'original' 按录制耗时 / 'zero' 不等待
+
 
 # ============================================================
 # 日志函数
@@ -124,6 +195,176 @@ def _write_db_log(keer_product_id: str, result: str, detail: str = ""):
         log_error(f"DB日志写入失败（不影响主流程）: {e}")
 
 
+# ============================================================
+# 阶段耗时指标
+# 每个阶段的耗时写入进程内直方图，由本机 /metrics 端点输出，
+# 并在每条任务结束后同步一份快照到 api_server（/metrics 汇总展示）。
+# ============================================================
+
+stage_metrics = StageMetrics()
+
+
+class TaskTrace:
+    """单条任务的各阶段耗时与重试次数，任务结束后写入 shopify_task_stage_log"""
+
+    def __init__(self):
+        self.keer_product_id = ''
+        self.started_at = time.perf_counter()
+        self.stages = {}     # stage -> 耗时秒
+        self.retries = {}    # stage -> 重试次数（单独计数，不产生耗时为 0 的阶段行）
+        self.stage = ''      # 当前所处阶段（随心跳写入任务租约）
+        self._lock = threading.Lock()   # 预取线程与任务线程同时记录
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_retry(self, stage: str):
+        with self._lock:
+            self.retries[stage] = self.retries.get(stage, 0) + 1
+
+    def snapshot(self):
+        """返回 (阶段耗时, 重试次数) 的副本"""
+        with self._lock:
+            return dict(self.stages), dict(self.retries)
+
+
+_trace_local = threading.local()
+
+
+def _current_trace() -> Optional[TaskTrace]:
+    return getattr(_trace_local, 'trace', None)
+
+
+def record_stage(stage: str, seconds: float):
+    """记录一段已测得的耗时（用于不能用 stage_timer 包裹的阶段）"""
+    stage_metrics.observe(stage, seconds)
+    trace = _current_trace()
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    trace = _current_trace()
+    previous = trace.stage if trace is not None else ''
+    if trace is not None:
+        trace.stage = stage
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.stage = previous
+        record_stage(stage, time.perf_counter() - t0)
+
+
+def record_retry(stage: str):
+    trace = _current_trace()
+    if trace is not None:
+        trace.add_retry(stage)
+
+
+def timed_stage(stage: str):
+    """装饰器：把整个函数的耗时记为一个阶段"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _report_stage_metrics_worker(snapshot: dict):
+    try:
+        url = f"{LOG_API_BASE_URL}/api/shopify/metrics/report"
+        resp = requests.post(url, json={"worker_id": WORKER_ID, "stages": snapshot}, timeout=2)
+        if resp.status_code != 200:
+            log_warning(f"阶段耗时指标上报失败: HTTP {resp.status_code}")
+    except Exception as e:
+        log_warning(f"阶段耗时指标上报异常（不影响主流程）: {e}")
+
+
+def report_stage_metrics():
+    t = threading.Thread(target=_report_stage_metrics_worker,
+                         args=(stage_metrics.snapshot(),), daemon=True)
+    t.start()
+
+
+class StageLogWriter:
+    """缓冲各任务的阶段耗时明细，攒批后用 executemany 一次写入"""
+
+    def __init__(self, batch_size: int = STAGE_LOG_BATCH_SIZE,
+                 flush_seconds: float = STAGE_LOG_FLUSH_SECONDS,
+                 max_buffer: int = 5000):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_buffer = max_buffer
+        self._rows = []
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+    def add_trace(self, trace: TaskTrace, result: str):
+        """每个计时阶段一行，retries 为该阶段的重试次数；task_total 行记录整条任务的重试总数"""
+        now = datetime.now()
+        stages, retries = trace.snapshot()
+        total_retries = sum(retries.values())
+        rows = [(
+            now.strftime('%Y-%m-%d'),
+            trace.keer_product_id or '',
+            WORKER_ID,
+            stage,
+            int(seconds * 1000),
+            total_retries if stage == 'task_total' else retries.get(stage, 0),
+            result,
+            now.strftime('%Y-%m-%d %H:%M:%S'),
+        ) for stage, seconds in stages.items()]
+        with self._lock:
+            self._rows.extend(rows)
+            if len(self._rows) > self.max_buffer:
+                dropped = len(self._rows) - self.max_buffer
+                del self._rows[:dropped]
+                log_warning(f"阶段耗时明细缓冲已满，丢弃最早的 {dropped} 行")
+        self.flush_if_due()
+
+    def flush_if_due(self):
+        """攒够一批或距上次写库超过 flush_seconds 时写库；空闲 worker 由心跳线程定时调用"""
+        with self._lock:
+            due = self._rows and (len(self._rows) >= self.batch_size
+                                  or time.time() - self._last_flush >= self.flush_seconds)
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._rows = self._rows, []
+            self._last_flush = time.time()
+        if not rows:
+            return
+        try:
+            conn = pymysql.connect(**DB_CONFIG)
+            try:
+                with conn.cursor() as cursor:
+                    sql = """
+                        INSERT INTO shopify_task_stage_log
+                            (task_date, keer_product_id, worker_id, stage,
+                             duration_ms, retries, result, created_at)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    """
+                    cursor.executemany(sql, rows)
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            log_error(f"阶段耗时明细写入失败（不影响主流程），下次重试: {e}")
+            with self._lock:
+                self._rows = (rows + self._rows)[-self.max_buffer:]
+
+
+stage_log_writer = StageLogWriter()
+
+
 # ============================================================
 # 数据类
 # ============================================================
@@ -358,7 +599,7 @@ def zhipu_single_image_analyze_sync(image_url: str, prompt: str, max_retries: in
                 if not selected_key:
                     continue
 
-            url = "https://open.bigmodel.cn/api/paas/v4/chat/completions"
+            url = ZHIPU_CHAT_URL
             headers = {"Authorization": f"Bearer {selected_key}", "Content-Type": "application/json"}
             payload = {
                 "model": "glm-4.1v-thinking-flash",
@@ -385,6 +626,7 @@ def zhipu_single_image_analyze_sync(image_url: str, prompt: str, max_retries: in
             log_error(f"❌ ZhipuAI分析失败(第{attempt+1}次): {error_msg}")
             if selected_key:
                 api_key_manager.record_failure(selected_key, error_msg)
+            record_retry('classify')
             sleep_t = 5 if '429' in error_msg else (2 if 'timeout' in error_msg.lower() else 0.5)
             time.sleep(sleep_t)
     return "分析失败：达到最大重试次数"
@@ -457,27 +699,623 @@ Rules:
 # 数据库操作
 # ============================================================
 
+# 待处理任务条件（带参数执行，% 需写成 %%）
+PENDING_TASK_SQL = """
+    SELECT id, keer_product_id, client_product_url, client_product_image,
+           quotation_result, created_at
+    FROM quotation_task_detail
+    WHERE task_status = '报价单创建完毕'
+      AND created_at >= DATE_SUB(NOW(), INTERVAL 3 DAY)
+      AND (shopfiy_task IS NULL OR shopfiy_task = '')
+      AND client_product_url LIKE 'http%%'
+      AND client_product_image IS NOT NULL
+      AND client_product_image != ''
+      AND NOT EXISTS (
+          SELECT 1 FROM shopify_task_lease l
+          WHERE l.keer_product_id = quotation_task_detail.keer_product_id
+            AND l.expires_at > NOW()
+      )
+"""
+
+
+class TaskPoller:
+    """
+    店铺级增量任务轮询。
+
+    记住已读到的最新 (created_at, id) 水位，平常只查询水位之后的新任务
+    （走 task_status + created_at 索引的小范围扫描）；每 TASK_FULL_SCAN_SECONDS
+    做一次 3 天窗口的完整扫描，补上创建后才满足条件的任务（报价后改状态、租约过期、
+    水位之前晚提交的行）。完整扫描按 (created_at, id) 倒序分页，一页取满时下次继续
+    读下一页，直到读完才回到增量扫描，积压的任务连续领取，不会等到下一轮完整扫描。
+    查到的候选缓存在本地，领取时依次抢占租约。
+    连续无任务时按 TASK_IDLE_BACKOFF 退避（不访问数据库），有候选任务时立即复位。
+    """
+
+    def __init__(self):
+        self._candidates = deque()
+        self._watermark = None        # (created_at, id)
+        self._next_full_scan = 0.0
+        self._full_cursor = None      # 完整扫描进行中时为上一页最旧的 (created_at, id)
+        self._next_poll = 0.0
+        self._idle = 0.0
+        self._lock = threading.Lock()
+
+    def wake(self):
+        """收到新任务通知：立即做一次完整扫描（通知的任务可能早于水位创建）"""
+        with self._lock:
+            self._idle, self._next_poll, self._next_full_scan = 0.0, 0.0, 0.0
+            self._full_cursor = None
+
+    def seconds_until_poll(self) -> float:
+        with self._lock:
+            if self._candidates:
+                return 0.0
+            return max(0.0, self._next_poll - time.time())
+
+    def next_task(self, store: "Store") -> Optional[Dict]:
+        with self._lock:
+            if not self._candidates and time.time() < self._next_poll:
+                return None
+            conn = pymysql.connect(**DB_CONFIG)
+            try:
+                with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+                    if not self._candidates:
+                        self._scan(cursor, store)
+                    found = len(self._candidates)
+                    while self._candidates:
+                        task = self._candidates.popleft()
+                        if self._claim(conn, cursor, task, store):
+                            self._idle, self._next_poll = 0.0, 0.0
+                            return task
+                    conn.commit()
+            finally:
+                conn.close()
+
+            if found:
+                log_info(f"{found} 条候选任务均已被其他 worker 领取")
+                self._idle, self._next_poll = 0.0, 0.0
+            else:
+                self._idle = min(max(self._idle * TASK_IDLE_BACKOFF, TASK_IDLE_MIN_SECONDS),
+                                 TASK_IDLE_MAX_SECONDS)
+                self._next_poll = time.time() + self._idle
+            return None
+
+    def _scan(self, cursor, store: "Store"):
+        sql, params = PENDING_TASK_SQL, []
+        if store.task_filter:
+            sql += f" AND ({store.task_filter})"     # 店铺任务路由条件（来自店铺配置）
+
+        full = (self._full_cursor is not None or self._watermark is None
+                or time.time() >= self._next_full_scan)
+        if full:
+            if self._full_cursor is not None:
+                created_at, row_id = self._full_cursor
+                sql += " AND created_at <= %s AND (created_at < %s OR id < %s)"
+                params = [created_at, created_at, row_id]
+            sql += f" ORDER BY created_at DESC, id DESC LIMIT {TASK_CLAIM_CANDIDATES}"
+        else:
+            created_at, row_id = self._watermark
+            sql += (" AND created_at >= %s AND (created_at > %s OR id > %s)"
+                    f" ORDER BY created_at, id LIMIT {TASK_CLAIM_CANDIDATES}")
+            params = [created_at, created_at, row_id]
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        self._candidates.extend(rows)
+
+        newest = max(((r['created_at'], r['id']) for r in rows), default=None)
+        if full:
+            if len(rows) >= TASK_CLAIM_CANDIDATES:
+                # 本页取满，可能还有更旧的待处理任务：下次继续读下一页
+                self._full_cursor = (rows[-1]['created_at'], rows[-1]['id'])
+            else:
+                self._full_cursor = None
+                self._next_full_scan = time.time() + TASK_FULL_SCAN_SECONDS
+            if newest is None and self._watermark is None:
+                cursor.execute("SELECT NOW() AS now")
+                newest = (cursor.fetchone()['now'], 0)
+        if newest is not None and (self._watermark is None or newest > self._watermark):
+            self._watermark = newest
+
+    @staticmethod
+    def _claim(conn, cursor, task: dict, store: "Store") -> bool:
+        keer_product_id = task['keer_product_id']
+        if not worker_registry.claim(cursor, keer_product_id, store.store_id):
+            return False
+        # 候选可能在缓存期间已被其他 worker 处理完（反馈后才释放租约），抢到租约后再确认一次
+        cursor.execute("""
+            SELECT 1 FROM quotation_task_detail
+            WHERE id = %s AND (shopfiy_task IS NULL OR shopfiy_task = '')
+        """, (task['id'],))
+        if cursor.fetchone() is None:
+            conn.rollback()
+            worker_registry.release(keer_product_id)
+            return False
+        conn.commit()
+        return True
+
+
 def fetch_one_task() -> Optional[Dict]:
-    conn = pymysql.connect(**DB_CONFIG)
-    try:
-        with conn.cursor(pymysql.cursors.DictCursor) as cursor:
-            sql = """
-                SELECT keer_product_id, client_product_url, client_product_image,
-                       quotation_result, created_at
-                FROM quotation_task_detail
-                WHERE created_at >= DATE_SUB(NOW(), INTERVAL 3 DAY)
-                  AND task_status = '报价单创建完毕'
-                  AND client_product_url LIKE 'http%'
-                  AND (shopfiy_task IS NULL OR shopfiy_task = '')
-                  AND client_product_image IS NOT NULL
-                  AND client_product_image != ''
-                ORDER BY created_at DESC
-                LIMIT 1
-            """
-            cursor.execute(sql)
-            return cursor.fetchone()
-    finally:
-        conn.close()
+    """领取一条任务：跳过其他 worker 租约未过期的任务，并为本 worker 写入租约（见 TaskPoller）"""
+    store = current_store()
+    return store.task_poller.next_task(store)
+
+
+class TaskSignalListener:
+    """
+    后台线程长轮询 api_server 的新任务通知；收到通知时唤醒各店铺的 TaskPoller，
+    空闲中的处理线程通过 wait() 立即返回领取任务，不必等到退避结束。
+    api_server 不可达时每 TASK_SIGNAL_RETRY_SECONDS 重试，期间 wait() 等同 sleep。
+    """
+
+    def __init__(self):
+        self.version = None
+        self._stores: List["Store"] = []
+        self._generation = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self, stores: List["Store"]):
+        if not TASK_SIGNAL_ENABLED or self._thread is not None:
+            return
+        self._stores = list(stores)
+        self._thread = threading.Thread(target=self._run, name="task-signal", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout: float) -> bool:
+        """代替空闲 sleep：收到新任务通知提前返回 True"""
+        with self._cond:
+            generation = self._generation
+            return self._cond.wait_for(lambda: self._generation != generation, timeout)
+
+    def _run(self):
+        url = f"{LOG_API_BASE_URL}/api/shopify/tasks/wait"
+        reachable = True
+        while True:
+            params = {"timeout": TASK_SIGNAL_WAIT_SECONDS}
+            if self.version is not None:
+                params["since"] = self.version
+            try:
+                resp = requests.get(url, params=params, timeout=TASK_SIGNAL_WAIT_SECONDS + 10)
+                resp.raise_for_status()
+                data = resp.json()["data"]
+            except Exception as e:
+                if reachable:
+                    log_warning(f"新任务通知不可用，按轮询间隔领取任务: {e}")
+                reachable = False
+                time.sleep(TASK_SIGNAL_RETRY_SECONDS)
+                continue
+            if not reachable:
+                log_info("新任务通知已恢复")
+                reachable = True
+            if data.get("changed"):
+                log_info("🔔 收到新任务通知")
+                for store in self._stores:
+                    store.task_poller.wake()
+                    store.idle_until = 0.0
+                with self._cond:
+                    self._generation += 1
+                    self._cond.notify_all()
+            self.version = data.get("version")
+
+
+task_signal = TaskSignalListener()
+
+
+# ============================================================
+# worker 登记与任务租约
+#
+# 多个节点共享 quotation_task_detail 队列：领取任务时在 shopify_task_lease 中
+# 写入租约（INSERT ... ON DUPLICATE KEY UPDATE 只在旧租约已过期时改写，
+# 原子地判定归属），心跳线程定期刷新 shopify_worker 并为持有的任务续租、
+# 同步当前阶段。任务结束（成功 / 失败 / 熔断暂停）后删除租约；进程崩溃时
+# 租约不再续期，TASK_LEASE_SECONDS 后任务重新回到待领取队列。
+# ============================================================
+
+LEASE_CLAIM_SQL = """
+    INSERT INTO shopify_task_lease
+        (keer_product_id, worker_id, store_id, stage, attempts, leased_at, expires_at)
+    VALUES (%s, %s, %s, 'claimed', 1, NOW(), DATE_ADD(NOW(), INTERVAL %s SECOND))
+    ON DUPLICATE KEY UPDATE
+        worker_id  = IF(expires_at <= NOW(), VALUES(worker_id), worker_id),
+        store_id   = IF(expires_at <= NOW(), VALUES(store_id), store_id),
+        stage      = IF(expires_at <= NOW(), VALUES(stage), stage),
+        attempts   = IF(expires_at <= NOW(), attempts + 1, attempts),
+        leased_at  = IF(expires_at <= NOW(), VALUES(leased_at), leased_at),
+        expires_at = IF(expires_at <= NOW(), VALUES(expires_at), expires_at)
+"""
+# 注意 expires_at 必须最后赋值：MySQL 按顺序求值，前面各列的判断依赖旧的 expires_at
+
+
+class WorkerRegistry:
+    def __init__(self, worker_id: str):
+        self.worker_id = worker_id
+        self.stores = ''
+        self.tasks_done = 0
+        self.started_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self._held = {}          # keer_product_id -> (store_id, TaskTrace)
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self, store_ids: List[str]):
+        self.stores = ','.join(store_ids)[:500]
+        self._ensure_heartbeat()
+
+    def _ensure_heartbeat(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._heartbeat_loop,
+                                            name="worker-heartbeat", daemon=True)
+            self._thread.start()
+
+    def claim(self, cursor, keer_product_id: str, store_id: str) -> bool:
+        """在 fetch_one_task 的事务中抢占租约；affected rows 1=新建 2=接管过期租约 0=他人持有"""
+        cursor.execute(LEASE_CLAIM_SQL, (keer_product_id, self.worker_id, store_id,
+                                         TASK_LEASE_SECONDS))
+        if cursor.rowcount not in (1, 2):
+            return False
+        if cursor.rowcount == 2:
+            cursor.execute("SELECT attempts FROM shopify_task_lease WHERE keer_product_id = %s",
+                           (keer_product_id,))
+            row = cursor.fetchone() or {}
+            log_warning(f"任务 {keer_product_id} 的上一租约已过期（持有者可能已崩溃），"
+                        f"第 {row.get('attempts', '?')} 次领取")
+        with self._lock:
+            self._held[keer_product_id] = (store_id, _current_trace())
+        self._ensure_heartbeat()
+        return True
+
+    def holds(self, keer_product_id: str) -> bool:
+        with self._lock:
+            return keer_product_id in self._held
+
+    def release(self, keer_product_id: str, result: str = ''):
+        """删除租约；未持有时不访问数据库"""
+        with self._lock:
+            if self._held.pop(keer_product_id, None) is None:
+                return
+            if result in ('success', 'failed'):
+                self.tasks_done += 1
+        try:
+            conn = pymysql.connect(**DB_CONFIG)
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(
+                        "DELETE FROM shopify_task_lease WHERE keer_product_id = %s AND worker_id = %s",
+                        (keer_product_id, self.worker_id))
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            log_error(f"任务租约释放失败（{TASK_LEASE_SECONDS}秒后自动过期）: {e}")
+
+    def heartbeat(self, status: str = 'running'):
+        with self._lock:
+            held = [(kid, trace.stage if trace is not None else '')
+                    for kid, (_, trace) in self._held.items()]
+            tasks_done = self.tasks_done
+        conn = pymysql.connect(**DB_CONFIG)
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO shopify_worker
+                        (worker_id, hostname, pid, stores, status, tasks_done,
+                         started_at, heartbeat_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, NOW())
+                    ON DUPLICATE KEY UPDATE
+                        stores = VALUES(stores), status = VALUES(status),
+                        tasks_done = VALUES(tasks_done), heartbeat_at = VALUES(heartbeat_at)
+                """, (self.worker_id, socket.gethostname(), os.getpid(), self.stores,
+                      status, tasks_done, self.started_at))
+                lost = []
+                for keer_product_id, stage in held:
+                    cursor.execute("""
+                        UPDATE shopify_task_lease
+                        SET stage = %s, expires_at = DATE_ADD(NOW(), INTERVAL %s SECOND)
+                        WHERE keer_product_id = %s AND worker_id = %s
+                    """, (stage or 'claimed', TASK_LEASE_SECONDS, keer_product_id, self.worker_id))
+                    if cursor.rowcount == 0:
+                        lost.append(keer_product_id)
+            conn.commit()
+        finally:
+            conn.close()
+        for keer_product_id in lost:
+            log_warning(f"⚠️ 任务 {keer_product_id} 的租约已失效（心跳中断期间被其他 worker 接管）")
+
+    def _heartbeat_loop(self):
+        while not self._stop.is_set():
+            try:
+                self.heartbeat()
+            except Exception as e:
+                log_warning(f"worker 心跳失败（连续失败超过 {TASK_LEASE_SECONDS} 秒任务将被重新分配）: {e}")
+            # 顺带按时间写出阶段耗时明细，避免空闲 worker 的缓冲长期滞留
+            stage_log_writer.flush_if_due()
+            self._stop.wait(WORKER_HEARTBEAT_SECONDS)
+
+    def stop(self):
+        """正常退出：登记为 stopped，并释放仍持有的租约使任务立即可被领取"""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._thread = None
+            held = list(self._held)
+        self._stop.set()
+        for keer_product_id in held:
+            self.release(keer_product_id)
+        try:
+            self.heartbeat(status='stopped')
+        except Exception as e:
+            log_warning(f"worker 退出登记失败: {e}")
+
+
+worker_registry = WorkerRegistry(WORKER_ID)
+
+
+# ============================================================
+# 任务断点（shopify_task_checkpoint，见 sql/006_shopify_task_checkpoint.sql）
+#
+# 上传流水线每完成一步保存一次进度，重试（upload_csv_to_shopify / sync_inventory
+# 的第二次尝试）以及重启、其他 worker 接管过期租约后，从最后完成的步骤继续：
+#   csv_built            csv_path / inventory_csv_path
+#   staged               staged（GCS 上传地址与表单参数）/ page_view_token
+#   gcs_uploaded         staged_key
+#   import_created       import_gid
+#   import_submitted     job_id
+#   import_finished      （已等待产品导入完成）
+#   inventory_uploaded   inventory_staged_key / inventory_create_key / inventory_submit_key
+#   inventory_created    inventory_import_gid
+#   inventory_submitted  inventory_job_id
+# 任务反馈后删除。TASK_CHECKPOINT_ENABLED = False 时只保存在内存中（仅对本次重试生效）。
+# ============================================================
+
+TASK_CHECKPOINT_ENABLED = True
+
+CHECKPOINT_STEPS = (
+    '', 'csv_built', 'staged', 'gcs_uploaded', 'import_created', 'import_submitted',
+    'import_finished', 'inventory_uploaded', 'inventory_created', 'inventory_submitted',
+)
+
+
+class TaskCheckpoint:
+    def __init__(self, keer_product_id: str = '', store_id: str = '',
+                 step: str = '', data: Optional[dict] = None):
+        self.keer_product_id = keer_product_id
+        self.store_id = store_id
+        self.step = step
+        self.data = data or {}
+
+    @classmethod
+    def load(cls, keer_product_id: str) -> "TaskCheckpoint":
+        store_id = current_store().store_id
+        checkpoint = cls(keer_product_id, store_id)
+        if not TASK_CHECKPOINT_ENABLED:
+            return checkpoint
+        try:
+            conn = pymysql.connect(**DB_CONFIG)
+            try:
+                with conn.cursor(pymysql.cursors.DictCursor) as cursor:
+                    cursor.execute("""
+                        SELECT store_id, step, data FROM shopify_task_checkpoint
+                        WHERE keer_product_id = %s
+                    """, (keer_product_id,))
+                    row = cursor.fetchone()
+            finally:
+                conn.close()
+        except Exception as e:
+            log_warning(f"任务断点读取失败，从头处理: {e}")
+            return checkpoint
+
+        if not row or row['step'] not in CHECKPOINT_STEPS:
+            return checkpoint
+        if row['store_id'] != store_id:
+            log_warning(f"任务断点属于店铺 {row['store_id']}，与当前店铺不符，从头处理")
+            return checkpoint
+        checkpoint.step = row['step']
+        checkpoint.data = json.loads(row['data'] or '{}')
+        log_info(f"♻️ 发现任务断点，从步骤 {checkpoint.step} 之后继续")
+        return checkpoint
+
+    def reached(self, step: str) -> bool:
+        return CHECKPOINT_STEPS.index(self.step) >= CHECKPOINT_STEPS.index(step)
+
+    def get(self, key: str, default=None):
+        return self.data.get(key, default)
+
+    def save(self, step: Optional[str] = None, **values):
+        """记录完成的步骤（step 为 None 时只更新数据）；写库失败不影响主流程"""
+        if step is not None:
+            self.step = step
+        self.data.update(values)
+        if not TASK_CHECKPOINT_ENABLED or not self.keer_product_id:
+            return
+        try:
+            conn = pymysql.connect(**DB_CONFIG)
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("""
+                        INSERT INTO shopify_task_checkpoint
+                            (keer_product_id, store_id, worker_id, step, data, updated_at)
+                        VALUES (%s, %s, %s, %s, %s, NOW())
+                        ON DUPLICATE KEY UPDATE
+                            store_id = VALUES(store_id), worker_id = VALUES(worker_id),
+                            step = VALUES(step), data = VALUES(data),
+                            updated_at = VALUES(updated_at)
+                    """, (self.keer_product_id, self.store_id, WORKER_ID, self.step,
+                          json.dumps(self.data, ensure_ascii=False)))
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            log_warning(f"任务断点写入失败（不影响主流程）: {e}")
+
+    def clear(self):
+        self.step, self.data = '', {}
+        if not TASK_CHECKPOINT_ENABLED or not self.keer_product_id:
+            return
+        try:
+            conn = pymysql.connect(**DB_CONFIG)
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute("DELETE FROM shopify_task_checkpoint WHERE keer_product_id = %s",
+                                   (self.keer_product_id,))
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            log_warning(f"任务断点删除失败（不影响主流程）: {e}")
+
+    def files_ready(self) -> bool:
+        """断点之后的步骤所需的本地 CSV 是否仍在（其他主机接管时通常不在）"""
+        if not self.reached('csv_built'):
+            return False
+        needed = []
+        if not self.reached('gcs_uploaded'):
+            needed.append(self.get('csv_path'))
+        if not self.reached('inventory_uploaded'):
+            needed.append(self.get('inventory_csv_path'))
+        return all(path and os.path.exists(path) for path in needed)
+
+
+# ============================================================
+# 导入去重（本地索引 LOG_DIR/import_index.sqlite3）
+#
+# 同一商品链接的多条任务、或任务重跑，生成的 CSV 逐字节相同。索引按
+# (店铺, URL handle) 记录最近一次成功导入的产品 CSV 与库存 CSV 内容哈希：
+# 产品 CSV 相同则跳过产品导入，库存 CSV 也相同（且上次库存同步成功）则跳过库存同步，
+# 直接反馈成功。超过 IMPORT_DEDUPE_TTL_DAYS 的记录不再使用（后台可能已手动修改商品）。
+# 同一进程内内容相同的任务通过 single_flight 串行执行：后到的任务等待先到的完成后
+# 再查索引，从而直接复用其结果。
+# ============================================================
+
+IMPORT_DEDUPE_ENABLED  = True
+IMPORT_DEDUPE_TTL_DAYS = 7
+
+
+@dataclass
+class ImportDigest:
+    store_id: str
+    handle: str
+    product_hash: str
+    inventory_hash: str
+
+
+def _file_sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ImportDedupeIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}       # (store_id, handle, product_hash) -> [Lock, 引用数]
+        self._ready_path = None
+
+    def _connect(self) -> sqlite3.Connection:
+        path = os.path.join(LOG_DIR, 'import_index.sqlite3')
+        conn = sqlite3.connect(path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        if self._ready_path != path:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS import_index (
+                    store_id         TEXT NOT NULL,
+                    handle           TEXT NOT NULL,
+                    product_hash     TEXT NOT NULL,
+                    inventory_hash   TEXT NOT NULL DEFAULT '',
+                    keer_product_id  TEXT NOT NULL DEFAULT '',
+                    imported_at      REAL NOT NULL,
+                    PRIMARY KEY (store_id, handle)
+                )
+            """)
+            self._ready_path = path
+        return conn
+
+    def digest(self, csv_path: str, inventory_csv_path: str) -> Optional[ImportDigest]:
+        """读取产品 CSV 的 URL handle 并计算两个 CSV 的内容哈希；未启用或读取失败返回 None"""
+        if not IMPORT_DEDUPE_ENABLED:
+            return None
+        try:
+            with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+                first = next(csv.DictReader(f), None) or {}
+            handle = first.get('URL handle') or ''
+            if not handle:
+                return None
+            return ImportDigest(
+                store_id=current_store().store_id,
+                handle=handle,
+                product_hash=_file_sha256(csv_path),
+                inventory_hash=_file_sha256(inventory_csv_path) if inventory_csv_path else '',
+            )
+        except Exception as e:
+            log_warning(f"导入去重哈希计算失败，按正常流程导入: {e}")
+            return None
+
+    def lookup(self, digest: ImportDigest) -> Optional[dict]:
+        try:
+            conn = self._connect()
+            try:
+                row = conn.execute("""
+                    SELECT product_hash, inventory_hash, keer_product_id, imported_at
+                    FROM import_index WHERE store_id = ? AND handle = ?
+                """, (digest.store_id, digest.handle)).fetchone()
+            finally:
+                conn.close()
+        except Exception as e:
+            log_warning(f"导入去重索引读取失败，按正常流程导入: {e}")
+            return None
+        if row is None or time.time() - row['imported_at'] > IMPORT_DEDUPE_TTL_DAYS * 86400:
+            return None
+        return dict(row)
+
+    def record(self, digest: ImportDigest, keer_product_id: str, inventory_synced: bool):
+        try:
+            conn = self._connect()
+            try:
+                conn.execute("""
+                    INSERT INTO import_index
+                        (store_id, handle, product_hash, inventory_hash, keer_product_id, imported_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (store_id, handle) DO UPDATE SET
+                        product_hash = excluded.product_hash,
+                        inventory_hash = excluded.inventory_hash,
+                        keer_product_id = excluded.keer_product_id,
+                        imported_at = excluded.imported_at
+                """, (digest.store_id, digest.handle, digest.product_hash,
+                      digest.inventory_hash if inventory_synced else '',
+                      keer_product_id or '', time.time()))
+                conn.commit()
+            finally:
+                conn.close()
+        except Exception as e:
+            log_warning(f"导入去重索引写入失败（不影响主流程）: {e}")
+
+    @contextmanager
+    def single_flight(self, digest: Optional[ImportDigest]):
+        """同一内容同时只有一个任务在导入；digest 为 None 时不做限制"""
+        if digest is None:
+            yield
+            return
+        key = (digest.store_id, digest.handle, digest.product_hash)
+        with self._lock:
+            flight = self._flights.setdefault(key, [threading.Lock(), 0])
+            flight[1] += 1
+        if flight[0].locked():
+            log_info(f"⏳ 相同内容的商品 {digest.handle} 正在由其他任务导入，等待其完成")
+        try:
+            with flight[0]:
+                yield
+        finally:
+            with self._lock:
+                flight[1] -= 1
+                if flight[1] == 0:
+                    del self._flights[key]
+
+
+import_dedupe = ImportDedupeIndex()
 
 
 def parse_price_from_quotation(quotation_result: str) -> Optional[float]:
@@ -499,6 +1337,7 @@ def parse_price_from_quotation(quotation_result: str) -> Optional[float]:
         return None
 
 
+@timed_stage('feedback')
 def feedback_task_status(keer_product_id: str, shopfiy_task: int) -> bool:
     try:
         url = f'{API_BASE_URL}/api/task-data/save'
@@ -611,11 +1450,11 @@ def generate_shopify_csv(product: ProductDetail, price: float, category: str,
 # Cookie 状态上报
 # ============================================================
 
-def _report_cookie_status_worker(is_valid: bool, detail: str):
+def _report_cookie_status_worker(store_id: str, is_valid: bool, detail: str):
     try:
         url = f"{LOG_API_BASE_URL}/api/shopify/cookie-status/report"
         payload = {
-            "store_id": STORE_ID,
+            "store_id": store_id,
             "is_valid": is_valid,
             "checker":  "auto_loop",
             "detail":   detail[:500] if detail else "",
@@ -631,7 +1470,8 @@ def _report_cookie_status_worker(is_valid: bool, detail: str):
 
 
 def report_cookie_status(is_valid: bool, detail: str = ""):
-    t = threading.Thread(target=_report_cookie_status_worker, args=(is_valid, detail), daemon=True)
+    t = threading.Thread(target=_report_cookie_status_worker,
+                         args=(current_store().store_id, is_valid, detail), daemon=True)
     t.start()
 
 
@@ -639,10 +1479,12 @@ def report_cookie_status(is_valid: bool, detail: str = ""):
 # Cookie下载
 # ============================================================
 
+@timed_stage('cookie_download')
 def download_cookies() -> Optional[list]:
     try:
-        log_info(f"正在下载Cookie: {COOKIE_URL}")
-        resp = requests.get(COOKIE_URL, timeout=15)
+        cookie_url = current_store().cookie_url
+        log_info(f"正在下载Cookie: {cookie_url}")
+        resp = requests.get(cookie_url, timeout=15)
         resp.raise_for_status()
         data = resp.json()
 
@@ -663,12 +1505,389 @@ def download_cookies() -> Optional[list]:
         return None
 
 
+# ============================================================
+# Shopify 后台熔断器
+#
+# Cookie 失效（被重定向到登录页 / 取不到 CSRF）或后台不可用时，
+# 每条任务仍会启动 Chrome 并重试，几分钟后才以失败告终。
+# 连续失败 BREAKER_FAILURE_THRESHOLD 次后熔断：
+#   open      admin 操作立即失败，暂停领取任务（任务不标记失败，留待恢复后处理）
+#   half_open Cookie 文件版本变化或冷却期结束后，放行一条任务做探测
+#   closed    探测成功（取到 CSRF）后恢复
+# ============================================================
+
+class AdminCircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, threshold: int, cooldown: float, cookie_url: str):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.cookie_url = cookie_url
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.cookie_version = None        # 熔断时的 Cookie 文件版本
+        self._version_checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def is_open(self) -> bool:
+        return self.state == self.OPEN
+
+    def allow_request(self) -> bool:
+        """admin 操作是否放行（半开状态下放行探测任务的请求）"""
+        return self.state != self.OPEN
+
+    def allow_claim(self) -> bool:
+        """是否可以领取新任务；熔断中满足探测条件时转为半开并放行一条"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.HALF_OPEN:
+                return False              # 已有探测任务在进行
+            reason = self._probe_reason()
+            if reason is None:
+                return False
+            self.state = self.HALF_OPEN
+        log_info(f"🔌 熔断器半开（{reason}），放行一条任务探测 Shopify 后台")
+        return True
+
+    def _probe_reason(self) -> Optional[str]:
+        now = time.time()
+        if now - self.opened_at >= self.cooldown:
+            return f"冷却 {int(self.cooldown)} 秒已到"
+        if now - self._version_checked_at >= BREAKER_VERSION_CHECK_SECONDS:
+            self._version_checked_at = now
+            version = fetch_cookie_version(self.cookie_url)
+            if version and version != self.cookie_version:
+                return "Cookie 文件已更新"
+        return None
+
+    def record_failure(self, detail: str):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and self.failures >= self.threshold):
+                self._open(detail)
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                log_info("✅ Shopify 后台探测成功，熔断器恢复")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def release_probe(self):
+        """探测任务未触及 admin 操作就结束时，回到熔断状态并允许下次立即探测"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.time() - self.cooldown
+
+    def _open(self, detail: str):
+        self.state = self.OPEN
+        self.opened_at = time.time()
+        self.cookie_version = fetch_cookie_version(self.cookie_url)
+        self._version_checked_at = self.opened_at
+        log_error(f"⛔ Shopify 后台熔断（连续失败 {self.failures} 次: {detail}），"
+                  f"暂停领取任务，{int(self.cooldown)} 秒后或 Cookie 更新后探测")
+
+
+def fetch_cookie_version(cookie_url: str) -> Optional[str]:
+    """Cookie 文件版本（ETag / Last-Modified，取不到时用内容哈希）"""
+    try:
+        resp = requests.head(cookie_url, timeout=10)
+        version = resp.headers.get('ETag') or resp.headers.get('Last-Modified')
+        if resp.status_code == 200 and version:
+            return version
+        resp = requests.get(cookie_url, timeout=15)
+        resp.raise_for_status()
+        return hashlib.md5(resp.content).hexdigest()
+    except Exception as e:
+        log_warning(f"获取 Cookie 文件版本失败: {e}")
+        return None
+
+
+# ============================================================
+# Cookie 有效性探测
+#
+# 不启动 Chrome，带 Cookie 直接 GET 后台商品页（不跟随跳转）：
+#   200                    → 有效
+#   跳转到登录页 / 401 / 403 → 失效
+#   其他（超时、5xx）       → 未知，不缓存，交由后续 Selenium 流程判断
+# 结果按 Cookie 内容指纹缓存（有效 / 失效分别有 TTL），同进程内各线程共享，
+# 每次实际探测的结果通过 cookie-status/report 上报。
+# ============================================================
+
+def _cookie_jar(cookie_list: list):
+    from requests.cookies import RequestsCookieJar
+    jar = RequestsCookieJar()
+    for c in cookie_list:
+        domain = c.get('domain', '')
+        path   = c.get('path', '/')
+        jar.set(c['name'], c['value'], domain=domain, path=path)
+    return jar
+
+
+def _cookie_fingerprint(cookie_list: list) -> str:
+    items = sorted((c['name'], c.get('domain', ''), c['value']) for c in cookie_list)
+    return hashlib.md5(json.dumps(items).encode('utf-8')).hexdigest()
+
+
+@timed_stage('cookie_probe')
+def probe_cookie_validity(cookie_list: list):
+    """返回 (是否有效 True/False/None=未知, 说明)"""
+    url = f"{SHOPIFY_ADMIN_URL}/store/{current_store().store_id}/products?selectedView=all"
+    headers = {
+        'accept': 'text/html,application/xhtml+xml',
+        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                      '(KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36',
+    }
+    try:
+        resp = requests.get(url, headers=headers, cookies=_cookie_jar(cookie_list),
+                            allow_redirects=False, timeout=COOKIE_PROBE_TIMEOUT)
+    except Exception as e:
+        return None, f"探测请求异常: {str(e)[:200]}"
+
+    if resp.is_redirect:
+        location = resp.headers.get('Location', '')
+        if 'login' in location or 'accounts.shopify.com' in location:
+            return False, "探测被重定向至登录页，Cookie 已失效"
+        return None, f"探测被重定向至 {location[:200]}"
+    if resp.status_code in (401, 403):
+        return False, f"探测返回 HTTP {resp.status_code}，Cookie 已失效"
+    if resp.status_code == 200:
+        return True, "HTTP 探测成功，Cookie 有效"
+    return None, f"探测返回 HTTP {resp.status_code}"
+
+
+class CookieValidityCache:
+    def __init__(self, valid_ttl: float, invalid_ttl: float):
+        self.valid_ttl = valid_ttl
+        self.invalid_ttl = invalid_ttl
+        self._data = {}    # 指纹 -> (过期时间, 是否有效)
+        self._lock = threading.Lock()
+
+    def get(self, cookie_list: list) -> Optional[bool]:
+        with self._lock:
+            entry = self._data.get(_cookie_fingerprint(cookie_list))
+            if entry is None or entry[0] <= time.time():
+                return None
+            return entry[1]
+
+    def check(self, cookie_list: list) -> bool:
+        """Cookie 是否可用；未知时返回 True，让后续流程决定"""
+        cached = self.get(cookie_list)
+        if cached is not None:
+            return cached
+
+        is_valid, detail = probe_cookie_validity(cookie_list)
+        if is_valid is None:
+            log_warning(f"Cookie 探测结果未知: {detail}")
+            return True
+
+        ttl = self.valid_ttl if is_valid else self.invalid_ttl
+        with self._lock:
+            self._data[_cookie_fingerprint(cookie_list)] = (time.time() + ttl, is_valid)
+        report_cookie_status(is_valid, detail)
+        if not is_valid:
+            log_error(f"❌ {detail}")
+        return is_valid
+
+    def invalidate(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _is_login_redirect(resp) -> bool:
+    urls = [resp.url or '']
+    if resp.is_redirect:
+        urls.append(resp.headers.get('Location', ''))
+    urls += [r.headers.get('Location', '') for r in resp.history]
+    return any('accounts.shopify.com' in u or '/login' in u for u in urls)
+
+
+def check_admin_auth(resp, label: str, store: Optional["Store"] = None) -> bool:
+    """
+    admin 接口（GraphQL / Job 轮询）返回 401 / 403 或被重定向到登录页时返回 True：
+    会话已失效，计入店铺熔断器并清空 Cookie 有效性缓存。
+    Job 轮询在后台线程执行，需显式传入登记 Job 时的店铺。
+    """
+    if resp.status_code in (401, 403):
+        detail = f"{label} 认证失败（HTTP {resp.status_code}）"
+    elif _is_login_redirect(resp):
+        detail = f"{label} 被重定向至登录页"
+    else:
+        return False
+    store = store or current_store()
+    log_error(f"❌ {detail}，Cookie 会话已失效")
+    store.invalidate_admin_session()
+    store.cookie_validity.invalidate()
+    store.breaker.record_failure(detail)
+    return True
+
+
+# ============================================================
+# 店铺注册表（多店铺）
+#
+# 每个店铺有独立的 Cookie 地址、库存位置、熔断器、Cookie 有效性缓存与 admin 限速。
+# 处理任务时用 use_store() 把店铺绑定到当前线程，下游函数通过 current_store() 读取；
+# 未绑定时使用由上方全局常量构成的默认店铺（单店铺模式 run_forever）。
+# ============================================================
+
+@dataclass
+class StoreConfig:
+    store_id: str
+    cookie_url: str
+    inventory_location_id: str
+    inventory_location_name: str
+    autods_location_name: str
+    task_filter: str = ''              # 追加到任务查询的 SQL 条件，把任务路由到该店铺（% 需写成 %%）
+    admin_min_interval: float = 0      # 两次打开 admin session 的最小间隔（秒）
+    max_concurrent_tasks: int = 1      # 该店铺同时处理的任务数上限
+    inventory_export_path: str = ''    # Shopify 库存导出文件；配置后库存CSV只包含与目标数量不同的行
+
+
+class RateLimiter:
+    """按最小间隔放行，多个线程排队等待各自的时间片"""
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self.min_interval <= 0:
+            return
+        with self._lock:
+            now = time.time()
+            at = max(now, self._next_at)
+            self._next_at = at + self.min_interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class Store:
+    """店铺配置 + 运行时状态；未定义的属性读取 StoreConfig"""
+
+    def __init__(self, config: StoreConfig):
+        self.config = config
+        self.breaker = AdminCircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_COOLDOWN_SECONDS,
+                                           config.cookie_url)
+        self.cookie_validity = CookieValidityCache(COOKIE_PROBE_TTL_SECONDS,
+                                                   COOKIE_PROBE_INVALID_TTL_SECONDS)
+        self.admin_limiter = RateLimiter(config.admin_min_interval)
+        self._admin_session = None      # 最近一次取得的 AdminSession
+        self._admin_session_lock = threading.Lock()
+        self.task_poller = TaskPoller()
+        self._inventory_index = None    # (导出文件修改时间, InventoryIndex)
+        self._inventory_index_lock = threading.Lock()
+        self.active_tasks = 0
+        self.idle_until = 0.0           # 无任务 / 熔断时暂不调度到该店铺
+
+    def __getattr__(self, name):
+        return getattr(self.config, name)
+
+    def cached_admin_session(self) -> Optional["AdminSession"]:
+        """未过期的缓存会话（每次返回独立的 requests.Session）；熔断器未闭合时作废缓存"""
+        with self._admin_session_lock:
+            cached = self._admin_session
+            if cached is None:
+                return None
+            if (self.breaker.state != AdminCircuitBreaker.CLOSED
+                    or time.perf_counter() - cached.created_at >= ADMIN_SESSION_TTL_SECONDS):
+                self._admin_session = None
+                return None
+        return cached.clone()
+
+    def cache_admin_session(self, admin: "AdminSession"):
+        with self._admin_session_lock:
+            self._admin_session = admin
+
+    def invalidate_admin_session(self):
+        with self._admin_session_lock:
+            self._admin_session = None
+
+    def inventory_index(self) -> Optional[InventoryIndex]:
+        """主仓库位置的库存导出索引，按文件修改时间缓存；未配置或读取失败返回 None（按全量生成）"""
+        path = self.config.inventory_export_path
+        if not path:
+            return None
+        with self._inventory_index_lock:
+            try:
+                mtime = os.path.getmtime(path)
+                if self._inventory_index is None or self._inventory_index[0] != mtime:
+                    index = InventoryIndex.from_export(path, {self.inventory_location_name})
+                    self._inventory_index = (mtime, index)
+                    log_info(f"库存导出索引已加载: {path}（{len(index)} 个变体）")
+            except (OSError, ValueError) as e:
+                log_warning(f"库存导出文件读取失败，按全量生成库存CSV: {e}")
+                return None
+            return self._inventory_index[1]
+
+
+_stores: Dict[str, Store] = {}
+_stores_lock = threading.Lock()
+_store_local = threading.local()
+_default_store: Optional[Store] = None
+
+
+def register_store(config: StoreConfig) -> Store:
+    with _stores_lock:
+        store = _stores[config.store_id] = Store(config)
+    return store
+
+
+def get_store(store_id: str) -> Optional[Store]:
+    return _stores.get(store_id)
+
+
+def load_stores(path: str) -> List[Store]:
+    with open(path, 'r', encoding='utf-8') as f:
+        items = json.load(f)
+    configs = [StoreConfig(**item) for item in items]
+    # task_filter 为空的店铺会领取全部任务；多个这样的店铺会把同一批任务随机分到不同店铺
+    unrouted = [c.store_id for c in configs if not c.task_filter.strip()]
+    if len(unrouted) > 1:
+        raise ValueError(f"{path}: 最多只能有一个店铺不设置 task_filter，"
+                         f"以下店铺均未设置: {', '.join(unrouted)}")
+    return [register_store(c) for c in configs]
+
+
+def default_store() -> Store:
+    """由全局常量构成的默认店铺（首次使用时创建）"""
+    global _default_store
+    if _default_store is None:
+        _default_store = register_store(StoreConfig(
+            store_id=STORE_ID,
+            cookie_url=COOKIE_URL,
+            inventory_location_id=INVENTORY_LOCATION_ID,
+            inventory_location_name=INVENTORY_LOCATION_NAME,
+            autods_location_name=AUTODS_LOCATION_NAME,
+        ))
+    return _default_store
+
+
+def current_store() -> Store:
+    return getattr(_store_local, 'store', None) or default_store()
+
+
+@contextmanager
+def use_store(store: Store):
+    prev = getattr(_store_local, 'store', None)
+    _store_local.store = store
+    try:
+        yield store
+    finally:
+        _store_local.store = prev
+
+
 # ============================================================
 # Shopify CSV上传
 # ============================================================
 
+@timed_stage('csrf')
 def _get_csrf_token_selenium(cookie_list: list) -> Optional[str]:
-    url = f"https://admin.shopify.com/store/{STORE_ID}/products?selectedView=all"
+    url = f"{SHOPIFY_ADMIN_URL}/store/{current_store().store_id}/products?selectedView=all"
     driver = None
     try:
         chrome_options = ChromeOptions()
@@ -691,7 +1910,7 @@ def _get_csrf_token_selenium(cookie_list: list) -> Optional[str]:
         })
 
         log_info("🌐 Selenium 正在加载 Shopify 后台...")
-        driver.get("https://admin.shopify.com/")
+        driver.get(f"{SHOPIFY_ADMIN_URL}/")
         time.sleep(1)
 
         for c in cookie_list:
@@ -748,68 +1967,103 @@ def _get_csrf_token_selenium(cookie_list: list) -> Optional[str]:
                 pass
 
 
-def upload_csv_to_shopify(csv_file: str) -> bool:
-    for attempt in range(1, 3):
-        log_info(f"📤 上传CSV（第{attempt}次尝试）: {os.path.basename(csv_file)}")
-        if _do_upload(csv_file):
-            return True
-        if attempt < 2:
-            log_warning("上传失败，5秒后重试...")
-            time.sleep(5)
-    return False
+@dataclass
+class ProductImportHandle:
+    """已提交的产品导入，用于轮询导入完成"""
+    import_gid: str
+    job_id: Optional[str]
+    session: requests.Session
+    headers: dict
+    submitted_at: float = field(default_factory=time.perf_counter)
+
+
+@dataclass
+class AdminSession:
+    """已带 Cookie 与 CSRF token 的 Shopify 后台会话"""
+    session: requests.Session
+    cookie_list: list
+    csrf_token: str
+    session_token: str
+    multitrack_token: str
+    store_id: str
+    created_at: float = field(default_factory=time.perf_counter)
+
+    def clone(self) -> "AdminSession":
+        """同一 Cookie / CSRF token 的新 requests.Session，供并发任务各自使用"""
+        session = requests.Session()
+        session.cookies = _cookie_jar(self.cookie_list)
+        return replace(self, session=session)
+
+    def headers(self) -> dict:
+        return {
+            'accept': 'application/json',
+            'accept-language': 'zh-CN,zh;q=0.9',
+            'apollographql-client-name': 'core',
+            'cache-control': 'no-cache,no-store,must-revalidate,max-age=0',
+            'content-type': 'application/json',
+            'origin': 'https://admin.shopify.com',
+            'referer': f'https://admin.shopify.com/store/{self.store_id}/products?selectedView=all',
+            'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
+                          '(KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36',
+            'shopify-proxy-api-enable': 'true',
+            'target-manifest-route-id': 'products:list',
+            'target-pathname': '/store/:storeHandle/products',
+            'target-slice': 'products-section',
+            'x-csrf-token': self.csrf_token,
+        }
 
 
-def _do_upload(csv_file: str) -> bool:
+def open_admin_session() -> Optional[AdminSession]:
+    """
+    下载 Cookie 并获取 CSRF token，失败返回 None（熔断期间直接返回 None）。
+    店铺缓存的会话未过期时直接复用（ADMIN_SESSION_TTL_SECONDS）。
+    """
+    store = current_store()
+    if not store.breaker.allow_request():
+        log_warning(f"店铺 {store.store_id} 的 Shopify 后台已熔断，跳过 admin 操作")
+        return None
+    cached = store.cached_admin_session()
+    if cached is not None:
+        return cached
+    store.admin_limiter.wait()
+
     cookie_list = download_cookies()
     if not cookie_list:
-        return False
+        return None
 
-    from requests.cookies import RequestsCookieJar
-    jar = RequestsCookieJar()
-    for c in cookie_list:
-        domain = c.get('domain', '')
-        path   = c.get('path', '/')
-        jar.set(c['name'], c['value'], domain=domain, path=path)
+    # 启动 Chrome 之前先用缓存 / 轻量探测确认 Cookie 有效
+    if not store.cookie_validity.check(cookie_list):
+        store.breaker.record_failure("Cookie 探测失效")
+        return None
 
     session = requests.Session()
-    session.cookies = jar
-
-    cookies_dict     = {c['name']: c['value'] for c in cookie_list}
-    session_token    = cookies_dict.get('_shopify_s', '')
-    multitrack_token = cookies_dict.get('_shopify_y', '')
+    session.cookies = _cookie_jar(cookie_list)
 
-    file_path = Path(csv_file)
-    file_size = file_path.stat().st_size
-    filename  = file_path.name
-    log_info(f"文件: {filename}，大小: {file_size} bytes")
+    cookies_dict = {c['name']: c['value'] for c in cookie_list}
 
     csrf_token = _get_csrf_token_selenium(cookie_list)
     if not csrf_token:
-        return False
+        store.cookie_validity.invalidate()    # 探测结果与实际不符，下次重新探测
+        store.breaker.record_failure("CSRF token 获取失败")
+        return None
+    store.breaker.record_success()
 
+    admin = AdminSession(session=session, cookie_list=cookie_list, csrf_token=csrf_token,
+                         session_token=cookies_dict.get('_shopify_s', ''),
+                         multitrack_token=cookies_dict.get('_shopify_y', ''),
+                         store_id=store.store_id)
+    store.cache_admin_session(admin)
+    return admin
+
+
+def _request_staged_target(admin: AdminSession, filename: str, file_size: int,
+                           page_view_token: str) -> Optional[dict]:
+    """ProductCSVStageUploads：获取 GCS 上传地址与表单参数"""
     log_info("获取GCS上传凭证...")
-    api_url = (f"https://admin.shopify.com/api/operations/"
+    api_url = (f"{SHOPIFY_ADMIN_URL}/api/operations/"
                f"a2199f150c46ccdff0a4ea14b2362f7b6c06412eee6d360d8f0e128486e39cf4/"
-               f"ProductCSVStageUploads/shopify/{STORE_ID}")
-
-    req_headers = {
-        'accept': 'application/json',
-        'accept-language': 'zh-CN,zh;q=0.9',
-        'apollographql-client-name': 'core',
-        'cache-control': 'no-cache,no-store,must-revalidate,max-age=0',
-        'content-type': 'application/json',
-        'origin': 'https://admin.shopify.com',
-        'referer': f'https://admin.shopify.com/store/{STORE_ID}/products?selectedView=all',
-        'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
-                      '(KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36',
-        'shopify-proxy-api-enable': 'true',
-        'target-manifest-route-id': 'products:list',
-        'target-pathname': '/store/:storeHandle/products',
-        'target-slice': 'products-section',
-        'x-csrf-token': csrf_token,
-    }
+               f"ProductCSVStageUploads/shopify/{admin.store_id}")
 
-    page_view_token = str(uuid.uuid4())
     payload = {
         "operationName": "ProductCSVStageUploads",
         "variables": {
@@ -825,87 +2079,234 @@ def _do_upload(csv_file: str) -> bool:
             "client_context": {
                 "page_view_token": page_view_token,
                 "client_route_handle": "products:list",
-                "client_pathname": f"/store/{STORE_ID}/products",
+                "client_pathname": f"/store/{admin.store_id}/products",
                 "client_normalized_pathname": "/store/:storeHandle/products",
-                "shopify_session_token": session_token,
-                "shopify_multitrack_token": multitrack_token
+                "shopify_session_token": admin.session_token,
+                "shopify_multitrack_token": admin.multitrack_token
             }
         }
     }
 
-    try:
-        resp = session.post(api_url, headers=req_headers, json=payload, timeout=30)
-        if resp.status_code != 200:
-            log_error(f"获取凭证失败: {resp.status_code} {resp.text[:300]}")
-            return False
+    with stage_timer('stage_upload'):
+        try:
+            resp = admin.session.post(api_url, headers=admin.headers(), json=payload, timeout=30)
+            if check_admin_auth(resp, "ProductCSVStageUploads"):
+                return None
+            if resp.status_code != 200:
+                log_error(f"获取凭证失败: {resp.status_code} {resp.text[:300]}")
+                return None
 
-        result = resp.json()
-        if 'errors' in result:
-            for err in result['errors']:
-                log_error(f"GraphQL错误: {err.get('message', '')}")
-            return False
+            result = resp.json()
+            if 'errors' in result:
+                for err in result['errors']:
+                    log_error(f"GraphQL错误: {err.get('message', '')}")
+                return None
 
-        staged = result['data']['stagedUploadsCreate']['stagedTargets'][0]
-        upload_url = staged['url']
-        parameters  = staged['parameters']
-        log_info(f"✅ 获取上传凭证成功")
-    except Exception as e:
-        log_error(f"获取凭证异常: {e}")
-        return False
+            staged = result['data']['stagedUploadsCreate']['stagedTargets'][0]
+            log_info(f"✅ 获取上传凭证成功")
+            return {"url": staged['url'], "parameters": staged['parameters'],
+                    "filename": filename, "file_size": file_size}
+        except Exception as e:
+            log_error(f"获取凭证异常: {e}")
+            return None
 
-    log_info("上传文件到Google Cloud Storage...")
-    try:
-        files_data = {}
-        for param in parameters:
-            files_data[param['name']] = (None, param['value'])
 
-        with open(csv_file, 'rb') as f:
-            files_data['file'] = (filename, f, 'text/csv')
-            upload_headers = {
-                'accept': '*/*',
-                'origin': 'https://admin.shopify.com',
-                'referer': 'https://admin.shopify.com/',
-                'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }
-            up_resp = requests.post(upload_url, headers=upload_headers,
-                                    files=files_data, timeout=60)
+# ============================================================
+# 预取（商品抓取成功后在后台预热 admin session / 预留上传凭证）
+#
+# 商品抓取成功后（start），AI 分类与 CSV 生成期间后台线程并行完成 Cookie 下载、CSRF 获取；
+# 抓取失败的任务不会触发预取。
+# 开启 PREFETCH_STAGED_UPLOADS 时还会按 PREFETCH_STAGED_UPLOAD_SIZE 预留
+# staged upload 目标。上传阶段取用结果；过期、文件超出预留大小或任务提前结束时
+# 直接丢弃（staged 目标未上传文件即不会被使用，无需通知 Shopify）。
+# 节省的等待时间记为 prefetch_saved 阶段。
+# ============================================================
+
+class UploadPrefetch:
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.page_view_token = str(uuid.uuid4())
+        self.work_seconds = 0.0
+        self._future = Future()
+        self._started = False
+        self._taken = False
+        self._trace = _current_trace()
+        self._store = current_store()
+
+    def start(self):
+        if not self._started:
+            self._started = True
+            threading.Thread(target=self._run, name="upload-prefetch", daemon=True).start()
+
+    def _run(self):
+        _trace_local.trace = self._trace   # 预取阶段的耗时仍计入本任务
+        t0 = time.perf_counter()
+        admin, staged = None, None
+        try:
+            with use_store(self._store):
+                admin = open_admin_session()
+                if admin and PREFETCH_STAGED_UPLOADS:
+                    staged = _request_staged_target(admin, self.filename,
+                                                    PREFETCH_STAGED_UPLOAD_SIZE,
+                                                    self.page_view_token)
+        except Exception as e:
+            log_warning(f"预取 admin session 异常（上传时将重新获取）: {e}")
+        finally:
+            _trace_local.trace = None
+            self.work_seconds = time.perf_counter() - t0
+            self._future.set_result((admin, staged))
+
+    def take(self):
+        """等待预取完成并取用，返回 (AdminSession, staged 目标)；不可用时对应项为 None"""
+        self._taken = True
+        if not self._started:         # 断点恢复的任务未重新抓取，没有预取
+            return None, None
+        t0 = time.perf_counter()
+        admin, staged = self._future.result()
+        waited = time.perf_counter() - t0
+        record_stage('prefetch_saved', max(0.0, self.work_seconds - waited))
+
+        if admin is not None and time.perf_counter() - admin.created_at > PREFETCH_MAX_AGE:
+            log_info(f"预取的 admin session 已超过 {PREFETCH_MAX_AGE} 秒，丢弃")
+            return None, None
+        return admin, staged
+
+    def discard(self):
+        """任务未走到上传阶段时丢弃预取结果"""
+        if self._started and not self._taken:
+            self._taken = True
+            log_info("任务提前结束，丢弃预取的 admin session / 上传凭证")
+
+
+@timed_stage('upload')
+def upload_csv_to_shopify(csv_file: str,
+                          prefetch: Optional[UploadPrefetch] = None,
+                          checkpoint: Optional[TaskCheckpoint] = None) -> Optional[ProductImportHandle]:
+    """上传并提交产品导入，成功返回 ProductImportHandle，失败返回 None；重试从 checkpoint 继续"""
+    checkpoint = checkpoint or TaskCheckpoint()
+    for attempt in range(1, 3):
+        log_info(f"📤 上传CSV（第{attempt}次尝试）: {os.path.basename(csv_file)}")
+        # 预取结果只用于第一次尝试，重试时重新获取
+        handle = _do_upload(csv_file, prefetch if attempt == 1 else None, checkpoint)
+        if handle:
+            return handle
+        if current_store().breaker.is_open():
+            log_warning("Shopify 后台已熔断，不再重试上传")
+            break
+        if attempt < 2:
+            log_warning("上传失败，5秒后重试...")
+            record_retry('upload')
+            current_store().invalidate_admin_session()    # 重试时重新获取 Cookie / CSRF
+            time.sleep(5)
+    return None
 
-        if up_resp.status_code in [200, 201, 204]:
-            log_info("✅ CSV上传到GCS成功！")
-        else:
-            log_error(f"GCS上传失败: {up_resp.status_code} {up_resp.text[:300]}")
-            return False
-    except Exception as e:
-        log_error(f"GCS上传异常: {e}")
-        return False
+
+def _staged_key(parameters: list) -> Optional[str]:
+    """从 GCS 表单参数中提取 staged key（格式如 tmp/xxxxx/filename.csv）"""
+    for param in parameters:
+        if param.get('name') == 'key':
+            return param['value']
+    return None
+
+
+def _do_upload(csv_file: str,
+               prefetch: Optional[UploadPrefetch],
+               checkpoint: TaskCheckpoint) -> Optional[ProductImportHandle]:
+    admin, staged = prefetch.take() if prefetch is not None else (None, None)
+    if admin is None:
+        admin = open_admin_session()
+        if admin is None:
+            return None
+
+    if not checkpoint.reached('gcs_uploaded'):
+        if not _upload_product_csv(csv_file, admin, prefetch, staged, checkpoint):
+            return None
+    else:
+        log_info("♻️ CSV 已上传到 GCS（断点），跳过上传")
 
     # 步骤3 + 步骤4：触发 Shopify 真正导入
-    return _trigger_shopify_import(session, req_headers, parameters,
-                                   session_token, multitrack_token, page_view_token)
+    return _trigger_shopify_import(admin.session, admin.headers(), checkpoint.get('staged_key'),
+                                   admin.session_token, admin.multitrack_token,
+                                   checkpoint.get('page_view_token') or str(uuid.uuid4()),
+                                   checkpoint)
+
+
+def _upload_product_csv(csv_file: str, admin: AdminSession,
+                        prefetch: Optional[UploadPrefetch], staged: Optional[dict],
+                        checkpoint: TaskCheckpoint) -> bool:
+    """获取 staged 目标并上传 CSV 到 GCS，完成后记录断点 gcs_uploaded"""
+    file_path = Path(csv_file)
+    file_size = file_path.stat().st_size
+    filename  = file_path.name
+    log_info(f"文件: {filename}，大小: {file_size} bytes")
+
+    page_view_token = prefetch.page_view_token if staged is not None else str(uuid.uuid4())
+    if checkpoint.reached('staged'):
+        staged, page_view_token = checkpoint.get('staged'), checkpoint.get('page_view_token')
+    if staged is not None and (staged["filename"] != filename or file_size > staged["file_size"]):
+        log_info("预留的上传凭证与文件不符，重新获取")
+        staged = None
+    if staged is None:
+        page_view_token = str(uuid.uuid4())
+        staged = _request_staged_target(admin, filename, file_size, page_view_token)
+        if staged is None:
+            return False
+    if not checkpoint.reached('staged') or checkpoint.get('staged') is not staged:
+        checkpoint.save('staged', staged=staged, page_view_token=page_view_token)
+
+    upload_url = staged['url']
+    parameters = staged['parameters']
+
+    log_info("上传文件到Google Cloud Storage...")
+    with stage_timer('gcs_upload'):
+        try:
+            files_data = {}
+            for param in parameters:
+                files_data[param['name']] = (None, param['value'])
+
+            with open(csv_file, 'rb') as f:
+                files_data['file'] = (filename, f, 'text/csv')
+                upload_headers = {
+                    'accept': '*/*',
+                    'origin': 'https://admin.shopify.com',
+                    'referer': 'https://admin.shopify.com/',
+                    'user-agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+                }
+                up_resp = requests.post(upload_url, headers=upload_headers,
+                                        files=files_data, timeout=60)
+
+            if up_resp.status_code in [200, 201, 204]:
+                log_info("✅ CSV上传到GCS成功！")
+            else:
+                log_error(f"GCS上传失败: {up_resp.status_code} {up_resp.text[:300]}")
+                checkpoint.save('csv_built')     # 上传凭证可能已过期，重试时重新获取
+                return False
+        except Exception as e:
+            log_error(f"GCS上传异常: {e}")
+            checkpoint.save('csv_built')
+            return False
+
+    staged_key = _staged_key(parameters)
+    if not staged_key:
+        log_error("❌ 未找到 GCS staged key，无法触发导入")
+        return False
+    checkpoint.save('gcs_uploaded', staged_key=staged_key)
+    return True
 
 
 def _trigger_shopify_import(session: requests.Session, base_headers: dict,
-                             gcs_parameters: list,
+                             staged_key: str,
                              session_token: str, multitrack_token: str,
-                             page_view_token: str) -> bool:
+                             page_view_token: str,
+                             checkpoint: TaskCheckpoint) -> Optional[ProductImportHandle]:
     """
     完整的 Shopify 导入流程（抓包确认的真实接口）：
       步骤3: ProductImportCreate  → 用 GCS key 创建导入任务，返回 ProductImport ID
       步骤4: ProductImportSubmit  → 用 ID 提交执行，产品才会真正出现在后台
+    成功返回 ProductImportHandle（含导入 Job ID，供 wait_for_product_import 轮询）；
+    checkpoint 中已有的步骤不再重复调用。
     """
-
-    # 从 GCS 参数里提取 key（格式如 tmp/xxxxx/filename.csv）
-    staged_key = None
-    for param in gcs_parameters:
-        if param.get('name') == 'key':
-            staged_key = param['value']
-            break
-
-    if not staged_key:
-        log_error("❌ 未找到 GCS staged key，无法触发导入")
-        return False
-
-    log_info(f"📥 步骤3: ProductImportCreate，staged_key: {staged_key}")
+    store_id = current_store().store_id
 
     # ── 公共 headers ──────────────────────────────────────────
     common_headers = {
@@ -915,7 +2316,7 @@ def _trigger_shopify_import(session: requests.Session, base_headers: dict,
         'cache-control': 'no-cache,no-store,must-revalidate,max-age=0',
         'content-type': 'application/json',
         'origin': 'https://admin.shopify.com',
-        'referer': f'https://admin.shopify.com/store/{STORE_ID}/products?selectedView=all',
+        'referer': f'https://admin.shopify.com/store/{store_id}/products?selectedView=all',
         'user-agent': ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
                        '(KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36'),
         'shopify-proxy-api-enable': 'true',
@@ -928,17 +2329,30 @@ def _trigger_shopify_import(session: requests.Session, base_headers: dict,
     client_context = {
         "page_view_token": page_view_token,
         "client_route_handle": "products:list",
-        "client_pathname": f"/store/{STORE_ID}/products",
+        "client_pathname": f"/store/{store_id}/products",
         "client_normalized_pathname": "/store/:storeHandle/products",
         "shopify_session_token": session_token,
         "shopify_multitrack_token": multitrack_token
     }
 
+    if checkpoint.reached('import_submitted'):
+        log_info(f"♻️ 产品导入已提交（断点），Import ID: {checkpoint.get('import_gid')}")
+        return ProductImportHandle(import_gid=checkpoint.get('import_gid'),
+                                   job_id=checkpoint.get('job_id'),
+                                   session=session, headers=common_headers)
+
     # ── 步骤3: ProductImportCreate ────────────────────────────
+    if checkpoint.reached('import_created'):
+        import_gid = checkpoint.get('import_gid')
+        log_info(f"♻️ ProductImportCreate 已完成（断点），Import ID: {import_gid}")
+        return _submit_product_import(session, common_headers, client_context,
+                                      import_gid, checkpoint)
+
+    log_info(f"📥 步骤3: ProductImportCreate，staged_key: {staged_key}")
     create_url = (
-        f"https://admin.shopify.com/api/operations/"
+        f"{SHOPIFY_ADMIN_URL}/api/operations/"
         f"68c029f983cbd39de99c30c73518a1f84a1053e06c5b312ed4d994967dc36a3f/"
-        f"ProductImportCreate/shopify/{STORE_ID}"
+        f"ProductImportCreate/shopify/{store_id}"
     )
     create_payload = {
         "operationName": "ProductImportCreate",
@@ -952,40 +2366,50 @@ def _trigger_shopify_import(session: requests.Session, base_headers: dict,
         "extensions": {"client_context": client_context}
     }
 
-    try:
-        resp = session.post(create_url, headers=common_headers, json=create_payload, timeout=30)
-        log_info(f"ProductImportCreate 响应: HTTP {resp.status_code}")
-        log_info(f"响应内容: {resp.text[:500]}")
+    with stage_timer('import_create'):
+        try:
+            resp = session.post(create_url, headers=common_headers, json=create_payload, timeout=30)
+            log_info(f"ProductImportCreate 响应: HTTP {resp.status_code}")
+            log_info(f"响应内容: {resp.text[:500]}")
 
-        if resp.status_code != 200:
-            log_error(f"ProductImportCreate 失败: {resp.status_code}")
-            return False
+            if check_admin_auth(resp, "ProductImportCreate"):
+                return None
+            if resp.status_code != 200:
+                log_error(f"ProductImportCreate 失败: {resp.status_code}")
+                return None
 
-        result = resp.json()
-        if 'errors' in result:
-            log_error(f"ProductImportCreate GraphQL 错误: {result['errors']}")
-            return False
+            result = resp.json()
+            if 'errors' in result:
+                log_error(f"ProductImportCreate GraphQL 错误: {result['errors']}")
+                return None
 
-        # 提取 ProductImport GID，格式: gid://shopify/ProductImport/xxxxxxxx
-        try:
-            import_gid = result['data']['productImportCreate']['productImport']['id']
-        except (KeyError, TypeError) as e:
-            log_error(f"无法从响应中提取 ProductImport ID: {e}，响应: {result}")
-            return False
+            # 提取 ProductImport GID，格式: gid://shopify/ProductImport/xxxxxxxx
+            try:
+                import_gid = result['data']['productImportCreate']['productImport']['id']
+            except (KeyError, TypeError) as e:
+                log_error(f"无法从响应中提取 ProductImport ID: {e}，响应: {result}")
+                return None
 
-        log_info(f"✅ ProductImportCreate 成功，Import ID: {import_gid}")
+            log_info(f"✅ ProductImportCreate 成功，Import ID: {import_gid}")
+            checkpoint.save('import_created', import_gid=import_gid)
+
+        except Exception as e:
+            log_error(f"ProductImportCreate 异常: {e}")
+            return None
+
+    return _submit_product_import(session, common_headers, client_context, import_gid, checkpoint)
 
-    except Exception as e:
-        log_error(f"ProductImportCreate 异常: {e}")
-        return False
 
+def _submit_product_import(session: requests.Session, common_headers: dict, client_context: dict,
+                           import_gid: str, checkpoint: TaskCheckpoint) -> Optional[ProductImportHandle]:
     # ── 步骤4: ProductImportSubmit ────────────────────────────
     log_info(f"📤 步骤4: ProductImportSubmit，ID: {import_gid}")
+    store_id = current_store().store_id
 
     submit_url = (
-        f"https://admin.shopify.com/api/operations/"
+        f"{SHOPIFY_ADMIN_URL}/api/operations/"
         f"0623f4c83b0e6dfe94448cebe8295bb1ae5c3b6406ed1e9acec2d69571d477a4/"
-        f"ProductImportSubmit/shopify/{STORE_ID}"
+        f"ProductImportSubmit/shopify/{store_id}"
     )
     submit_payload = {
         "operationName": "ProductImportSubmit",
@@ -995,26 +2419,35 @@ def _trigger_shopify_import(session: requests.Session, base_headers: dict,
         "extensions": {"client_context": client_context}
     }
 
-    try:
-        resp = session.post(submit_url, headers=common_headers, json=submit_payload, timeout=30)
-        log_info(f"ProductImportSubmit 响应: HTTP {resp.status_code}")
-        log_info(f"响应内容: {resp.text[:500]}")
+    with stage_timer('import_submit'):
+        try:
+            resp = session.post(submit_url, headers=common_headers, json=submit_payload, timeout=30)
+            log_info(f"ProductImportSubmit 响应: HTTP {resp.status_code}")
+            log_info(f"响应内容: {resp.text[:500]}")
 
-        if resp.status_code != 200:
-            log_error(f"ProductImportSubmit 失败: {resp.status_code}")
-            return False
+            if check_admin_auth(resp, "ProductImportSubmit"):
+                return None
+            if resp.status_code != 200:
+                log_error(f"ProductImportSubmit 失败: {resp.status_code}")
+                return None
 
-        result = resp.json()
-        if 'errors' in result:
-            log_error(f"ProductImportSubmit GraphQL 错误: {result['errors']}")
-            return False
+            result = resp.json()
+            if 'errors' in result:
+                log_error(f"ProductImportSubmit GraphQL 错误: {result['errors']}")
+                return None
 
-        log_info("✅ ProductImportSubmit 成功！产品将在 Shopify 后台异步导入（通常1~2分钟内完成）")
-        return True
+            submit_data = (result.get('data') or {}).get('productImportSubmit') or {}
+            job = ((submit_data.get('productImport') or {}).get('job')
+                   or submit_data.get('job') or {})
+            log_info("✅ ProductImportSubmit 成功！产品将在 Shopify 后台异步导入"
+                     f"（Job ID: {job.get('id') or '无'}）")
+            checkpoint.save('import_submitted', job_id=job.get('id'))
+            return ProductImportHandle(import_gid=import_gid, job_id=job.get('id'),
+                                       session=session, headers=common_headers)
 
-    except Exception as e:
-        log_error(f"ProductImportSubmit 异常: {e}")
-        return False
+        except Exception as e:
+            log_error(f"ProductImportSubmit 异常: {e}")
+            return None
 
 
 # ============================================================
@@ -1022,25 +2455,18 @@ def _trigger_shopify_import(session: requests.Session, base_headers: dict,
 # ============================================================
 
 def generate_inventory_csv(product: ProductDetail, location_name: str,
-                            output_path: str, quantity: int = 100) -> bool:
+                            output_path: str, quantity: int = 100,
+                            current: Optional[InventoryIndex] = None) -> Optional[int]:
     """
-    生成 Shopify 库存导入 CSV。
+    生成 Shopify 库存导入 CSV，返回写入的行数；写入失败返回 None。
     格式与 Shopify 导出的库存 CSV 完全一致：
     - 每个变体两行：牟平区北关大街845 行 + AutoDS 行
     - 使用 "On hand (current)" 和 "On hand (new)" 列
+    传入 current（库存导出索引）时只输出库存与 quantity 不同的主仓库行，
+    On hand (current) 取自索引（导出中没有的新变体按 0）；导出中该位置未备货
+    （not stocked）的变体与 delta_rows 一样跳过；AutoDS 行不修改库存，省略。
+    没有需要修改的行时不生成文件，返回 0。
     """
-    headers = [
-        'Handle', 'Title',
-        'Option1 Name', 'Option1 Value',
-        'Option2 Name', 'Option2 Value',
-        'Option3 Name', 'Option3 Value',
-        'SKU', 'HS Code', 'COO',
-        'Location', 'Bin name',
-        'Incoming (not editable)', 'Unavailable (not editable)',
-        'Committed (not editable)', 'Available (not editable)',
-        'On hand (current)', 'On hand (new)'
-    ]
-
     handle = product.handle or re.sub(r'[^a-z0-9]+', '-', product.title.lower()).strip('-')
     option1_name = product.options[0].get('name', 'Title') if product.options else 'Title'
     option2_name = product.options[1].get('name', '') if len(product.options) > 1 else ''
@@ -1061,6 +2487,14 @@ def generate_inventory_csv(product: ProductDetail, location_name: str,
             'HS Code': '',
             'COO': '',
         }
+        on_hand = 0
+        if current is not None:
+            key = (handle, variant.sku or '', location_name)
+            if key in current and not current.stocked(*key):
+                continue
+            on_hand = current.get(*key) or 0
+            if on_hand == quantity:
+                continue
         # 主仓库行：设置库存数量
         main_row = {
             **common,
@@ -1070,14 +2504,16 @@ def generate_inventory_csv(product: ProductDetail, location_name: str,
             'Unavailable (not editable)': '0',
             'Committed (not editable)': '0',
             'Available (not editable)': '0',
-            'On hand (current)': '0',
+            'On hand (current)': str(on_hand),
             'On hand (new)': str(quantity),
         }
         rows.append(main_row)
+        if current is not None:
+            continue
         # AutoDS 行：not stocked
         autods_row = {
             **common,
-            'Location': AUTODS_LOCATION_NAME,
+            'Location': current_store().autods_location_name,
             'Bin name': '',
             'Incoming (not editable)': 'not stocked',
             'Unavailable (not editable)': 'not stocked',
@@ -1088,20 +2524,58 @@ def generate_inventory_csv(product: ProductDetail, location_name: str,
         }
         rows.append(autods_row)
 
+    if not rows:
+        log_info(f"✅ 库存已是目标数量（{quantity}），无需同步")
+        return 0
     try:
         os.makedirs(os.path.dirname(output_path) if os.path.dirname(output_path) else '.', exist_ok=True)
-        with open(output_path, 'w', newline='', encoding='utf-8-sig') as f:
-            writer = csv.DictWriter(f, fieldnames=headers)
-            writer.writeheader()
-            writer.writerows(rows)
-        log_info(f"库存CSV已生成: {output_path} ({len(product.variants)} 个变体, 数量={quantity})")
-        return True
+        write_inventory_csv(rows, output_path)
+        log_info(f"库存CSV已生成: {output_path} ({len(rows)} 行 / {len(product.variants)} 个变体, 数量={quantity})")
+        return len(rows)
     except Exception as e:
         log_error(f"库存CSV写入失败: {e}")
+        return None
+
+
+def restock_from_export(export_csv: str, quantity: Optional[int] = INVENTORY_QUANTITY,
+                        handles: Optional[set] = None) -> bool:
+    """
+    按 Shopify 库存导出文件补货（当前店铺的主仓库位置）：流式解析导出，
+    只导入 On hand 与目标数量不同的行。quantity 为 None 时以导出文件的 On hand (new) 为目标。
+    没有需要修改的行时不调用 Shopify，直接返回 True。
+    """
+    store = current_store()
+    csv_dir = os.path.join(LOG_DIR, 'csv')
+    os.makedirs(csv_dir, exist_ok=True)
+    delta_csv = os.path.join(csv_dir, f"inventory_delta_{store.store_id}_"
+                                      f"{datetime.now().strftime('%Y%m%d%H%M%S')}.csv")
+
+    total = 0
+
+    def counted(rows):
+        nonlocal total
+        for row in rows:
+            total += 1
+            yield row
+
+    target = make_target(quantity, store.inventory_location_name, handles)
+    try:
+        changed = write_inventory_csv(delta_rows(counted(iter_export(export_csv)), target), delta_csv)
+    except (OSError, ValueError) as e:
+        log_error(f"库存导出文件解析失败: {e}")
         return False
 
+    log_info(f"库存导出 {total} 行，其中 {changed} 行需要修改")
+    if changed == 0:
+        os.remove(delta_csv)
+        log_info("✅ 库存已是目标数量，无需导入")
+        return True
+    with stage_timer('inventory_sync'):
+        return sync_inventory(delta_csv)
+
 
-def sync_inventory(inventory_csv_file: str) -> bool:
+def sync_inventory(inventory_csv_file: str,
+                   checkpoint: Optional[TaskCheckpoint] = None) -> bool:
     """
     完整的库存同步流程：
     1. 下载Cookie + 获取CSRF Token
@@ -1110,48 +2584,60 @@ def sync_inventory(inventory_csv_file: str) -> bool:
     4. InventoryImportCreate → 创建导入任务
     5. InventoryImportSubmit → 提交导入
     6. JobPoller → 轮询等待完成
+    重试时从 checkpoint 中最后完成的步骤继续。
     """
+    checkpoint = checkpoint or TaskCheckpoint()
     for attempt in range(1, 3):
         log_info(f"📦 库存同步（第{attempt}次尝试）: {os.path.basename(inventory_csv_file)}")
-        if _do_inventory_sync(inventory_csv_file):
+        if _do_inventory_sync(inventory_csv_file, checkpoint):
             return True
+        if current_store().breaker.is_open():
+            log_warning("Shopify 后台已熔断，不再重试库存同步")
+            break
         if attempt < 2:
             log_warning("库存同步失败，10秒后重试...")
+            record_retry('inventory_sync')
+            current_store().invalidate_admin_session()    # 重试时重新获取 Cookie / CSRF
             time.sleep(10)
     return False
 
 
-def _do_inventory_sync(inventory_csv_file: str) -> bool:
+def _do_inventory_sync(inventory_csv_file: str, checkpoint: TaskCheckpoint) -> bool:
     """执行库存同步的具体逻辑"""
-    cookie_list = download_cookies()
-    if not cookie_list:
+    # 下载 Cookie + 获取 CSRF Token
+    admin = open_admin_session()
+    if admin is None:
         return False
+    session    = admin.session
+    csrf_token = admin.csrf_token
+    inv_headers, client_context = _inventory_request_context(admin)
 
-    from requests.cookies import RequestsCookieJar
-    jar = RequestsCookieJar()
-    for c in cookie_list:
-        domain = c.get('domain', '')
-        path   = c.get('path', '/')
-        jar.set(c['name'], c['value'], domain=domain, path=path)
+    if checkpoint.reached('inventory_submitted'):
+        log_info("♻️ 库存导入已提交（断点）")
+        job_id = checkpoint.get('inventory_job_id')
+    else:
+        job_id = _submit_inventory_import(session, inv_headers, client_context,
+                                          inventory_csv_file, checkpoint)
+        if job_id is False:
+            return False
 
-    session = requests.Session()
-    session.cookies = jar
+    # ── 步骤5: JobPoller（轮询等待完成）─────────────────────────
+    if job_id:
+        log_info(f"⏳ 库存步骤5: JobPoller 轮询，Job ID: {job_id}")
+        _poll_inventory_job(session, inv_headers, job_id, csrf_token)
+    else:
+        log_info("未获取到 Job ID，跳过轮询（库存导入已提交，将在后台异步完成）")
 
-    cookies_dict     = {c['name']: c['value'] for c in cookie_list}
-    session_token    = cookies_dict.get('_shopify_s', '')
-    multitrack_token = cookies_dict.get('_shopify_y', '')
+    return True
 
-    file_path = Path(inventory_csv_file)
-    file_size = file_path.stat().st_size
-    filename  = file_path.name
-    log_info(f"库存文件: {filename}，大小: {file_size} bytes")
 
-    # 获取 CSRF Token
-    csrf_token = _get_csrf_token_selenium(cookie_list)
-    if not csrf_token:
-        return False
-
-    page_view_token = str(uuid.uuid4())
+def _inventory_request_context(admin: AdminSession):
+    """库存导入各步骤共用的请求头与 client_context"""
+    store            = current_store()
+    csrf_token       = admin.csrf_token
+    session_token    = admin.session_token
+    multitrack_token = admin.multitrack_token
+    page_view_token  = str(uuid.uuid4())
 
     # 库存操作的公共 headers
     inv_headers = {
@@ -1161,8 +2647,8 @@ def _do_inventory_sync(inventory_csv_file: str) -> bool:
         'cache-control': 'no-cache,no-store,must-revalidate,max-age=0',
         'content-type': 'application/json',
         'origin': 'https://admin.shopify.com',
-        'referer': (f'https://admin.shopify.com/store/{STORE_ID}/products/inventory'
-                    f'?location_id={INVENTORY_LOCATION_ID}'),
+        'referer': (f'https://admin.shopify.com/store/{store.store_id}/products/inventory'
+                    f'?location_id={store.inventory_location_id}'),
         'user-agent': ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 '
                        '(KHTML, like Gecko) Chrome/144.0.0.0 Safari/537.36'),
         'shopify-proxy-api-enable': 'true',
@@ -1175,18 +2661,107 @@ def _do_inventory_sync(inventory_csv_file: str) -> bool:
     client_context = {
         "page_view_token": page_view_token,
         "client_route_handle": "products:inventory:list",
-        "client_pathname": f"/store/{STORE_ID}/products/inventory",
+        "client_pathname": f"/store/{store.store_id}/products/inventory",
         "client_normalized_pathname": "/store/:storeHandle/products/inventory",
         "shopify_session_token": session_token,
         "shopify_multitrack_token": multitrack_token
     }
+    return inv_headers, client_context
+
+
+def _submit_inventory_import(session: requests.Session, inv_headers: dict, client_context: dict,
+                             inventory_csv_file: str, checkpoint: TaskCheckpoint):
+    """
+    库存步骤1~4，已完成的步骤按 checkpoint 跳过。
+    成功返回 Job ID（可能为 None），失败返回 False。
+    """
+    store = current_store()
+    if checkpoint.reached('inventory_uploaded'):
+        staged_key = checkpoint.get('inventory_staged_key')
+        log_info(f"♻️ 库存CSV已上传到 GCS（断点），staged_key: {staged_key}")
+    else:
+        staged_key = _upload_inventory_csv(session, inv_headers, client_context, inventory_csv_file)
+        if not staged_key:
+            return False
+        # 幂等键随断点保存，重试 Create / Submit 时沿用，Shopify 不会重复创建导入
+        checkpoint.save('inventory_uploaded', inventory_staged_key=staged_key,
+                        inventory_create_key=str(uuid.uuid4()),
+                        inventory_submit_key=str(uuid.uuid4()))
+
+    if checkpoint.reached('inventory_created'):
+        import_gid = checkpoint.get('inventory_import_gid')
+        log_info(f"♻️ InventoryImportCreate 已完成（断点），Import ID: {import_gid}")
+    else:
+        import_gid = _create_inventory_import(session, inv_headers, client_context, staged_key,
+                                              checkpoint.get('inventory_create_key'))
+        if not import_gid:
+            return False
+        checkpoint.save('inventory_created', inventory_import_gid=import_gid)
+
+    # ── 步骤4: InventoryImportSubmit ──────────────────────────
+    log_info(f"📤 库存步骤4: InventoryImportSubmit，ID: {import_gid}")
+    submit_url = (
+        f"{SHOPIFY_ADMIN_URL}/api/operations/"
+        f"e1cbb128d9f0abd1c1b35dc85ab7ae7718944c96e5a4538b945acca1a707bd95/"
+        f"InventoryImportSubmit/shopify/{store.store_id}"
+    )
+    submit_payload = {
+        "operationName": "InventoryImportSubmit",
+        "variables": {
+            "id": import_gid,
+            "idempotencyKey": checkpoint.get('inventory_submit_key')
+        },
+        "extensions": {"client_context": client_context}
+    }
+
+    job_id = None
+    try:
+        resp = session.post(submit_url, headers=inv_headers, json=submit_payload, timeout=30)
+        log_info(f"InventoryImportSubmit 响应: HTTP {resp.status_code}")
+
+        if check_admin_auth(resp, "InventoryImportSubmit"):
+            return False
+        if resp.status_code != 200:
+            log_error(f"InventoryImportSubmit 失败: {resp.status_code}")
+            return False
+
+        result = resp.json()
+        if 'errors' in result:
+            log_error(f"InventoryImportSubmit GraphQL 错误: {result['errors']}")
+            return False
+
+        # 提取 Job ID 用于轮询
+        try:
+            job_data = result.get('data', {}).get('inventoryImportSubmit', {})
+            job_id = job_data.get('job', {}).get('id')
+        except (KeyError, TypeError, AttributeError):
+            pass
+
+        log_info("✅ InventoryImportSubmit 成功！库存导入已提交")
+        checkpoint.save('inventory_submitted', inventory_job_id=job_id)
+
+    except Exception as e:
+        log_error(f"InventoryImportSubmit 异常: {e}")
+        return False
+
+    return job_id
+
+
+def _upload_inventory_csv(session: requests.Session, inv_headers: dict, client_context: dict,
+                          inventory_csv_file: str) -> Optional[str]:
+    """库存步骤1~2：获取 GCS 上传凭证并上传，成功返回 staged key"""
+    store = current_store()
+    file_path = Path(inventory_csv_file)
+    file_size = file_path.stat().st_size
+    filename  = file_path.name
+    log_info(f"库存文件: {filename}，大小: {file_size} bytes")
 
     # ── 步骤1: InventoryStagedUploads ──────────────────────────
     log_info("📤 库存步骤1: InventoryStagedUploads（获取GCS上传凭证）")
     stage_url = (
-        f"https://admin.shopify.com/api/operations/"
+        f"{SHOPIFY_ADMIN_URL}/api/operations/"
         f"dafbde9e8213fb109b67860a344cd72657293731daa8abb55ddc0245a477716c/"
-        f"InventoryStagedUploads/shopify/{STORE_ID}"
+        f"InventoryStagedUploads/shopify/{store.store_id}"
     )
     stage_payload = {
         "operationName": "InventoryStagedUploads",
@@ -1204,14 +2779,16 @@ def _do_inventory_sync(inventory_csv_file: str) -> bool:
 
     try:
         resp = session.post(stage_url, headers=inv_headers, json=stage_payload, timeout=30)
+        if check_admin_auth(resp, "InventoryStagedUploads"):
+            return None
         if resp.status_code != 200:
             log_error(f"InventoryStagedUploads 失败: {resp.status_code} {resp.text[:300]}")
-            return False
+            return None
 
         result = resp.json()
         if 'errors' in result:
             log_error(f"InventoryStagedUploads GraphQL 错误: {result['errors']}")
-            return False
+            return None
 
         staged = result['data']['stagedUploadsCreate']['stagedTargets'][0]
         upload_url  = staged['url']
@@ -1219,7 +2796,7 @@ def _do_inventory_sync(inventory_csv_file: str) -> bool:
         log_info("✅ 库存GCS凭证获取成功")
     except Exception as e:
         log_error(f"InventoryStagedUploads 异常: {e}")
-        return False
+        return None
 
     # ── 步骤2: 上传库存CSV到GCS ────────────────────────────────
     log_info("📤 库存步骤2: 上传CSV到Google Cloud Storage")
@@ -1243,35 +2820,34 @@ def _do_inventory_sync(inventory_csv_file: str) -> bool:
             log_info("✅ 库存CSV上传到GCS成功")
         else:
             log_error(f"库存GCS上传失败: {up_resp.status_code} {up_resp.text[:300]}")
-            return False
+            return None
     except Exception as e:
         log_error(f"库存GCS上传异常: {e}")
-        return False
-
-    # 从 GCS 参数中提取 staged key
-    staged_key = None
-    for param in parameters:
-        if param.get('name') == 'key':
-            staged_key = param['value']
-            break
+        return None
 
+    staged_key = _staged_key(parameters)
     if not staged_key:
         log_error("未找到库存 GCS staged key")
-        return False
+        return None
+    return staged_key
+
 
+def _create_inventory_import(session: requests.Session, inv_headers: dict, client_context: dict,
+                             staged_key: str, idempotency_key: str) -> Optional[str]:
+    """库存步骤3：InventoryImportCreate，成功返回 InventoryImport ID"""
+    store = current_store()
     # ── 步骤3: InventoryImportCreate ──────────────────────────
     log_info(f"📥 库存步骤3: InventoryImportCreate，staged_key: {staged_key}")
     create_url = (
-        f"https://admin.shopify.com/api/operations/"
+        f"{SHOPIFY_ADMIN_URL}/api/operations/"
         f"8d2fcb60da9f65b5f03a0f9efed1ae09b64e237405a6aabab8c530247ce79a49/"
-        f"InventoryImportCreate/shopify/{STORE_ID}"
+        f"InventoryImportCreate/shopify/{store.store_id}"
     )
-    idempotency_key_create = str(uuid.uuid4())
     create_payload = {
         "operationName": "InventoryImportCreate",
         "variables": {
             "url": staged_key,
-            "idempotencyKey": idempotency_key_create
+            "idempotencyKey": idempotency_key
         },
         "extensions": {"client_context": client_context}
     }
@@ -1280,91 +2856,164 @@ def _do_inventory_sync(inventory_csv_file: str) -> bool:
         resp = session.post(create_url, headers=inv_headers, json=create_payload, timeout=30)
         log_info(f"InventoryImportCreate 响应: HTTP {resp.status_code}")
 
+        if check_admin_auth(resp, "InventoryImportCreate"):
+            return None
         if resp.status_code != 200:
             log_error(f"InventoryImportCreate 失败: {resp.status_code}")
-            return False
+            return None
 
         result = resp.json()
         if 'errors' in result:
             log_error(f"InventoryImportCreate GraphQL 错误: {result['errors']}")
-            return False
+            return None
 
         try:
             import_gid = result['data']['inventoryImportCreate']['inventoryImport']['id']
         except (KeyError, TypeError) as e:
             log_error(f"无法提取 InventoryImport ID: {e}，响应: {json.dumps(result)[:500]}")
-            return False
+            return None
 
         log_info(f"✅ InventoryImportCreate 成功，Import ID: {import_gid}")
+        return import_gid
 
     except Exception as e:
         log_error(f"InventoryImportCreate 异常: {e}")
-        return False
-
-    # ── 步骤4: InventoryImportSubmit ──────────────────────────
-    log_info(f"📤 库存步骤4: InventoryImportSubmit，ID: {import_gid}")
-    submit_url = (
-        f"https://admin.shopify.com/api/operations/"
-        f"e1cbb128d9f0abd1c1b35dc85ab7ae7718944c96e5a4538b945acca1a707bd95/"
-        f"InventoryImportSubmit/shopify/{STORE_ID}"
-    )
-    idempotency_key_submit = str(uuid.uuid4())
-    submit_payload = {
-        "operationName": "InventoryImportSubmit",
-        "variables": {
-            "id": import_gid,
-            "idempotencyKey": idempotency_key_submit
-        },
-        "extensions": {"client_context": client_context}
-    }
-
-    job_id = None
-    try:
-        resp = session.post(submit_url, headers=inv_headers, json=submit_payload, timeout=30)
-        log_info(f"InventoryImportSubmit 响应: HTTP {resp.status_code}")
-
-        if resp.status_code != 200:
-            log_error(f"InventoryImportSubmit 失败: {resp.status_code}")
-            return False
-
-        result = resp.json()
-        if 'errors' in result:
-            log_error(f"InventoryImportSubmit GraphQL 错误: {result['errors']}")
-            return False
+        return None
 
-        # 提取 Job ID 用于轮询
-        try:
-            job_data = result.get('data', {}).get('inventoryImportSubmit', {})
-            job_id = job_data.get('job', {}).get('id')
-        except (KeyError, TypeError, AttributeError):
-            pass
 
-        log_info("✅ InventoryImportSubmit 成功！库存导入已提交")
+def _poll_inventory_job(session: requests.Session, headers: dict,
+                         job_id: str, csrf_token: str, timeout: float = 100):
+    """
+    轮询 Shopify 异步 Job 状态，直到完成或超时。
+    与产品导入相同按 IMPORT_POLL_* 退避，首次轮询时间参考库存导入的历史耗时。
+    """
+    if poll_job(session, headers, job_id, "库存导入",
+                timeout=timeout, initial_interval=IMPORT_POLL_INITIAL_INTERVAL,
+                max_interval=IMPORT_POLL_MAX_INTERVAL, backoff=IMPORT_POLL_BACKOFF).done:
+        return
+    log_warning(f"库存导入 {timeout:.0f} 秒内未完成，可能仍在后台进行")
 
-    except Exception as e:
-        log_error(f"InventoryImportSubmit 异常: {e}")
-        return False
 
-    # ── 步骤5: JobPoller（轮询等待完成）─────────────────────────
-    if job_id:
-        log_info(f"⏳ 库存步骤5: JobPoller 轮询，Job ID: {job_id}")
-        _poll_inventory_job(session, inv_headers, job_id, csrf_token)
-    else:
-        log_info("未获取到 Job ID，跳过轮询（库存导入已提交，将在后台异步完成）")
+# ============================================================
+# 全店批量库存对账（命令行入口见 bulk_inventory.py）
+#
+# 流式读取库存导出并按规则计算目标库存（inventory_export.iter_reconcile_chunks），
+# 变化行按 INVENTORY_BULK_CHUNK_ROWS 分块，每块走一遍
+# InventoryStagedUploads / InventoryImportCreate / InventoryImportSubmit，
+# 提交后交给 job_poller 后台轮询；最多 INVENTORY_BULK_MAX_INFLIGHT 块同时处于导入中，
+# 超出时等待最早的一块完成再提交下一块。每块完成时输出进度与吞吐量。
+# ============================================================
 
-    return True
+INVENTORY_BULK_CHUNK_ROWS    = 5000        # 每个库存导入文件的最大行数
+INVENTORY_BULK_MAX_INFLIGHT  = 4           # 同时处于导入中的分块数
+INVENTORY_BULK_POLL_TIMEOUT  = 1800        # 单块导入的最长等待秒数
 
 
-def _poll_inventory_job(session: requests.Session, headers: dict,
-                         job_id: str, csrf_token: str,
-                         max_polls: int = 20, interval: int = 5):
+@dataclass
+class _BulkChunk:
+    index: int
+    rows: int
+    path: str
+    submitted_at: float
+    future: Optional[Future] = None
+
+
+def bulk_reconcile_inventory(export_csv: str, rules: list,
+                             chunk_rows: int = INVENTORY_BULK_CHUNK_ROWS,
+                             max_inflight: int = INVENTORY_BULK_MAX_INFLIGHT,
+                             dry_run: bool = False) -> dict:
     """
-    轮询 Shopify 异步 Job 状态，直到完成或超时。
+    按规则对账当前店铺的库存并分块提交，返回统计：
+      scanned / changed  导出行数 / 变化行数
+      chunks             分块数；submitted / completed / timeout / failed 各状态块数
+      rows_done / rows_timeout  已完成分块 / 等待超时分块的行数
+      elapsed / rows_per_sec    rows_per_sec 只按已完成的行计算
+    dry_run 时只生成分块文件，不调用 Shopify。
     """
+    store = current_store()
+    out_dir = os.path.join(LOG_DIR, 'csv', f"bulk_{store.store_id}_"
+                                           f"{datetime.now().strftime('%Y%m%d%H%M%S')}")
+    os.makedirs(out_dir, exist_ok=True)
+
+    stats = {'scanned': 0, 'changed': 0, 'chunks': 0, 'submitted': 0,
+             'completed': 0, 'timeout': 0, 'failed': 0, 'rows_done': 0, 'rows_timeout': 0}
+    t0 = time.perf_counter()
+    inflight = deque()
+    admin = None
+
+    def finish(chunk: _BulkChunk):
+        done = chunk.future.result().done if chunk.future is not None else True
+        stats['completed' if done else 'timeout'] += 1
+        stats['rows_done' if done else 'rows_timeout'] += chunk.rows
+        elapsed = time.perf_counter() - t0
+        log_info(f"📦 分块 {chunk.index} {'完成' if done else '等待超时（可能仍在导入）'}: "
+                 f"{chunk.rows} 行，耗时 {time.perf_counter() - chunk.submitted_at:.1f}s | "
+                 f"累计完成 {stats['rows_done']} 行、超时 {stats['rows_timeout']} 行"
+                 f"（已扫描 {stats['scanned']} 行，发现变化 {stats['changed']} 行），"
+                 f"{stats['rows_done'] / elapsed:.1f} 行/秒")
+
+    for chunk_rows_list in iter_reconcile_chunks(export_csv, rules, chunk_rows, stats=stats):
+        stats['chunks'] += 1
+        chunk = _BulkChunk(index=stats['chunks'], rows=len(chunk_rows_list),
+                           path=os.path.join(out_dir, f"inventory_chunk_{stats['chunks']:04d}.csv"),
+                           submitted_at=time.perf_counter())
+        write_inventory_csv(chunk_rows_list, chunk.path)
+        if dry_run:
+            log_info(f"分块 {chunk.index}: {chunk.rows} 行 → {chunk.path}")
+            continue
+
+        while len(inflight) >= max_inflight:
+            finish(inflight.popleft())
+
+        job_id = False
+        for attempt in range(1, 3):
+            if admin is None:
+                admin = open_admin_session()
+                if admin is None:
+                    break
+            headers, client_context = _inventory_request_context(admin)
+            job_id = _submit_inventory_import(admin.session, headers, client_context,
+                                              chunk.path, TaskCheckpoint())
+            if job_id is not False:
+                break
+            admin = None          # CSRF 可能已过期，重新获取会话后重试一次
+            current_store().invalidate_admin_session()
+            record_retry('inventory_bulk')
+
+        if job_id is False:
+            stats['failed'] += 1
+            log_error(f"❌ 分块 {chunk.index} 提交失败（{chunk.rows} 行）: {chunk.path}")
+            if store.breaker.is_open():
+                log_warning("Shopify 后台已熔断，停止提交剩余分块")
+                break
+            continue
+
+        stats['submitted'] += 1
+        chunk.submitted_at = time.perf_counter()
+        if job_id:
+            chunk.future = job_poller.watch(job_id, admin.session, headers, "批量库存导入",
+                                            timeout=INVENTORY_BULK_POLL_TIMEOUT,
+                                            initial_interval=IMPORT_POLL_INITIAL_INTERVAL,
+                                            max_interval=IMPORT_POLL_MAX_INTERVAL,
+                                            backoff=IMPORT_POLL_BACKOFF)
+        inflight.append(chunk)
+        log_info(f"📤 分块 {chunk.index} 已提交（{chunk.rows} 行），导入中 {len(inflight)} 块")
+
+    while inflight:
+        finish(inflight.popleft())
+
+    stats['elapsed'] = round(time.perf_counter() - t0, 2)
+    stats['rows_per_sec'] = round(stats['rows_done'] / stats['elapsed'], 1) if stats['elapsed'] else 0.0
+    stats['out_dir'] = out_dir
+    record_stage('inventory_bulk', stats['elapsed'])
+    return stats
+
+
+def _job_poll_url(job_id: str, store_id: str) -> str:
     poller_base_url = (
-        f"https://admin.shopify.com/api/operations/"
+        f"{SHOPIFY_ADMIN_URL}/api/operations/"
         f"e1593abda1eb0795fd588f8374f0f642659c1252872a4117c0ffd5e1db328980/"
-        f"JobPoller/shopify/{STORE_ID}"
+        f"JobPoller/shopify/{store_id}"
     )
 
     variables_json = json.dumps({"id": job_id})
@@ -1372,29 +3021,215 @@ def _poll_inventory_job(session: requests.Session, headers: dict,
         "operationName": "JobPoller",
         "variables": variables_json
     })
-    poll_url = f"{poller_base_url}?{params}"
+    return f"{poller_base_url}?{params}"
 
-    for i in range(1, max_polls + 1):
-        time.sleep(interval)
-        try:
-            resp = session.get(poll_url, headers=headers, timeout=15)
-            if resp.status_code != 200:
-                log_warning(f"JobPoller 第{i}次 HTTP {resp.status_code}")
+
+@dataclass
+class JobOutcome:
+    """
+    Shopify 异步 Job 的最终结果:
+      done          Job 已完成
+      timeout       超时仍未完成（可能仍在后台进行）
+      unauthorized  会话失效，无法继续轮询（Job 可能仍在后台进行）
+      missing       JobPoller 查不到该 Job
+      unknown       提交时没有返回 Job ID，无从判断
+    """
+    state: str
+    detail: str = ''
+    polls: int = 0
+
+    @property
+    def done(self) -> bool:
+        return self.state == 'done'
+
+
+class _WatchedJob:
+    def __init__(self, job_id, session, headers, label, deadline,
+                 interval, max_interval, backoff, future):
+        self.job_id = job_id
+        self.store = current_store()
+        self.poll_url = _job_poll_url(job_id, self.store.store_id)
+        self.session = session
+        self.headers = headers
+        self.label = label
+        self.deadline = deadline
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.future = future
+        self.started_at = time.perf_counter()
+        self.polls = 0
+
+
+class JobPollerService:
+    """
+    后台 JobPoller 服务：一个线程同时跟踪多个 Shopify 异步 Job。
+
+    watch() 登记 Job 后立即返回 Future（结果为 JobOutcome），
+    调用方可 result() 阻塞等待，或 add_done_callback() 注册回调。
+    各 Job 独立退避：每次未完成后间隔乘以 backoff（不超过 max_interval）；
+    同一 label 的首次轮询延迟参考该类 Job 的历史完成耗时（EWMA），
+    避免在通常不可能完成的时间点空轮询。
+    轮询复用提交 Job 时的 admin session（requests.Session 自带 keep-alive 连接池）。
+    """
+
+    EWMA_ALPHA = 0.3
+
+    def __init__(self):
+        self._heap = []          # (next_poll_at, seq, _WatchedJob)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._typical = {}       # label -> 完成耗时 EWMA（秒）
+
+    def watch(self, job_id: str, session: requests.Session, headers: dict, label: str,
+              timeout: float, initial_interval: float, max_interval: float,
+              backoff: float = 1.0) -> Future:
+        future = Future()
+        now = time.perf_counter()
+        with self._cond:
+            first_delay = initial_interval
+            typical = self._typical.get(label)
+            if typical:
+                first_delay = min(max(initial_interval, typical * 0.8), max_interval)
+            job = _WatchedJob(job_id, session, headers, label, now + timeout,
+                              initial_interval, max_interval, backoff, future)
+            self._push(now + first_delay, job)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="job-poller", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return future
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._heap)
+
+    def _push(self, at: float, job: _WatchedJob):
+        self._seq += 1
+        heapq.heappush(self._heap, (at, self._seq, job))
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due = self._heap[0][0] - time.perf_counter()
+                    if due <= 0:
+                        break
+                    self._cond.wait(due)
+                _, _, job = heapq.heappop(self._heap)
+
+            outcome = self._poll(job)
+            now = time.perf_counter()
+            if outcome is not None and outcome.done:
+                elapsed = now - job.started_at
+                with self._cond:
+                    prev = self._typical.get(job.label)
+                    self._typical[job.label] = (elapsed if prev is None else
+                                                prev + self.EWMA_ALPHA * (elapsed - prev))
+                log_info(f"✅ {job.label} Job 已完成（第{job.polls}次轮询，{elapsed:.1f}秒）")
+                job.future.set_result(outcome)
+                continue
+            if outcome is not None:
+                log_warning(f"{job.label} Job 无法继续跟踪: {outcome.detail}")
+                job.future.set_result(outcome)
                 continue
 
-            result = resp.json()
-            job_data = result.get('data', {}).get('job', {})
-            done = job_data.get('done', False)
+            job.interval = min(job.interval * job.backoff, job.max_interval)
+            if now + job.interval > job.deadline:
+                log_warning(f"{job.label} Job 轮询超时（{job.polls}次）: {job.job_id}")
+                job.future.set_result(JobOutcome('timeout', f"{job.polls} 次轮询仍未完成", job.polls))
+                continue
+            with self._cond:
+                self._push(now + job.interval, job)
 
-            if done:
-                log_info(f"✅ 库存导入 Job 已完成（第{i}次轮询）")
-                return
-            else:
-                log_info(f"⏳ 库存导入进行中... ({i}/{max_polls})")
+    @staticmethod
+    def _poll(job: _WatchedJob) -> Optional[JobOutcome]:
+        """完成或确定无法继续时返回 JobOutcome；仍在进行或本次请求出错返回 None（稍后再轮询）"""
+        job.polls += 1
+        try:
+            resp = job.session.get(job.poll_url, headers=job.headers, timeout=15)
+            if check_admin_auth(resp, f"JobPoller {job.label}", job.store):
+                return JobOutcome('unauthorized', "Cookie 会话已失效", job.polls)
+            if resp.status_code != 200:
+                log_warning(f"JobPoller 第{job.polls}次 HTTP {resp.status_code}")
+                return None
+
+            data = resp.json().get('data') or {}
+            if 'job' in data and data['job'] is None:
+                return JobOutcome('missing', f"Job 不存在: {job.job_id}", job.polls)
+            if (data.get('job') or {}).get('done', False):
+                return JobOutcome('done', '', job.polls)
+            log_info(f"⏳ {job.label}进行中...（第{job.polls}次轮询）")
         except Exception as e:
-            log_warning(f"JobPoller 第{i}次异常: {e}")
+            log_warning(f"JobPoller 第{job.polls}次异常: {e}")
+        return None
+
+
+job_poller = JobPollerService()
+
+
+def poll_job(session: requests.Session, headers: dict, job_id: str, label: str,
+             timeout: float, initial_interval: float, max_interval: float,
+             backoff: float = 1.0) -> JobOutcome:
+    """
+    阻塞等待 Shopify 异步 Job（由 job_poller 统一轮询），返回最终结果（完成 / 失败 / 超时）。
+    """
+    return job_poller.watch(job_id, session, headers, label, timeout,
+                            initial_interval, max_interval, backoff).result()
 
-    log_warning(f"JobPoller 达到最大轮询次数 ({max_polls})，库存导入可能仍在后台进行")
+
+def wait_for_product_import(handle: ProductImportHandle) -> JobOutcome:
+    """
+    等待产品导入完成：有 Job ID 时按退避间隔轮询，返回 Job 的最终结果；
+    否则退回固定等待 INVENTORY_WAIT_SECONDS，返回 unknown。
+    导入完成时把提交到完成的耗时记为 product_import 阶段，供调整轮询参数参考。
+    """
+    if not handle.job_id:
+        log_info(f"未获取到产品导入 Job ID，固定等待 {INVENTORY_WAIT_SECONDS} 秒后同步库存...")
+        time.sleep(INVENTORY_WAIT_SECONDS)
+        return JobOutcome('unknown', "未获取到 Job ID")
+
+    log_info(f"⏳ 轮询产品导入 Job: {handle.job_id}（{handle.import_gid}）")
+    outcome = poll_job(handle.session, handle.headers, handle.job_id, "产品导入",
+                       timeout=IMPORT_POLL_TIMEOUT,
+                       initial_interval=IMPORT_POLL_INITIAL_INTERVAL,
+                       max_interval=IMPORT_POLL_MAX_INTERVAL,
+                       backoff=IMPORT_POLL_BACKOFF)
+    elapsed = time.perf_counter() - handle.submitted_at
+    if outcome.done:
+        record_stage('product_import', elapsed)
+        log_info(f"产品导入耗时 {elapsed:.1f} 秒")
+    else:
+        log_warning(f"产品导入 {elapsed:.0f} 秒内未完成（{outcome.state}: {outcome.detail}）")
+    return outcome
+
+
+def _import_unfinished(keer_product_id: str, checkpoint: TaskCheckpoint, outcome: JobOutcome) -> str:
+    """
+    导入 Job 未确认完成时不反馈成功：
+      后台熔断                    → 'paused'，保留断点
+      超时 / 会话失效（未超轮数）  → 'pending'，保留断点，任务下次被领取时继续轮询同一 Job
+      Job 不存在或连续 IMPORT_WAIT_MAX_ROUNDS 轮未完成 → 反馈失败
+    """
+    if current_store().breaker.is_open():
+        log_warning(f"⏸️ Shopify 后台熔断，产品导入 Job 待恢复后继续确认: {keer_product_id}")
+        return 'paused'
+    rounds = checkpoint.get('import_wait_rounds', 0) + 1
+    if outcome.state in ('timeout', 'unauthorized') and rounds < IMPORT_WAIT_MAX_ROUNDS:
+        checkpoint.save(import_wait_rounds=rounds)
+        log_warning(f"⏳ 产品导入 Job 第{rounds}轮未完成（{outcome.detail}），保留断点，稍后重新领取: {keer_product_id}")
+        return 'pending'
+
+    reason = f"产品导入 Job 未完成（{outcome.state}: {outcome.detail}，共 {rounds} 轮）"
+    feedback_task_status(keer_product_id, 2)
+    write_daily_log(keer_product_id, 'failed', reason)
+    checkpoint.clear()
+    log_error(f"❌ 任务失败: {keer_product_id}，{reason}")
+    return 'failed'
 
 
 # ============================================================
@@ -1404,23 +3239,153 @@ def _poll_inventory_job(session: requests.Session, headers: dict,
 def process_one_task(analyzer: ZhipuImageAnalyzer) -> str:
     """
     处理单条任务
-    返回值: 'success' / 'failed' / 'skipped'
+    返回值: 'success' / 'failed' / 'skipped' / 'paused'（Shopify 后台熔断中）/
+            'pending'（产品导入 Job 未完成，保留断点，稍后重新领取）
     """
-    task = fetch_one_task()
+    store = current_store()
+    if not store.breaker.allow_claim():
+        return 'paused'
+
+    trace = _trace_local.trace = TaskTrace()
+    result = 'failed'
+    try:
+        result = _process_one_task(analyzer)
+        return result
+    finally:
+        _trace_local.trace = None
+        store.breaker.release_probe()
+        if trace.keer_product_id:
+            worker_registry.release(trace.keer_product_id, result)
+        if result not in ('skipped', 'paused'):
+            trace.add('task_total', time.perf_counter() - trace.started_at)
+            stage_log_writer.add_trace(trace, result)
+
+
+def _process_one_task(analyzer: ZhipuImageAnalyzer) -> str:
+    with stage_timer('fetch_task'):
+        task = fetch_one_task()
     if not task:
         log_info("暂无待处理任务，退出。")
         return 'skipped'
 
+    keer_product_id = task.get('keer_product_id')
+    _current_trace().keer_product_id = keer_product_id
+
+    # 抓取成功后，分类 / 生成 CSV 期间在后台预热上传所需的 admin session
+    prefetch = None
+    if PREFETCH_ADMIN_SESSION:
+        prefetch = UploadPrefetch(f"shopify_import_{keer_product_id}.csv")
+    try:
+        return _process_task(analyzer, task, prefetch)
+    finally:
+        if prefetch is not None:
+            prefetch.discard()
+
+
+def _process_task(analyzer: ZhipuImageAnalyzer, task: dict,
+                  prefetch: Optional[UploadPrefetch]) -> str:
+    keer_product_id    = task.get('keer_product_id')
+    client_product_url = task.get('client_product_url')
+
+    log_info(f"--- 开始处理任务: {keer_product_id} ---")
+    log_info(f"商品URL: {client_product_url}")
+
+    checkpoint = TaskCheckpoint.load(keer_product_id)
+    if not checkpoint.files_ready():
+        paths = _build_task_csvs(analyzer, task, prefetch)
+        if paths is None and not checkpoint.reached('gcs_uploaded'):
+            feedback_task_status(keer_product_id, 2)
+            write_daily_log(keer_product_id, 'failed', "商品抓取或CSV生成/校验失败")
+            checkpoint.clear()
+            return 'failed'
+        if paths is None:
+            log_warning("⚠️ 断点恢复时重新生成库存CSV失败，跳过库存同步")
+            paths = (checkpoint.get('csv_path'), '')
+        # 产品 CSV 已上传时只补齐库存 CSV，不回退断点步骤
+        checkpoint.save(None if checkpoint.reached('gcs_uploaded') else 'csv_built',
+                        csv_path=paths[0], inventory_csv_path=paths[1])
+    csv_path = checkpoint.get('csv_path')
+    inventory_csv_path = checkpoint.get('inventory_csv_path')
+
+    # 只对尚未开始上传的任务做内容去重（断点恢复的任务已有进行中的 Shopify 导入）
+    digest = None
+    if not checkpoint.reached('staged'):
+        digest = import_dedupe.digest(csv_path, inventory_csv_path)
+    with import_dedupe.single_flight(digest):
+        return _import_task(keer_product_id, csv_path, inventory_csv_path,
+                            prefetch, checkpoint, digest)
+
+
+def _import_task(keer_product_id: str, csv_path: str, inventory_csv_path: str,
+                 prefetch: Optional[UploadPrefetch], checkpoint: TaskCheckpoint,
+                 digest: Optional[ImportDigest]) -> str:
+    previous = import_dedupe.lookup(digest) if digest is not None else None
+    same_product = previous is not None and previous['product_hash'] == digest.product_hash
+    same_inventory = (same_product and bool(digest.inventory_hash)
+                      and previous['inventory_hash'] == digest.inventory_hash)
+    if same_product:
+        log_info(f"♻️ 产品CSV与上次成功导入的内容相同（任务 {previous['keer_product_id']}），跳过产品导入")
+
+    # 上传CSV
+    uploaded = same_product or checkpoint.reached('import_finished')
+    if not uploaded:
+        import_handle = upload_csv_to_shopify(csv_path, prefetch, checkpoint)
+        uploaded = import_handle is not None
+        if uploaded:
+            # ── 等待导入 Job 完成后再同步库存；未确认完成不反馈成功 ──────
+            with stage_timer('inventory_wait'):
+                outcome = wait_for_product_import(import_handle)
+            if outcome.state not in ('done', 'unknown'):
+                return _import_unfinished(keer_product_id, checkpoint, outcome)
+            # 断点中记录 Job 是否确认完成，恢复的任务据此决定是否写入去重索引
+            checkpoint.save('import_finished', import_done=outcome.done)
+
+    if uploaded:
+        inv_ok = False
+        if same_inventory:
+            log_info("♻️ 库存CSV与上次成功同步的内容相同，跳过库存同步")
+            inv_ok = True
+        elif inventory_csv_path:
+            with stage_timer('inventory_sync'):
+                inv_ok = sync_inventory(inventory_csv_path, checkpoint)
+            if inv_ok:
+                log_info(f"✅ 库存同步成功: {keer_product_id}")
+            else:
+                log_warning(f"⚠️ 库存同步失败（不影响产品导入状态）: {keer_product_id}")
+        else:
+            log_warning(f"⚠️ 没有库存CSV（生成失败或库存已是目标数量），跳过库存同步: {keer_product_id}")
+
+        # 只有确认导入完成的内容才记为“上次成功导入”（无 Job ID 无法确认时不记录）
+        if digest is not None and (same_product or checkpoint.get('import_done', False)):
+            import_dedupe.record(digest, keer_product_id, inventory_synced=inv_ok)
+        feedback_task_status(keer_product_id, 1)
+        write_daily_log(keer_product_id, 'success', '')
+        checkpoint.clear()
+        log_info(f"✅ 任务完成: {keer_product_id}")
+        return 'success'
+    elif current_store().breaker.is_open():
+        # 后台不可用不是任务本身的问题，不反馈失败，恢复后重新领取（保留断点）
+        log_warning(f"⏸️ Shopify 后台熔断，任务暂不处理: {keer_product_id}")
+        return 'paused'
+    else:
+        feedback_task_status(keer_product_id, 2)
+        write_daily_log(keer_product_id, 'failed', "产品CSV上传或导入提交失败")
+        checkpoint.clear()
+        log_error(f"❌ 任务失败: {keer_product_id}")
+        return 'failed'
+
+
+def _build_task_csvs(analyzer: ZhipuImageAnalyzer, task: dict,
+                     prefetch: Optional[UploadPrefetch] = None):
+    """解析价格、抓取商品、AI 分类，生成并校验产品 / 库存 CSV；抓取、产品 CSV 生成或校验失败返回 None"""
     keer_product_id      = task.get('keer_product_id')
     client_product_url   = task.get('client_product_url')
     client_product_image = task.get('client_product_image')
     quotation_result     = task.get('quotation_result')
 
-    log_info(f"--- 开始处理任务: {keer_product_id} ---")
-    log_info(f"商品URL: {client_product_url}")
-
     # 解析价格（原始为欧元，×1.2 转为美元）
-    price = parse_price_from_quotation(quotation_result)
+    with stage_timer('price_parse'):
+        price = parse_price_from_quotation(quotation_result)
     if price is None:
         log_warning("价格解析失败，使用默认价格 0.0")
         price = 0.0
@@ -1429,12 +3394,14 @@ def process_one_task(analyzer: ZhipuImageAnalyzer) -> str:
     log_info(f"解析价格: €{price_eur} → ${price}（×1.2 EUR→USD）")
 
     # 抓取商品
-    scraper = ShopifyScraper()
-    product = scraper.fetch(client_product_url)
+    with stage_timer('scrape'):
+        scraper = ShopifyScraper()
+        product = scraper.fetch(client_product_url)
     if not product:
         log_error("商品抓取失败")
-        feedback_task_status(keer_product_id, 2)
-        return 'failed'
+        return None
+    if prefetch is not None:
+        prefetch.start()
 
     log_info(f"商品标题: {product.title} | 变体: {len(product.variants)} | 图片: {len(product.images)}")
 
@@ -1442,7 +3409,8 @@ def process_one_task(analyzer: ZhipuImageAnalyzer) -> str:
     category = None
     if client_product_image:
         log_info("正在识别商品分类...")
-        category = get_product_category(analyzer, client_product_image)
+        with stage_timer('classify'):
+            category = get_product_category(analyzer, client_product_image)
     log_info(f"商品分类: {category or '未设置'}")
 
     # 生成CSV
@@ -1452,69 +3420,83 @@ def process_one_task(analyzer: ZhipuImageAnalyzer) -> str:
 
     if not generate_shopify_csv(product, price, category, csv_path):
         log_error("CSV生成失败")
-        feedback_task_status(keer_product_id, 2)
-        return 'failed'
-
-    # 上传CSV
-    upload_ok = upload_csv_to_shopify(csv_path)
-
-    if upload_ok:
-        # ── 库存同步 ──────────────────────────────────────
-        log_info(f"产品导入成功，等待 {INVENTORY_WAIT_SECONDS} 秒后同步库存...")
-        time.sleep(INVENTORY_WAIT_SECONDS)
-
-        inventory_csv_path = os.path.join(csv_dir, f"inventory_{keer_product_id}.csv")
-        if generate_inventory_csv(product, INVENTORY_LOCATION_NAME, inventory_csv_path,
-                                   quantity=INVENTORY_QUANTITY):
-            inv_ok = sync_inventory(inventory_csv_path)
-            if inv_ok:
-                log_info(f"✅ 库存同步成功: {keer_product_id}")
-            else:
-                log_warning(f"⚠️ 库存同步失败（不影响产品导入状态）: {keer_product_id}")
-        else:
-            log_warning(f"⚠️ 库存CSV生成失败: {keer_product_id}")
+        return None
 
-        feedback_task_status(keer_product_id, 1)
-        log_info(f"✅ 任务完成: {keer_product_id}")
-        return 'success'
-    else:
-        feedback_task_status(keer_product_id, 2)
-        log_error(f"❌ 任务失败: {keer_product_id}")
-        return 'failed'
+    # 库存 CSV 与产品 CSV 一起生成，断点恢复时无需重新抓取商品
+    inventory_csv_path = os.path.join(csv_dir, f"inventory_{keer_product_id}.csv")
+    store = current_store()
+    if not generate_inventory_csv(product, store.inventory_location_name, inventory_csv_path,
+                                  quantity=INVENTORY_QUANTITY, current=store.inventory_index()):
+        inventory_csv_path = ''     # 生成失败或库存已是目标数量
+
+    # 上传前本地校验：可修正的问题直接修正，无法修正的直接失败，不再走一轮导入
+    with stage_timer('csv_validate'):
+        checked = validate_product_csv(csv_path)
+        if checked.ok and inventory_csv_path:
+            inventory_checked = validate_inventory_csv(inventory_csv_path, handle=checked.handle)
+            if not inventory_checked.ok:
+                checked = inventory_checked
+            elif inventory_checked.repairs:
+                checked.repairs.extend(inventory_checked.repairs)
+    for repair in dict.fromkeys(checked.repairs):
+        log_warning(f"CSV 已修正: {repair}")
+    if not checked.ok:
+        log_error(f"CSV 校验未通过（{os.path.basename(checked.path)}）: {checked.reason}")
+        return None
+    return csv_path, inventory_csv_path
 
 
 # ============================================================
 # 程序入口（单任务测试模式）
 # ============================================================
 
-def run_forever(task_interval: int = 10, key_refresh_hours: int = 1):
-    """
-    无限循环运行 Shopify 自动上架任务。
-    24小时不间断从数据库拉取任务并处理。
-
-    参数:
-        task_interval:      每次任务之间的等待秒数（默认10秒）
-        key_refresh_hours:  ZhipuAI密钥刷新间隔（小时，默认1小时）
-    """
+def _init_worker() -> Optional[ZhipuImageAnalyzer]:
+    """日志目录、HTTP cassette、ZhipuAI 密钥与指标端口；密钥初始化失败返回 None"""
     _ensure_log_dir()
 
+    if HTTP_CASSETTE_MODE:
+        import http_cassette
+        os.makedirs(os.path.dirname(HTTP_CASSETTE_PATH), exist_ok=True)
+        http_cassette.install(HTTP_CASSETTE_MODE, HTTP_CASSETTE_PATH, HTTP_CASSETTE_DELAY)
+        log_info(f"HTTP cassette 已启用: {HTTP_CASSETTE_MODE} {HTTP_CASSETTE_PATH}")
+
     log_info("初始化 ZhipuAI 密钥...")
     if not init_global_api_keys():
         log_error("ZhipuAI 密钥初始化失败，60秒后重试...")
         time.sleep(60)
         if not init_global_api_keys():
             log_error("ZhipuAI 密钥初始化二次失败，退出")
-            return
+            return None
+
+    if start_metrics_http_server(stage_metrics, METRICS_PORT) is None:
+        log_warning(f"指标端口 {METRICS_PORT} 启动失败，仅上报到 api_server")
+
+    return ZhipuImageAnalyzer()
+
+
+def run_forever(task_interval: int = 10, key_refresh_hours: int = 1):
+    """
+    无限循环运行 Shopify 自动上架任务。
+    24小时不间断从数据库拉取任务并处理。
 
-    analyzer = ZhipuImageAnalyzer()
+    参数:
+        task_interval:      每次任务之间的等待秒数（默认10秒；无任务时按 TaskPoller 退避，不少于该值）
+        key_refresh_hours:  ZhipuAI密钥刷新间隔（小时，默认1小时）
+    """
+    analyzer = _init_worker()
+    if analyzer is None:
+        return
 
     print("=" * 60)
     print("🚀 Shopify 自动上架 — 无限循环模式已启动")
     print(f"   任务间隔: {task_interval}秒")
     print(f"   密钥刷新: 每{key_refresh_hours}小时")
     print(f"   日志目录: {LOG_DIR}")
+    print(f"   指标端点: http://0.0.0.0:{METRICS_PORT}/metrics")
     print("=" * 60)
     log_info("无限循环模式已启动")
+    worker_registry.start([current_store().store_id])
+    task_signal.start([current_store()])
 
     task_count = 0
     success_count = 0
@@ -1543,14 +3525,27 @@ def run_forever(task_interval: int = 10, key_refresh_hours: int = 1):
                 task_count += 1
                 fail_count += 1
                 log_info(f"📊 累计: 处理{task_count}条, 成功{success_count}, 失败{fail_count}")
+            elif result == 'paused':
+                log_info(f"⏸️ Shopify 后台熔断中，暂停领取任务（{task_interval}秒后再检查）")
+            elif result == 'pending':
+                log_info("⏳ 产品导入 Job 未完成，任务已保留断点，稍后重新领取")
             else:
                 # skipped — 没有新任务
                 pass
 
-            time.sleep(task_interval)
+            if result not in ('skipped', 'paused'):
+                report_stage_metrics()
+
+            if result == 'skipped':
+                # 无任务时按 TaskPoller 的退避间隔等待，期间不访问数据库；收到新任务通知立即领取
+                task_signal.wait(max(task_interval, current_store().task_poller.seconds_until_poll()))
+            else:
+                time.sleep(task_interval)
 
         except KeyboardInterrupt:
             log_info("🛑 收到中断信号，正在退出...")
+            stage_log_writer.flush()
+            worker_registry.stop()
             print(f"\n最终统计: 处理{task_count}条, 成功{success_count}, 失败{fail_count}")
             break
         except Exception as e:
@@ -1560,5 +3555,120 @@ def run_forever(task_interval: int = 10, key_refresh_hours: int = 1):
             time.sleep(30)
 
 
+# ============================================================
+# 多店铺模式
+#
+# 一个进程内用 workers 个线程服务多个店铺。StoreScheduler 按轮转顺序为空闲线程
+# 挑选店铺：跳过已达 max_concurrent_tasks 的店铺，以及刚发现无任务或已熔断、
+# 仍在 task_interval 冷却中的店铺，保证各店铺轮流获得处理机会。
+# ============================================================
+
+class StoreScheduler:
+    def __init__(self, stores: List[Store], idle_seconds: float):
+        self.stores = list(stores)
+        self.idle_seconds = idle_seconds
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> Optional[Store]:
+        with self._lock:
+            now = time.time()
+            n = len(self.stores)
+            for k in range(n):
+                idx = (self._next + k) % n
+                store = self.stores[idx]
+                if store.active_tasks < store.max_concurrent_tasks and store.idle_until <= now:
+                    store.active_tasks += 1
+                    self._next = (idx + 1) % n
+                    return store
+        return None
+
+    def release(self, store: Store, result: str):
+        with self._lock:
+            store.active_tasks -= 1
+            if result == 'skipped':
+                store.idle_until = time.time() + max(self.idle_seconds,
+                                                     store.task_poller.seconds_until_poll())
+            elif result == 'paused':
+                store.idle_until = time.time() + self.idle_seconds
+
+
+def run_multi_store(stores: List[Store], workers: int = 0,
+                    task_interval: int = 10, key_refresh_hours: int = 1):
+    """
+    多店铺无限循环。
+    参数:
+        stores:         店铺列表（load_stores / register_store）
+        workers:        处理线程数（默认各店铺 max_concurrent_tasks 之和）
+        task_interval:  店铺无任务或熔断时，再次为其领取任务前的等待秒数
+    """
+    analyzer = _init_worker()
+    if analyzer is None:
+        return
+
+    workers = workers or sum(s.max_concurrent_tasks for s in stores)
+    scheduler = StoreScheduler(stores, task_interval)
+    counts = {s.store_id: {'success': 0, 'failed': 0} for s in stores}
+    counts_lock = threading.Lock()
+
+    def worker_loop():
+        while True:
+            store = scheduler.acquire()
+            if store is None:
+                task_signal.wait(1)
+                continue
+            result = 'failed'
+            try:
+                with use_store(store):
+                    result = process_one_task(analyzer)
+            except Exception as e:
+                log_error(f"💥 店铺 {store.store_id} 任务异常: {e}")
+                log_error(traceback.format_exc())
+            finally:
+                scheduler.release(store, result)
+
+            if result in ('success', 'failed'):
+                with counts_lock:
+                    counts[store.store_id][result] += 1
+                    log_info(f"📊 店铺 {store.store_id} 累计: {counts[store.store_id]}")
+                report_stage_metrics()
+            elif result == 'paused':
+                log_info(f"⏸️ 店铺 {store.store_id} 后台熔断中，暂停领取任务")
+
+    print("=" * 60)
+    print("🚀 Shopify 自动上架 — 多店铺模式已启动")
+    print(f"   店铺: {', '.join(s.store_id for s in stores)}")
+    print(f"   处理线程: {workers}")
+    print(f"   日志目录: {LOG_DIR}")
+    print(f"   指标端点: http://0.0.0.0:{METRICS_PORT}/metrics")
+    print("=" * 60)
+    log_info(f"多店铺模式已启动: {len(stores)} 个店铺, {workers} 个线程")
+    worker_registry.start([s.store_id for s in stores])
+    task_signal.start(stores)
+
+    for i in range(workers):
+        threading.Thread(target=worker_loop, name=f"store-worker-{i}", daemon=True).start()
+
+    last_key_refresh = time.time()
+    try:
+        while True:
+            time.sleep(60)
+            if time.time() - last_key_refresh > key_refresh_hours * 3600:
+                log_info("⏰ 定时刷新 ZhipuAI 密钥...")
+                if refresh_api_keys():
+                    log_info("✅ 密钥刷新成功")
+                else:
+                    log_warning("⚠️ 密钥刷新失败，继续使用旧密钥")
+                last_key_refresh = time.time()
+    except KeyboardInterrupt:
+        log_info("🛑 收到中断信号，正在退出...")
+        stage_log_writer.flush()
+        worker_registry.stop()
+        print(f"\n最终统计: {counts}")
+
+
 if __name__ == "__main__":
-    run_forever()
+    if os.path.exists(STORES_CONFIG_PATH):
+        run_multi_store(load_stores(STORES_CONFIG_PATH))
+    else:
+        run_forever()
@@ -0,0 +1,23 @@
+-- ============================================================
+-- 每日统计汇总表：供 GET /api/shopify/daily-stats 读取历史日期
+-- 当天数据仍由接口实时查询 shopify_task_log；
+-- 历史日期由 api_server.compact_daily_stats 按需补齐，也可用本脚本一次性回填。
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS shopify_task_log_daily (
+    task_date  DATE        NOT NULL,
+    result     VARCHAR(20) NOT NULL,
+    total      INT         NOT NULL DEFAULT 0,
+    PRIMARY KEY (task_date, result)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 原始日志按日期 + 结果查询 / 汇总所需索引
+ALTER TABLE shopify_task_log ADD INDEX idx_task_date_result (task_date, result);
+
+-- 回填今天之前的全部历史（可重复执行）
+INSERT INTO shopify_task_log_daily (task_date, result, total)
+SELECT task_date, result, COUNT(*)
+FROM shopify_task_log
+WHERE task_date < CURDATE()
+GROUP BY task_date, result
+ON DUPLICATE KEY UPDATE total = VALUES(total);
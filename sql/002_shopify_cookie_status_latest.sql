@@ -0,0 +1,30 @@
+-- ============================================================
+-- Cookie 最新状态表：每个店铺一行，供 GET /api/shopify/cookie-status 读取
+-- POST /api/shopify/cookie-status/report 在写入历史表的同一事务内 upsert 本表。
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS shopify_cookie_status_latest (
+    store_id    VARCHAR(64)  NOT NULL,
+    is_valid    TINYINT(1)   NOT NULL,
+    checked_at  DATETIME     NOT NULL,
+    checker     VARCHAR(50)  NOT NULL DEFAULT '',
+    detail      VARCHAR(500) NOT NULL DEFAULT '',
+    PRIMARY KEY (store_id),
+    INDEX idx_checked_at (checked_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 从历史表回填每个店铺最新一条（可重复执行）
+INSERT INTO shopify_cookie_status_latest
+    (store_id, is_valid, checked_at, checker, detail)
+SELECT s.store_id, s.is_valid, s.checked_at, s.checker, s.detail
+FROM shopify_cookie_status s
+INNER JOIN (
+    SELECT store_id, MAX(id) AS max_id
+    FROM shopify_cookie_status
+    GROUP BY store_id
+) t ON s.store_id = t.store_id AND s.id = t.max_id
+ON DUPLICATE KEY UPDATE
+    is_valid   = VALUES(is_valid),
+    checked_at = VALUES(checked_at),
+    checker    = VALUES(checker),
+    detail     = VALUES(detail);
@@ -0,0 +1,7 @@
+-- ============================================================
+-- 明细查询接口（/api/shopify/task-log、/api/shopify/cookie-status/history）
+-- 按筛选字段 + id 倒序做游标分页所需索引
+-- ============================================================
+
+ALTER TABLE shopify_task_log ADD INDEX idx_keer_product_id_id (keer_product_id, id);
+ALTER TABLE shopify_cookie_status ADD INDEX idx_store_id_id (store_id, id);
@@ -0,0 +1,22 @@
+-- ============================================================
+-- 任务阶段耗时明细：worker 每条任务结束后批量写入（每个阶段一行）
+-- 供 GET /api/shopify/stage-latency 计算各阶段 p50/p95/p99
+-- stage 取值见 shopify_auto_loop.stage_timer，另有 task_total 表示整条任务耗时
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS shopify_task_stage_log (
+    id               BIGINT       NOT NULL AUTO_INCREMENT,
+    task_date        DATE         NOT NULL,
+    keer_product_id  VARCHAR(64)  NOT NULL DEFAULT '',
+    worker_id        VARCHAR(100) NOT NULL DEFAULT '',
+    stage            VARCHAR(50)  NOT NULL,
+    duration_ms      INT          NOT NULL,
+    retries          INT          NOT NULL DEFAULT 0,
+    result           VARCHAR(20)  NOT NULL DEFAULT '',
+    created_at       DATETIME     NOT NULL,
+    PRIMARY KEY (id),
+    INDEX idx_task_date_stage (task_date, stage, duration_ms)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 按小时统计吞吐量所需索引
+ALTER TABLE shopify_task_log ADD INDEX idx_created_at (created_at);
@@ -0,0 +1,35 @@
+-- ============================================================
+-- worker 登记与任务租约：多个节点共享 quotation_task_detail 任务队列
+--
+-- shopify_worker      每个 worker 进程一行，心跳线程定期更新 heartbeat_at
+-- shopify_task_lease  正在处理的任务（每个 keer_product_id 一行）；
+--                     持有者心跳时续期 expires_at，任务结束后删除。
+--                     worker 崩溃后租约过期，任务重新回到待领取队列。
+-- 查询见 GET /api/shopify/workers
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS shopify_worker (
+    worker_id     VARCHAR(100) NOT NULL,
+    hostname      VARCHAR(100) NOT NULL DEFAULT '',
+    pid           INT          NOT NULL DEFAULT 0,
+    stores        VARCHAR(500) NOT NULL DEFAULT '',
+    status        VARCHAR(20)  NOT NULL DEFAULT 'running',
+    tasks_done    INT          NOT NULL DEFAULT 0,
+    started_at    DATETIME     NOT NULL,
+    heartbeat_at  DATETIME     NOT NULL,
+    PRIMARY KEY (worker_id),
+    INDEX idx_heartbeat_at (heartbeat_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+CREATE TABLE IF NOT EXISTS shopify_task_lease (
+    keer_product_id  VARCHAR(64)  NOT NULL,
+    worker_id        VARCHAR(100) NOT NULL,
+    store_id         VARCHAR(64)  NOT NULL DEFAULT '',
+    stage            VARCHAR(50)  NOT NULL DEFAULT '',
+    attempts         INT          NOT NULL DEFAULT 1,
+    leased_at        DATETIME     NOT NULL,
+    expires_at       DATETIME     NOT NULL,
+    PRIMARY KEY (keer_product_id),
+    INDEX idx_worker_id (worker_id),
+    INDEX idx_expires_at (expires_at)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
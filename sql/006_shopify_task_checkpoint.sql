@@ -0,0 +1,16 @@
+-- ============================================================
+-- 任务断点：上传流水线每完成一步写入一次（每个任务一行），
+-- 重试或 worker 重启 / 接管过期租约后从最后完成的步骤继续，
+-- 避免重复创建 Shopify 导入任务、重复下载 Cookie / 获取 CSRF / 上传 GCS。
+-- step 取值与 data 字段见 shopify_auto_loop.TaskCheckpoint；任务结束（反馈成功 / 失败）后删除。
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS shopify_task_checkpoint (
+    keer_product_id  VARCHAR(64)  NOT NULL,
+    store_id         VARCHAR(64)  NOT NULL DEFAULT '',
+    worker_id        VARCHAR(100) NOT NULL DEFAULT '',
+    step             VARCHAR(50)  NOT NULL,
+    data             MEDIUMTEXT   NOT NULL,
+    updated_at       DATETIME     NOT NULL,
+    PRIMARY KEY (keer_product_id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
@@ -0,0 +1,10 @@
+-- ============================================================
+-- 任务轮询（shopify_auto_loop.TaskPoller）所需索引
+-- 完整扫描:  task_status = ? AND created_at >= 3天前 ORDER BY created_at DESC, id DESC
+-- 增量扫描:  task_status = ? AND (created_at, id) > 水位 ORDER BY created_at, id
+-- task_status 等值 + created_at / id 有序范围扫描，shopfiy_task 条件在索引内过滤
+-- （索引条件下推），只有候选行回表读取 URL / 图片 / 报价字段。
+-- ============================================================
+
+ALTER TABLE quotation_task_detail
+    ADD INDEX idx_shopify_task_poll (task_status, created_at, id, shopfiy_task);
@@ -0,0 +1,29 @@
+-- ============================================================
+-- 新任务信号：quotation_task_detail 的任务进入“报价单创建完毕”时，触发器递增
+-- shopify_task_signal 的版本号（单行）。api_server 在有 worker 长轮询等待时按主键
+-- 读取该版本号，变化即唤醒 worker（GET /api/shopify/tasks/wait），worker 不再空轮询任务表。
+-- 触发器在报价事务内执行，版本号随事务提交才可见，worker 被唤醒时任务行已提交。
+-- 版本号单行更新会在报价事务间短暂串行，任务写入频率（每分钟数十条）下可以忽略。
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS shopify_task_signal (
+    id          INT      NOT NULL,
+    version     BIGINT   NOT NULL DEFAULT 0,
+    updated_at  DATETIME NOT NULL,
+    PRIMARY KEY (id)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+INSERT IGNORE INTO shopify_task_signal (id, version, updated_at) VALUES (1, 0, NOW());
+
+CREATE TRIGGER trg_quotation_task_ready_insert
+AFTER INSERT ON quotation_task_detail
+FOR EACH ROW
+    UPDATE shopify_task_signal SET version = version + 1, updated_at = NOW()
+    WHERE id = 1 AND NEW.task_status = '报价单创建完毕';
+
+CREATE TRIGGER trg_quotation_task_ready_update
+AFTER UPDATE ON quotation_task_detail
+FOR EACH ROW
+    UPDATE shopify_task_signal SET version = version + 1, updated_at = NOW()
+    WHERE id = 1 AND NEW.task_status = '报价单创建完毕'
+      AND NOT (OLD.task_status <=> NEW.task_status);
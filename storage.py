@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+api_server.py 的存储层
+
+  MySQLStorage   生产环境：带上限与健康检查的 PyMySQL 连接池
+  SQLiteStorage  本地替身：单文件 SQLite，用于压测 / 离线调试（见 load_test_api.py）
+
+两种实现对外提供相同的连接接口：cursor() 接受 PyMySQL 风格的 %s 占位符，
+返回 dict 行；方言差异（upsert、按小时截断时间、数据库当前时间）通过 upsert_clause / hour_bucket / now_before 生成。
+"""
+
+import queue
+import re
+import sqlite3
+import threading
+import time
+
+import pymysql
+
+
+POOL_MAX_SIZE        = 10    # 连接池最大连接数
+POOL_ACQUIRE_TIMEOUT = 10    # 等待空闲连接的最长秒数
+POOL_PING_IDLE_SECS  = 30    # 空闲超过该秒数的连接在复用前先 ping 检查
+
+
+# ============================================================
+# MySQL
+# ============================================================
+
+class _PooledConnection:
+    """连接代理：close() 时归还连接池而不是真正断开"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+
+class ConnectionPool:
+    """有上限的 PyMySQL 连接池，复用前对长时间空闲的连接做健康检查"""
+
+    def __init__(self, config: dict, max_size: int = POOL_MAX_SIZE):
+        self.config = config
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = queue.LifoQueue()   # (conn, last_used)
+
+    def _connect(self):
+        return pymysql.connect(**self.config, cursorclass=pymysql.cursors.DictCursor)
+
+    def acquire(self, timeout: float = POOL_ACQUIRE_TIMEOUT) -> _PooledConnection:
+        if not self._slots.acquire(timeout=timeout):
+            raise RuntimeError(f"数据库连接池已耗尽（等待 {timeout} 秒）")
+        try:
+            while True:
+                try:
+                    conn, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    conn = self._connect()
+                    break
+                if time.time() - last_used < POOL_PING_IDLE_SECS:
+                    break
+                try:
+                    conn.ping(reconnect=False)
+                    break
+                except Exception:
+                    self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+        return _PooledConnection(self, conn)
+
+    def release(self, conn):
+        try:
+            if conn.open:
+                conn.rollback()   # 丢弃未提交的事务状态
+                self._idle.put((conn, time.time()))
+            else:
+                self._discard(conn)
+        except Exception:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    @staticmethod
+    def _discard(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+
+class MySQLStorage:
+    name = "mysql"
+
+    def __init__(self, config: dict, pool_size: int = POOL_MAX_SIZE):
+        self.config = config
+        self._pool = ConnectionPool(config, pool_size)
+
+    def get_conn(self):
+        return self._pool.acquire()
+
+    def stream_conn(self):
+        """服务端游标连接（逐行读取大结果集），不占用连接池"""
+        return pymysql.connect(**self.config, cursorclass=pymysql.cursors.SSDictCursor)
+
+    @staticmethod
+    def upsert_clause(keys: list, columns: list) -> str:
+        sets = ", ".join(f"{c} = VALUES({c})" for c in columns)
+        return f"ON DUPLICATE KEY UPDATE {sets}"
+
+    @staticmethod
+    def hour_bucket(column: str) -> str:
+        return f"DATE_FORMAT({column}, '%%Y-%%m-%%d %%H:00')"
+
+    @staticmethod
+    def now_before(seconds: int = 0) -> str:
+        """数据库当前时间（减去 seconds 秒），与 worker 写入心跳 / 租约时用的 NOW() 同一时钟"""
+        return f"DATE_SUB(NOW(), INTERVAL {int(seconds)} SECOND)" if seconds else "NOW()"
+
+
+# ============================================================
+# SQLite
+# ============================================================
+
+_PLACEHOLDER_RE = re.compile(r"%(s|%)")
+
+
+def _to_sqlite_sql(sql: str) -> str:
+    """%s → ?，%% → %"""
+    return _PLACEHOLDER_RE.sub(lambda m: "?" if m.group(1) == "s" else "%", sql)
+
+
+class _SQLiteCursor:
+    def __init__(self, conn: sqlite3.Connection):
+        self._cursor = conn.cursor()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    @staticmethod
+    def _row(row):
+        return dict(row) if row is not None else None
+
+    def execute(self, sql: str, params=()):
+        self._cursor.execute(_to_sqlite_sql(sql), tuple(params or ()))
+        return self._cursor.rowcount
+
+    def executemany(self, sql: str, seq):
+        self._cursor.executemany(_to_sqlite_sql(sql), [tuple(p) for p in seq])
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchall(self):
+        return [dict(r) for r in self._cursor.fetchall()]
+
+    def __iter__(self):
+        for row in self._cursor:
+            yield dict(row)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+
+class _SQLiteConnection:
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+
+    def cursor(self):
+        return _SQLiteCursor(self._conn)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS shopify_task_log (
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_date        TEXT NOT NULL,
+    keer_product_id  TEXT NOT NULL DEFAULT '',
+    result           TEXT NOT NULL,
+    detail           TEXT NOT NULL DEFAULT '',
+    created_at       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_task_log_date_result ON shopify_task_log (task_date, result);
+CREATE INDEX IF NOT EXISTS idx_task_log_keer_id ON shopify_task_log (keer_product_id, id);
+CREATE INDEX IF NOT EXISTS idx_task_log_created_at ON shopify_task_log (created_at);
+
+CREATE TABLE IF NOT EXISTS shopify_task_log_daily (
+    task_date  TEXT    NOT NULL,
+    result     TEXT    NOT NULL,
+    total      INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (task_date, result)
+);
+
+CREATE TABLE IF NOT EXISTS shopify_cookie_status (
+    id          INTEGER PRIMARY KEY AUTOINCREMENT,
+    store_id    TEXT    NOT NULL,
+    is_valid    INTEGER NOT NULL,
+    checked_at  TEXT    NOT NULL,
+    checker     TEXT    NOT NULL DEFAULT '',
+    detail      TEXT    NOT NULL DEFAULT ''
+);
+CREATE INDEX IF NOT EXISTS idx_cookie_status_store ON shopify_cookie_status (store_id, id);
+
+CREATE TABLE IF NOT EXISTS shopify_cookie_status_latest (
+    store_id    TEXT    PRIMARY KEY,
+    is_valid    INTEGER NOT NULL,
+    checked_at  TEXT    NOT NULL,
+    checker     TEXT    NOT NULL DEFAULT '',
+    detail      TEXT    NOT NULL DEFAULT ''
+);
+
+CREATE TABLE IF NOT EXISTS shopify_task_stage_log (
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_date        TEXT    NOT NULL,
+    keer_product_id  TEXT    NOT NULL DEFAULT '',
+    worker_id        TEXT    NOT NULL DEFAULT '',
+    stage            TEXT    NOT NULL,
+    duration_ms      INTEGER NOT NULL,
+    retries          INTEGER NOT NULL DEFAULT 0,
+    result           TEXT    NOT NULL DEFAULT '',
+    created_at       TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_stage_log_date_stage ON shopify_task_stage_log (task_date, stage, duration_ms);
+
+CREATE TABLE IF NOT EXISTS shopify_worker (
+    worker_id     TEXT    PRIMARY KEY,
+    hostname      TEXT    NOT NULL DEFAULT '',
+    pid           INTEGER NOT NULL DEFAULT 0,
+    stores        TEXT    NOT NULL DEFAULT '',
+    status        TEXT    NOT NULL DEFAULT 'running',
+    tasks_done    INTEGER NOT NULL DEFAULT 0,
+    started_at    TEXT    NOT NULL,
+    heartbeat_at  TEXT    NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS shopify_task_lease (
+    keer_product_id  TEXT    PRIMARY KEY,
+    worker_id        TEXT    NOT NULL,
+    store_id         TEXT    NOT NULL DEFAULT '',
+    stage            TEXT    NOT NULL DEFAULT '',
+    attempts         INTEGER NOT NULL DEFAULT 1,
+    leased_at        TEXT    NOT NULL,
+    expires_at       TEXT    NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_task_lease_worker ON shopify_task_lease (worker_id);
+
+CREATE TABLE IF NOT EXISTS shopify_task_signal (
+    id          INTEGER PRIMARY KEY,
+    version     INTEGER NOT NULL DEFAULT 0,
+    updated_at  TEXT    NOT NULL
+);
+INSERT OR IGNORE INTO shopify_task_signal (id, version, updated_at) VALUES (1, 0, datetime('now'));
+"""
+
+
+class SQLiteStorage:
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        self.path = path
+        conn = _SQLiteConnection(path)
+        try:
+            conn._conn.executescript(SQLITE_SCHEMA)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def get_conn(self):
+        return _SQLiteConnection(self.path)
+
+    def stream_conn(self):
+        return _SQLiteConnection(self.path)
+
+    @staticmethod
+    def upsert_clause(keys: list, columns: list) -> str:
+        sets = ", ".join(f"{c} = excluded.{c}" for c in columns)
+        return f"ON CONFLICT ({', '.join(keys)}) DO UPDATE SET {sets}"
+
+    @staticmethod
+    def hour_bucket(column: str) -> str:
+        return f"strftime('%%Y-%%m-%%d %%H:00', {column})"
+
+    @staticmethod
+    def now_before(seconds: int = 0) -> str:
+        return f"datetime('now', 'localtime', '-{int(seconds)} seconds')"